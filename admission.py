@@ -0,0 +1,166 @@
+"""
+Admission control in front of API key verification.
+
+Checking an API key that is not in the verified-key cache costs one scrypt
+computation (or one per legacy hash), so a client sending random X-API-Key
+values could otherwise pin the CPU. Before any hash check:
+
+- keys rejected in the last few seconds are answered from a negative cache
+  (indexed by HMAC digest, like the verified-key cache), costing no KDF
+- each client IP and each key ID prefix draws from a token bucket; an empty
+  bucket means a fast 429
+- at most ``kdf_concurrency`` hash checks run at once per process; when all
+  slots are busy the request gets a 429 instead of queueing
+
+Keys found in the verified-key cache never reach admission control.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import metrics
+from credential_cache import CredentialCache
+from key_store import split_api_key
+
+# Defaults, overridable through environment variables
+DEFAULT_IP_RATE = 1.0
+DEFAULT_IP_BURST = 10
+DEFAULT_KEY_RATE = 1.0
+DEFAULT_KEY_BURST = 5
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_NEGATIVE_SIZE = 4096
+DEFAULT_MAX_CLIENTS = 10000
+
+# Bucket shared by keys without a key ID prefix
+LEGACY_PREFIX = 'legacy'
+
+_REJECTED = 'rejected'
+
+
+class RateLimited(Exception):
+    """Raised when a request may not run a hash check right now."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Rate limited ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        """Retry-After header value (whole seconds, at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets per client key, refilled at ``rate`` tokens per second up
+    to ``burst``. Only the ``max_clients`` most recently seen keys are kept.
+    """
+
+    def __init__(self, rate, burst, max_clients=DEFAULT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """
+        Take one token from ``key``'s bucket.
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionControl:
+    """Negative cache, token buckets and the KDF concurrency cap."""
+
+    def __init__(self, ip_rate=DEFAULT_IP_RATE, ip_burst=DEFAULT_IP_BURST,
+                 key_rate=DEFAULT_KEY_RATE, key_burst=DEFAULT_KEY_BURST,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, negative_size=DEFAULT_NEGATIVE_SIZE,
+                 kdf_concurrency=None, max_clients=DEFAULT_MAX_CLIENTS, secret=None):
+        self.by_ip = TokenBucketLimiter(ip_rate, ip_burst, max_clients)
+        self.by_key = TokenBucketLimiter(key_rate, key_burst, max_clients)
+        self.rejected = CredentialCache(ttl=negative_ttl, max_size=negative_size, secret=secret)
+        self.kdf_concurrency = kdf_concurrency or os.cpu_count() or 4
+        self._kdf_slots = threading.BoundedSemaphore(self.kdf_concurrency)
+
+    def recently_rejected(self, api_key):
+        """Return True if this key failed verification within the negative TTL."""
+        if self.rejected.get(api_key) is None:
+            return False
+        metrics.ADMISSION.inc(result='negative_cache')
+        return True
+
+    def remember_rejected(self, api_key):
+        self.rejected.put(api_key, _REJECTED)
+
+    def forget_rejected(self):
+        """Drop the negative cache, e.g. after the stored keys changed."""
+        self.rejected.invalidate()
+
+    def admit(self, client_ip, api_key):
+        """
+        Charge the client IP and key prefix buckets for one hash check.
+
+        Raises:
+            RateLimited: if either bucket is empty
+        """
+        wait = self.by_ip.take(client_ip or 'unknown')
+        if wait:
+            metrics.ADMISSION.inc(result='ip_limited')
+            raise RateLimited('ip', wait)
+        key_id, _ = split_api_key(api_key)
+        wait = self.by_key.take(key_id or LEGACY_PREFIX)
+        if wait:
+            metrics.ADMISSION.inc(result='key_limited')
+            raise RateLimited('key', wait)
+
+    @contextmanager
+    def kdf_slot(self):
+        """
+        Hold one of the KDF slots for the duration of the block.
+
+        Raises:
+            RateLimited: immediately, if every slot is in use
+        """
+        if not self._kdf_slots.acquire(blocking=False):
+            metrics.ADMISSION.inc(result='kdf_busy')
+            raise RateLimited('kdf', 1.0)
+        try:
+            metrics.ADMISSION.inc(result='admitted')
+            yield
+        finally:
+            self._kdf_slots.release()
+
+
+def from_environment():
+    """Create admission control configured from ADMISSION_* environment variables."""
+    return AdmissionControl(
+        ip_rate=float(os.environ.get('ADMISSION_IP_RATE', DEFAULT_IP_RATE)),
+        ip_burst=float(os.environ.get('ADMISSION_IP_BURST', DEFAULT_IP_BURST)),
+        key_rate=float(os.environ.get('ADMISSION_KEY_RATE', DEFAULT_KEY_RATE)),
+        key_burst=float(os.environ.get('ADMISSION_KEY_BURST', DEFAULT_KEY_BURST)),
+        negative_ttl=float(os.environ.get('ADMISSION_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL)),
+        negative_size=int(os.environ.get('ADMISSION_NEGATIVE_SIZE', DEFAULT_NEGATIVE_SIZE)),
+        kdf_concurrency=int(os.environ.get('ADMISSION_KDF_CONCURRENCY', 0)) or None,
+    )
@@ -1,29 +1,59 @@
 import os
+import math
 import logging
-from flask import Flask, request, jsonify, render_template, abort, redirect, url_for, flash, session
-from werkzeug.security import check_password_hash
+from flask import Flask, request, jsonify, render_template, abort, redirect, url_for, flash, session, g, Response
 import datetime
-from sleep_controller import trigger_sleep
-from auth import requires_auth, create_api_key, get_api_keys, check_auth
-import aws_integration
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("alexa_sleep.log"),
-        logging.StreamHandler()
-    ]
-)
+import time
+from sleep_controller import trigger_sleep_coalesced, get_controller, SLEEP_COALESCE_WINDOW
+from auth import requires_auth, create_api_key, get_api_keys, verify_api_key, check_auth, use_key_store, API_KEYS_FILE
+import database
+import jobs
+import history_buffer
+import event_bus
+import metrics
+import static_assets
+import scheduler
+from admission import RateLimited
+from logging_setup import configure_logging
+
+# Configure logging (queued, rotating; LOG_LEVEL defaults to INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
 
-# Store sleep request history
-sleep_requests = []
+# Keys, sleep history and settings live in the database shared by all workers
+engine = database.init_app(app)
+key_store = database.SqlKeyStore(
+    engine,
+    recheck_interval=float(os.environ.get('API_KEYS_RECHECK_INTERVAL', 1.0)),
+    flush_interval=float(os.environ.get('LAST_USED_FLUSH_INTERVAL', database.LAST_USED_FLUSH_INTERVAL))
+)
+key_store.import_json(API_KEYS_FILE)
+use_key_store(key_store)
+
+# Recent sleep requests for the dashboard, shared by all workers
+sleep_history = history_buffer.from_environment()
+
+# Fingerprinted, precompressed static files under /assets/
+assets = static_assets.init_app(app)
+
+# HTML and JSON responses that may be answered with 304 Not Modified
+CONDITIONAL_MIMETYPES = ('text/html', 'application/json')
+
+@app.after_request
+def add_etag(response):
+    """Add an ETag to HTML/JSON GET responses and answer If-None-Match with 304."""
+    if (request.method in ('GET', 'HEAD') and response.status_code == 200
+            and response.mimetype in CONDITIONAL_MIMETYPES
+            and not response.is_streamed and 'ETag' not in response.headers):
+        response.add_etag()
+        # Pages depend on the session; let browsers keep them but always revalidate
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        response.make_conditional(request)
+    return response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -55,61 +85,259 @@ def logout():
 def index():
     """Display the admin dashboard."""
     api_keys = get_api_keys()
+    sleep_requests = sleep_history.recent(20)
+    # The page asks /events for everything after the newest record shown
+    last_event_id = sleep_requests[-1]['seq'] if sleep_requests else sleep_history.write_index - 1
     return render_template('index.html', 
                           api_keys=api_keys, 
-                          sleep_requests=sleep_requests)
+                          sleep_requests=sleep_requests,
+                          last_event_id=last_event_id)
 
-@app.route('/api/sleep', methods=['POST'])
-def api_sleep():
-    """API endpoint to trigger sleep mode."""
+def authenticate_api_request():
+    """
+    Check the API key or Basic auth credentials of the current request.
+
+    Returns:
+        tuple: (key_id, error_response); key_id is None for Basic auth and
+        error_response is None when the request is authenticated
+    """
+    g.auth_type = 'api_key' if request.headers.get('X-API-Key') else \
+        'basic' if request.authorization else 'none'
     # Option 1: API Key in header
     api_key = request.headers.get('X-API-Key')
     if api_key:
-        # Verify API key
-        api_keys = get_api_keys()
-        if any(check_password_hash(stored_key, api_key) for stored_key in api_keys):
+        # Verify API key (one hash check via the key ID prefix)
+        try:
+            key_id = verify_api_key(api_key, client_ip=request.remote_addr)
+        except RateLimited as e:
+            logger.warning(f"API key check throttled ({e.reason}) for {request.remote_addr}")
+            return None, (jsonify({"error": "リクエストが多すぎます。しばらくしてから再試行してください"}), 429,
+                          {'Retry-After': e.retry_after_header})
+        if key_id:
             # API key is valid, proceed
-            pass
-        else:
-            logger.warning(f"Sleep request with invalid API key: {api_key[:5]}...")
-            return jsonify({"error": "無効なAPIキー"}), 401
+            return key_id, None
+        logger.warning(f"API request with invalid API key: {api_key[:5]}...")
+        return None, (jsonify({"error": "無効なAPIキー"}), 401)
     
     # Option 2: Basic auth as fallback
     elif request.authorization:
         auth = request.authorization
         if not check_auth(auth.username, auth.password):
-            logger.warning("Sleep request with invalid Basic auth")
-            return jsonify({"error": "無効な認証情報"}), 401
+            logger.warning("API request with invalid Basic auth")
+            return None, (jsonify({"error": "無効な認証情報"}), 401)
+        return None, None
     else:
-        logger.warning("Sleep request received without authentication")
-        return jsonify({"error": "認証が必要です"}), 401
+        logger.warning("API request received without authentication")
+        return None, (jsonify({"error": "認証が必要です"}), 401)
+
+def authenticate_admin_request():
+    """
+    Check that the current request comes from the administrator.
+
+    Accepts the dashboard session or Basic auth with the admin credentials;
+    API keys (issued to Alexa and the agents) are not enough.
+
+    Returns:
+        tuple: (None, error_response); error_response is None when the
+        request is authenticated
+    """
+    if session.get('logged_in'):
+        g.auth_type = 'session'
+        return None, None
+    g.auth_type = 'basic' if request.authorization else \
+        'api_key' if request.headers.get('X-API-Key') else 'none'
+    if request.authorization:
+        auth = request.authorization
+        if not check_auth(auth.username, auth.password):
+            logger.warning("Admin request with invalid Basic auth")
+            return None, (jsonify({"error": "無効な認証情報"}), 401)
+        return None, None
+    if request.headers.get('X-API-Key'):
+        logger.warning(f"Admin request with an API key from {request.remote_addr}")
+        return None, (jsonify({"error": "この操作には管理者認証が必要です"}), 403)
+    logger.warning("Admin request received without authentication")
+    return None, (jsonify({"error": "認証が必要です"}), 401)
+
+def record_sleep_request(job, created, ip, user_agent, key_id, coalesced=False):
+    """Add a sleep request and the result of its (finished) job to the history."""
+    success = job.status == jobs.SUCCEEDED
+    database.record_sleep_event(created, ip, user_agent, key_id, success, job.message,
+                                coalesced=coalesced)
+    outcome = history_buffer.OUTCOME_SUCCESS if success else history_buffer.OUTCOME_FAILURE
+    if coalesced:
+        outcome |= history_buffer.OUTCOME_COALESCED
+    sleep_history.append(
+        created, ip, user_agent,
+        outcome=outcome,
+        # A request coalesced after the job finished waited for nothing
+        latency_ms=max(0.0, (job.finished - created).total_seconds() * 1000)
+    )
+    events.wake()
+
+def record_finished_job(job):
+    """Add a finished power job to the sleep request history."""
+    record_sleep_request(job, job.created, job.ip, job.user_agent, job.key_id)
+
+def record_coalesced_request(job, created, ip, user_agent, key_id):
+    """Add a request that shared an earlier request's job to the history."""
+    record_sleep_request(job, created, ip, user_agent, key_id, coalesced=True)
+
+# Probe the available sleep backends once at startup
+get_controller()
+
+# Power actions run in the background so requests return immediately
+job_executor = jobs.JobExecutor(
+    app,
+    actions={'sleep': trigger_sleep_coalesced},
+    on_finished=record_finished_job,
+    on_coalesced=record_coalesced_request,
+    coalesce_window=SLEEP_COALESCE_WINDOW
+)
+
+# Live dashboard updates: one watcher per process feeds every open stream
+events = event_bus.from_environment(sleep_history, load_jobs=job_executor.changed_since)
+
+# Metrics are merged across workers through snapshot files in METRICS_DIR
+metrics.JOB_QUEUE_DEPTH.set_function(lambda: job_executor.queue_depth)
+metrics.EVENT_STREAMS.set_function(lambda: events.subscribers)
+metrics.REGISTRY.enable_multiprocess(os.environ.get('METRICS_DIR', 'metrics_data'))
+
+@app.route('/api/sleep', methods=['POST'])
+def api_sleep():
+    """API endpoint to trigger sleep mode. Returns 202 with a job ID."""
+    key_id, error = authenticate_api_request()
+    if error:
+        metrics.REQUESTS.inc(auth=g.auth_type, outcome='throttled' if error[1] == 429 else 'rejected')
+        return error
     
     # Log the request details
-    timestamp = datetime.datetime.now()
     client_ip = request.remote_addr
     user_agent = request.headers.get('User-Agent', 'Unknown')
     
     logger.info(f"Sleep request accepted from {client_ip} with user agent: {user_agent}")
     
-    # Add to request history
-    sleep_requests.append({
-        'timestamp': timestamp,
-        'ip': client_ip,
-        'user_agent': user_agent
-    })
+    # Queue the sleep action
+    try:
+        job_id = job_executor.submit('sleep', ip=client_ip, user_agent=user_agent, key_id=key_id)
+    except Exception as e:
+        logger.exception("Failed to queue sleep job")
+        metrics.REQUESTS.inc(auth=g.auth_type, outcome='error')
+        return jsonify({"status": "エラー", "message": f"スリープジョブの登録に失敗しました: {str(e)}"}), 500
     
-    # Limit history to last 20 entries
-    if len(sleep_requests) > 20:
-        sleep_requests.pop(0)
-    
-    # Trigger sleep
-    success, message = trigger_sleep()
+    metrics.REQUESTS.inc(auth=g.auth_type, outcome='accepted')
+    status_url = url_for('get_job', job_id=job_id)
+    return jsonify({
+        "status": "受付済み",
+        "message": "スリープコマンドを受け付けました",
+        "job_id": job_id,
+        "status_url": status_url
+    }), 202, {'Location': status_url}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Return the status and result of a power job."""
+    _, error = authenticate_api_request()
+    if error:
+        return error
     
-    if success:
-        return jsonify({"status": "成功", "message": message}), 200
-    else:
-        logger.error(f"Failed to trigger sleep: {message}")
-        return jsonify({"status": "エラー", "message": message}), 500
+    job = job_executor.get(job_id)
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(jobs.job_to_dict(job)), 200
+
+def event_cursor():
+    """Stream position from Last-Event-ID or ?after= (the last sleep record seen)."""
+    value = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        return events.cursor(int(value))
+    except (TypeError, ValueError):
+        return events.cursor()
+
+# Seconds /events/poll waits for new events (?wait=), and the most it may wait
+POLL_WAIT_DEFAULT = 25.0
+POLL_WAIT_MAX = 60.0
+
+def poll_wait():
+    """The ?wait= of a long poll in seconds, clamped to 0..POLL_WAIT_MAX."""
+    try:
+        wait = float(request.args.get('wait', POLL_WAIT_DEFAULT))
+    except (TypeError, ValueError):
+        return POLL_WAIT_DEFAULT
+    if math.isnan(wait):
+        return POLL_WAIT_DEFAULT
+    return min(max(wait, 0.0), POLL_WAIT_MAX)
+
+@app.route('/events')
+def event_stream():
+    """Server-Sent Events stream of new sleep records and job status changes."""
+    if not session.get('logged_in'):
+        return jsonify({"error": "認証が必要です"}), 401
+    # Each stream holds a server thread; past the limit the page long-polls
+    if not events.subscribe():
+        return jsonify({"error": "ストリームが多すぎます"}), 503, {'Retry-After': '30'}
+    cursor = event_cursor()
+
+    def stream():
+        yield b'retry: 3000\n\n'
+        for event in cursor.start():
+            yield event.frame
+        # End after a while so the thread is freed; EventSource reconnects
+        deadline = time.monotonic() + events.stream_seconds
+        while time.monotonic() < deadline:
+            pending, complete = events.wait(cursor.version, events.heartbeat)
+            if not pending:
+                yield b': keep-alive\n\n'
+            for event in cursor.take(pending, complete):
+                yield event.frame
+
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(events.unsubscribe)
+    return response
+
+@app.route('/events/poll')
+def event_poll():
+    """Long-poll fallback for /events: waits up to ?wait= seconds for new events."""
+    if not session.get('logged_in'):
+        return jsonify({"error": "認証が必要です"}), 401
+
+    cursor = event_cursor()
+    pending = cursor.missed()
+    wait = poll_wait()
+    if not pending and wait > 0 and events.subscribe():
+        try:
+            pending = cursor.take(*events.wait(cursor.version, wait))
+        finally:
+            events.unsubscribe()
+    return jsonify({
+        "last_id": cursor.last_seq,
+        "events": [{"event": e.kind, "id": e.id, "data": e.data} for e in pending],
+    }), 200, {'Cache-Control': 'no-store'}
+
+# Controller mode: host registry and group sleep endpoints
+if os.environ.get('APP_ROLE') == 'controller':
+    import controller
+    group_sleeper = controller.init_app(app, authenticate_api_request, authenticate_admin_request)
+
+def run_scheduled_action(schedule):
+    """Run a due schedule: sleep its host group, or queue a job on this PC."""
+    if schedule.target:
+        if os.environ.get('APP_ROLE') != 'controller':
+            raise RuntimeError("ホストグループへのスケジュールはコントローラーモードでのみ実行できます")
+        hosts = [controller.host_to_dict(host, include_key=True)
+                 for host in controller.hosts_in_group(schedule.target)]
+        if not hosts:
+            raise RuntimeError(f"グループ {schedule.target} にホストが登録されていません")
+        succeeded = sum(result['ok'] for result in group_sleeper.sleep_hosts(hosts))
+        return f"{succeeded}/{len(hosts)} 台のホストがスリープを受け付けました"
+    job_id = job_executor.submit(schedule.action, user_agent=f"schedule {schedule.id}",
+                                 key_id=schedule.key_id)
+    return f"ジョブ {job_id} を開始しました"
+
+# Delayed and recurring power actions, run by one leader process
+schedules = scheduler.init_app(app, authenticate_api_request, run_scheduled_action,
+                               actions=job_executor.actions,
+                               allow_targets=os.environ.get('APP_ROLE') == 'controller')
 
 @app.route('/generate-api-key', methods=['POST'])
 @requires_auth
@@ -153,6 +381,9 @@ def setup_aws_lambda():
         if public_endpoint.endswith('/'):
             public_endpoint = public_endpoint[:-1]
             
+        # The AWS integration is only needed here; load it on first use
+        import aws_integration
+
         try:
             # Lambda関数を作成
             lambda_info = aws_integration.create_lambda_function(
@@ -187,10 +418,27 @@ def setup_aws_lambda():
     # GETリクエストの場合、AWSセットアップフォームを表示
     return render_template('aws_lambda_setup.html', api_key=session['new_api_key'])
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, merged across all server workers."""
+    return Response(metrics.REGISTRY.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+# (second, body) of the last rendered status page
+_status_page = None
+
+def status_page():
+    """The status page, rendered at most once per second (its clock has one-second resolution)."""
+    global _status_page
+    now = datetime.datetime.now().replace(microsecond=0)
+    page = _status_page
+    if page is None or page[0] != now:
+        page = _status_page = (now, app.jinja_env.get_template('status.html').render(uptime=now))
+    return page[1]
+
 @app.route('/status')
 def status():
     """Simple status endpoint to verify the service is running."""
-    return render_template('status.html', uptime=datetime.datetime.now())
+    return status_page()
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -201,4 +449,5 @@ def server_error(e):
     return jsonify({"error": "サーバーエラー"}), 500
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=True)
+    # Development server only; use serve.py (or main.py) in production
+    app.run(host="0.0.0.0", debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,432 @@
+"""
+Asyncio-native (ASGI) entry point.
+
+Serves the API endpoints directly on the event loop:
+
+- POST /api/sleep      (API key / Basic auth, queues a power job, 202)
+- GET  /api/jobs/<id>  (job status)
+- GET  /status
+- GET  /metrics
+- GET  /events         (live dashboard SSE stream; an open stream costs no
+                        thread, only a listener on the event bus)
+
+API key hashing runs in a bounded thread pool (ASGI_KDF_THREADS) and power
+backend commands are awaited with asyncio.create_subprocess_exec, so one
+process can hold thousands of idle keep-alive connections. Every other path
+(login, dashboard, key generation, AWS setup) is passed to the Flask app
+through a WSGI bridge running on a separate thread pool (ASGI_WSGI_THREADS).
+
+Run with any ASGI server, e.g.:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+or:
+    python asgi.py --port 5000
+"""
+import io
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+import binascii
+import functools
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.http import parse_etags
+
+import app as flask_module
+import auth
+import jobs
+import metrics
+from admission import RateLimited
+from sleep_controller import trigger_sleep_async, trigger_sleep_coalesced
+
+logger = logging.getLogger(__name__)
+
+flask_app = flask_module.app
+
+JOB_PATH = re.compile(r'^/api/jobs/([0-9a-f]{32})$')
+
+# Upper bound on request bodies read for the Flask bridge (bytes)
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the native handlers need."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+
+    def basic_auth(self):
+        """Return (username, password) from a Basic Authorization header, or None."""
+        header = self.headers.get('authorization', '')
+        scheme, _, token = header.partition(' ')
+        if scheme.lower() != 'basic' or not token:
+            return None
+        try:
+            username, _, password = b64decode(token).decode('utf-8').partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        return username, password
+
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response_headers = [
+        (b'content-type', content_type.encode('latin-1')),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ]
+    response_headers += [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class SleepASGIApp:
+    """ASGI application: native API endpoints plus the Flask app for everything else."""
+
+    def __init__(self, wsgi_app, kdf_threads=None, wsgi_threads=32):
+        self.wsgi_app = wsgi_app
+        self.kdf_pool = ThreadPoolExecutor(max_workers=kdf_threads or auth.admission_control.kdf_concurrency,
+                                           thread_name_prefix='asgi-kdf')
+        self.wsgi_pool = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='asgi-wsgi')
+        self.loop = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    # Lifespan -------------------------------------------------------------
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        self.loop = asyncio.get_running_loop()
+        # Power jobs still run one at a time on the job thread, but the backend
+        # itself is awaited on the event loop (subprocesses without blocking)
+        flask_module.job_executor.actions['sleep'] = functools.partial(
+            trigger_sleep_coalesced, self._trigger_on_loop
+        )
+
+    def _trigger_on_loop(self):
+        return asyncio.run_coroutine_threadsafe(trigger_sleep_async(), self.loop).result()
+
+    def shutdown(self):
+        self.kdf_pool.shutdown(wait=False)
+        self.wsgi_pool.shutdown(wait=True)
+
+    # Routing --------------------------------------------------------------
+
+    async def http(self, scope, receive, send):
+        path, method = scope['path'], scope['method']
+        if path == '/api/sleep' and method == 'POST':
+            await self.api_sleep(Request(scope), send)
+        elif JOB_PATH.match(path) and method == 'GET':
+            await self.get_job(Request(scope), JOB_PATH.match(path).group(1), send)
+        elif path == '/status' and method in ('GET', 'HEAD'):
+            await self.status(Request(scope), send)
+        elif path == '/events' and method == 'GET':
+            await self.events(scope, receive, send)
+        elif path == '/metrics' and method == 'GET':
+            body = await self.loop.run_in_executor(self.wsgi_pool, metrics.REGISTRY.render)
+            await send_response(send, 200, body, metrics.CONTENT_TYPE)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    # Native handlers ------------------------------------------------------
+
+    async def authenticate(self, request):
+        """
+        Async counterpart of app.authenticate_api_request().
+
+        Returns:
+            tuple: (auth_type, key_id, error) where error is the arguments of
+            send_response() after ``send`` (status, body, ...) or None
+        """
+        api_key = request.headers.get('x-api-key')
+        if api_key:
+            try:
+                # Cache lookups and rate limits run on the loop; only the hash
+                # check goes to the pool, after a KDF slot has been taken
+                done, key_id = auth.screen_api_key(api_key, request.remote_addr)
+                if not done:
+                    with auth.admission_control.kdf_slot():
+                        key_id = await self.loop.run_in_executor(
+                            self.kdf_pool, auth.verify_stored_api_key, api_key)
+            except RateLimited as e:
+                logger.warning(f"API key check throttled ({e.reason}) for {request.remote_addr}")
+                return 'api_key', None, (429, {"error": "リクエストが多すぎます。しばらくしてから再試行してください"},
+                                         'application/json', [('retry-after', e.retry_after_header)])
+            if key_id:
+                return 'api_key', key_id, None
+            logger.warning(f"API request with invalid API key: {api_key[:5]}...")
+            return 'api_key', None, (401, {"error": "無効なAPIキー"})
+
+        credentials = request.basic_auth()
+        if credentials:
+            if not auth.check_auth(*credentials):
+                logger.warning("API request with invalid Basic auth")
+                return 'basic', None, (401, {"error": "無効な認証情報"})
+            return 'basic', None, None
+
+        logger.warning("API request received without authentication")
+        return 'none', None, (401, {"error": "認証が必要です"})
+
+    async def api_sleep(self, request, send):
+        auth_type, key_id, error = await self.authenticate(request)
+        if error:
+            metrics.REQUESTS.inc(auth=auth_type, outcome='throttled' if error[0] == 429 else 'rejected')
+            await send_response(send, *error)
+            return
+
+        user_agent = request.headers.get('user-agent', 'Unknown')
+        logger.info(f"Sleep request accepted from {request.remote_addr} with user agent: {user_agent}")
+
+        def submit():
+            with flask_app.app_context():
+                return flask_module.job_executor.submit(
+                    'sleep', ip=request.remote_addr, user_agent=user_agent, key_id=key_id
+                )
+
+        try:
+            job_id = await self.loop.run_in_executor(self.wsgi_pool, submit)
+        except Exception as e:
+            logger.exception("Failed to queue sleep job")
+            metrics.REQUESTS.inc(auth=auth_type, outcome='error')
+            await send_response(send, 500, {"status": "エラー", "message": f"スリープジョブの登録に失敗しました: {str(e)}"})
+            return
+
+        metrics.REQUESTS.inc(auth=auth_type, outcome='accepted')
+        status_url = f"{request.scope.get('root_path', '')}/api/jobs/{job_id}"
+        await send_response(send, 202, {
+            "status": "受付済み",
+            "message": "スリープコマンドを受け付けました",
+            "job_id": job_id,
+            "status_url": status_url
+        }, headers=[('location', status_url)])
+
+    async def get_job(self, request, job_id, send):
+        _, _, error = await self.authenticate(request)
+        if error:
+            await send_response(send, *error)
+            return
+
+        def load():
+            with flask_app.app_context():
+                job = flask_module.job_executor.get(job_id)
+                return jobs.job_to_dict(job) if job else None
+
+        job = await self.loop.run_in_executor(self.wsgi_pool, load)
+        if job is None:
+            await send_response(send, 404, {"error": "ジョブが見つかりません"})
+        else:
+            await send_response(send, 200, job)
+
+    async def status(self, request, send):
+        body = flask_module.status_page().encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': [(b'etag', f'"{etag}"'.encode())]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send_response(send, 200, body, 'text/html; charset=utf-8',
+                            headers=[('etag', f'"{etag}"'), ('cache-control', 'no-cache')])
+
+    async def events(self, scope, receive, send):
+        """Native counterpart of app.event_stream(), waiting on the loop instead of a thread."""
+        request = flask_app.request_class(build_environ(scope, b''))
+        session = flask_app.session_interface.open_session(flask_app, request)
+        if not (session and session.get('logged_in')):
+            await send_response(send, 401, {"error": "認証が必要です"})
+            return
+
+        bus = flask_module.events
+        value = request.headers.get('Last-Event-ID') or request.args.get('after')
+        cursor = bus.cursor(int(value) if value and value.isdigit() else None)
+        wake = asyncio.Event()
+
+        def listener():
+            self.loop.call_soon_threadsafe(wake.set)
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        bus.subscribe(listener, blocking=False)
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            frames = [b'retry: 3000\n\n'] + [event.frame for event in cursor.start()]
+            await send({'type': 'http.response.body', 'body': b''.join(frames), 'more_body': True})
+            while not disconnected.done():
+                woken = asyncio.ensure_future(wake.wait())
+                await asyncio.wait({woken, disconnected}, timeout=bus.heartbeat,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if disconnected.done():
+                    break
+                wake.clear()
+                frames = [event.frame for event in cursor.take(*bus.events_after(cursor.version))]
+                await send({'type': 'http.response.body', 'body': b''.join(frames) or b': keep-alive\n\n',
+                            'more_body': True})
+        finally:
+            bus.unsubscribe(listener, blocking=False)
+            disconnected.cancel()
+
+    # WSGI bridge ----------------------------------------------------------
+
+    async def wsgi(self, scope, receive, send):
+        """Run the Flask app for this request on the bridge thread pool, streaming its output."""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_SIZE:
+                await send_response(send, 413, {"error": "リクエストが大きすぎます"})
+                return
+            if not message.get('more_body'):
+                break
+
+        environ = build_environ(scope, bytes(body))
+        queue = asyncio.Queue()
+        disconnected = False
+
+        def put(item):
+            self.loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def run():
+            def start_response(status, headers, exc_info=None):
+                put(('start', status, headers))
+                return lambda data: put(('body', data))
+
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if disconnected:
+                            break
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+                put(('end',))
+            except BaseException as e:
+                put(('error', e))
+
+        self.loop.run_in_executor(self.wsgi_pool, run)
+
+        started = False
+        try:
+            while True:
+                item = await queue.get()
+                kind = item[0]
+                if kind == 'start':
+                    status, headers = item[1], item[2]
+                    await send({
+                        'type': 'http.response.start',
+                        'status': int(status.split(' ', 1)[0]),
+                        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+                    })
+                    started = True
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+                elif kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                else:
+                    logger.error("Error in Flask app behind ASGI bridge", exc_info=item[1])
+                    if not started:
+                        await send_response(send, 500, {"error": "サーバーエラー"})
+                    return
+        except (OSError, asyncio.CancelledError):
+            disconnected = True
+            raise
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ dict from an ASGI HTTP scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            continue
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+application = SleepASGIApp(
+    flask_app,
+    kdf_threads=int(os.environ.get('ASGI_KDF_THREADS', 0)) or None,
+    wsgi_threads=int(os.environ.get('ASGI_WSGI_THREADS', 32))
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Alexa Sleep service with an ASGI server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is required for ASGI mode: pip install uvicorn")
+    uvicorn.run(application, host=args.host, port=args.port, backlog=4096, log_config=None)
+
+
+if __name__ == '__main__':
+    main()
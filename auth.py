@@ -5,16 +5,39 @@ import logging
 from functools import wraps
 from flask import request, Response, session, redirect, url_for, flash
 from werkzeug.security import generate_password_hash, check_password_hash
+from key_store import ApiKeyStore, KEY_ID_SEPARATOR
+import credential_cache
+import admission
+import metrics
 
 logger = logging.getLogger(__name__)
 
 # Path to store API keys
-API_KEYS_FILE = 'api_keys.json'
+API_KEYS_FILE = os.environ.get('API_KEYS_FILE', 'api_keys.json')
 
 # Default admin credentials - should be changed in production
 DEFAULT_USERNAME = 'admin'
 DEFAULT_PASSWORD = 'admin'
 
+# Recently verified API keys, so repeat callers skip the hash check
+verified_keys = credential_cache.from_environment()
+
+# Rate limits and negative cache for keys that would need a hash check
+admission_control = admission.from_environment()
+
+def keys_changed():
+    """Forget cached verification results after the stored keys changed."""
+    verified_keys.invalidate()
+    admission_control.forget_rejected()
+
+# In-memory view of the stored keys, reloaded only when the storage changes.
+# The app replaces this with a database-backed store at startup.
+key_store = ApiKeyStore(
+    API_KEYS_FILE,
+    recheck_interval=float(os.environ.get('API_KEYS_RECHECK_INTERVAL', 1.0)),
+    on_reload=keys_changed
+)
+
 def requires_auth(f):
     """Decorator for routes that require authentication."""
     @wraps(f)
@@ -45,40 +68,123 @@ def authenticate():
         {'WWW-Authenticate': 'Basic realm="Login Required"'}
     )
 
+def use_key_store(store):
+    """Switch API key storage to another key store (e.g. database.SqlKeyStore)."""
+    global key_store
+    store.on_reload = keys_changed
+    key_store = store
+    keys_changed()
+
 def get_api_keys():
-    """Retrieve stored API keys."""
+    """Retrieve stored API key hashes."""
     try:
-        if not os.path.exists(API_KEYS_FILE):
-            # Create initial API key if none exists
-            keys = []
-            with open(API_KEYS_FILE, 'w') as f:
-                json.dump(keys, f)
-            return keys
-        
-        with open(API_KEYS_FILE, 'r') as f:
-            return json.load(f)
+        return key_store.hashes()
     except Exception as e:
         logger.error(f"Error retrieving API keys: {e}")
         return []
 
-def create_api_key():
-    """Generate a new API key and store the hash."""
+def verify_api_key(api_key, client_ip=None):
+    """
+    Verify an API key against the stored hashes.
+
+    Keys that need a hash check first pass admission control (negative
+    cache, per-IP and per-key-prefix token buckets, KDF concurrency cap).
+
+    Returns:
+        str: the key ID of the matching key ("legacy" for keys issued before
+        key IDs existed), or None if the key is not valid
+
+    Raises:
+        admission.RateLimited: if the key may not be checked right now
+    """
+    done, key_id = screen_api_key(api_key, client_ip)
+    if done:
+        return key_id
+    with admission_control.kdf_slot():
+        return verify_stored_api_key(api_key)
+
+def screen_api_key(api_key, client_ip=None):
+    """
+    Answer an API key check without any hash computation where possible.
+
+    Returns:
+        tuple: (done, key_id); done is True for recently verified keys and
+        for recently rejected keys (key_id None). Otherwise the caller must
+        run verify_stored_api_key() inside admission_control.kdf_slot().
+
+    Raises:
+        admission.RateLimited: if the client or key prefix is over its limit
+    """
+    key_id = lookup_cached_api_key(api_key)
+    if key_id is not None:
+        return True, key_id
+    if admission_control.recently_rejected(api_key):
+        return True, None
+    admission_control.admit(client_ip, api_key)
+    return False, None
+
+def verify_stored_api_key(api_key):
+    """Check an API key against the key store (the hash check) and cache the result."""
+    metrics.API_KEY_CACHE.inc(result='miss')
     try:
-        # Generate a random API key
-        api_key = str(uuid.uuid4())
+        key_id = key_store.verify(api_key)
+    except Exception as e:
+        logger.error(f"Error verifying API key: {e}")
+        return None
+    if key_id is None:
+        admission_control.remember_rejected(api_key)
+        return None
+    verified_keys.put(api_key, key_id)
+    key_store.touch(key_id)
+    return key_id
+
+def lookup_cached_api_key(api_key):
+    """
+    Return the key ID of a recently verified API key without any hash check.
+
+    Checks the key store for changes first (at most once per recheck
+    interval), so a key revoked by another worker stops matching.
+
+    Returns None on a cache miss.
+    """
+    try:
+        key_store.refresh()
+    except Exception as e:
+        # Storage unreadable: only the hash check path can decide
+        logger.error(f"Error checking API keys for changes: {e}")
+        return None
+    key_id = verified_keys.get(api_key)
+    if key_id is not None:
+        metrics.API_KEY_CACHE.inc(result='hit')
+        key_store.touch(key_id)
+    return key_id
+
+def create_api_key():
+    """Generate a new API key and store the hash under its key ID."""
+    def add_key(store):
+        # Generate a random API key with a public key ID prefix
+        key_id = store.new_key_id()
+        api_key = f"{key_id}{KEY_ID_SEPARATOR}{uuid.uuid4()}"
         
         # Hash the key for storage
-        hashed_key = generate_password_hash(api_key)
-        
-        # Store the hash
-        keys = get_api_keys()
-        keys.append(hashed_key)
-        
-        with open(API_KEYS_FILE, 'w') as f:
-            json.dump(keys, f)
-        
-        logger.info(f"New API key generated: {api_key[:5]}...")
+        store.add(key_id, generate_password_hash(api_key))
+        return key_id, api_key
+
+    try:
+        key_id, api_key = key_store.update(add_key)
+        logger.info(f"New API key generated: {key_id}")
         return api_key
     except Exception as e:
         logger.error(f"Error creating API key: {e}")
         return None
+
+def revoke_api_key(key_id):
+    """Revoke the API key with the given key ID. Returns True if it existed."""
+    try:
+        revoked = key_store.update(lambda store: store.revoke(key_id))
+        if revoked:
+            logger.info(f"API key revoked: {key_id}")
+        return revoked
+    except Exception as e:
+        logger.error(f"Error revoking API key: {e}")
+        return False
@@ -6,150 +6,616 @@ APIキー生成時にAWS Lambda関数を自動的に作成するための機能
 import json
 import logging
 import os
+import copy
 import base64
-import boto3
-from botocore.exceptions import ClientError
+import functools
+from lambda_package import PackageBuilder, ENTRY_FILES, build_zip
 
 # ロガー設定
 logger = logging.getLogger(__name__)
 
 # Lambda関数のコードテンプレート (Node.js)
+# 標準のhttp/httpsモジュールのみを使うため、依存パッケージを同梱する必要はない
 NODEJS_LAMBDA_CODE = """
-const axios = require('axios');
+const http = require('http');
+const https = require('https');
 
-exports.handler = async function(event, context) {
-    try {
-        // リクエストからスキル情報を取得
-        const alexaRequest = event.request || {};
-        const alexaResponse = {
-            version: '1.0',
-            response: {
-                outputSpeech: {},
-                shouldEndSession: true
+// エンドポイントとキープアライブ接続はモジュールスコープで保持し、
+// ウォーム起動時は既存のTCP/TLS接続を再利用する
+const ENDPOINT = new URL({{ENDPOINT_URL}});
+const CLIENT = ENDPOINT.protocol === 'http:' ? http : https;
+const AGENT = new CLIENT.Agent({ keepAlive: true, maxSockets: 4 });
+const SLEEP_PATH = ENDPOINT.pathname.replace(/[/]+$/, '') + '/api/sleep';
+const API_KEY = {{API_KEY}};
+
+// Alexaは8秒以内の応答を要求する。応答を組み立てる時間を残して打ち切る
+const ALEXA_BUDGET_MS = 8000;
+const RESPONSE_MARGIN_MS = 700;
+const MIN_CALL_MS = 300;
+
+function speech(text) {
+    return {
+        version: '1.0',
+        response: {
+            outputSpeech: {
+                type: 'PlainText',
+                text: text
+            },
+            shouldEndSession: true
+        }
+    };
+}
+
+function callDeadline(context, startedAt) {
+    // 呼び出し開始からのAlexaの残り時間と、Lambda自体の残り時間の短い方
+    const alexaRemaining = ALEXA_BUDGET_MS - (Date.now() - startedAt);
+    const lambdaRemaining = context && context.getRemainingTimeInMillis ?
+        context.getRemainingTimeInMillis() : alexaRemaining;
+    return Date.now() + Math.min(alexaRemaining, lambdaRemaining) - RESPONSE_MARGIN_MS;
+}
+
+function postSleep(deadline, retried) {
+    return new Promise((resolve, reject) => {
+        const timeoutMs = deadline - Date.now();
+        if (timeoutMs < MIN_CALL_MS) {
+            reject(Object.assign(new Error('deadline exceeded'), { code: 'ETIMEDOUT' }));
+            return;
+        }
+        const req = CLIENT.request({
+            protocol: ENDPOINT.protocol,
+            hostname: ENDPOINT.hostname,
+            port: ENDPOINT.port || undefined,
+            path: SLEEP_PATH,
+            method: 'POST',
+            agent: AGENT,
+            headers: {
+                'X-API-Key': API_KEY,
+                'Content-Length': 0
             }
-        };
-
-        // 特定のインテントかどうかを確認
-        if (event.request && event.request.type === 'IntentRequest' && 
-            event.request.intent && event.request.intent.name === 'SleepIntent') {
-            
-            // APIにスリープリクエストを送信
-            const response = await axios.post('{{ENDPOINT_URL}}/api/sleep', {}, {
-                headers: {
-                    'X-API-Key': '{{API_KEY}}'
-                }
+        }, (res) => {
+            let body = '';
+            res.setEncoding('utf8');
+            res.on('data', (chunk) => { body += chunk; });
+            res.on('end', () => {
+                clearTimeout(timer);
+                resolve({ status: res.statusCode, body: body });
             });
-            
-            // 成功メッセージを設定
-            alexaResponse.response.outputSpeech = {
-                type: 'PlainText',
-                text: 'コンピューターをスリープ状態にします。'
-            };
-            
-            return alexaResponse;
-        } else {
-            // 対応していないリクエストの場合
-            alexaResponse.response.outputSpeech = {
-                type: 'PlainText',
-                text: 'その操作はサポートされていません。コンピューターをスリープ状態にするには、「パソコンをスリープして」と言ってください。'
-            };
-            return alexaResponse;
+        });
+        const timer = setTimeout(() => {
+            req.destroy(Object.assign(new Error('request timed out'), { code: 'ETIMEDOUT' }));
+        }, timeoutMs);
+        req.on('error', (error) => {
+            clearTimeout(timer);
+            // 再利用したキープアライブ接続がサーバー側で閉じられていた場合は一度だけ再試行
+            if (req.reusedSocket && error.code === 'ECONNRESET' && !retried) {
+                resolve(postSleep(deadline, true));
+            } else {
+                reject(error);
+            }
+        });
+        req.end();
+    });
+}
+
+exports.handler = async function(event, context) {
+    const startedAt = Date.now();
+    const request = event.request || {};
+
+    // 特定のインテントかどうかを確認
+    if (request.type !== 'IntentRequest' || !request.intent || request.intent.name !== 'SleepIntent') {
+        // 対応していないリクエストの場合
+        return speech('その操作はサポートされていません。コンピューターをスリープ状態にするには、「パソコンをスリープして」と言ってください。');
+    }
+
+    try {
+        // APIにスリープリクエストを送信 (202 = 受付済み)
+        const result = await postSleep(callDeadline(context, startedAt), false);
+        if (result.status >= 200 && result.status < 300) {
+            return speech('コンピューターをスリープ状態にします。');
+        }
+        console.error('API error:', result.status, result.body);
+        if (result.status === 401) {
+            return speech('APIキーが無効なため、パソコンをスリープ状態にできませんでした。');
+        }
+        if (result.status === 429) {
+            return speech('リクエストが多すぎます。少し待ってからもう一度お試しください。');
         }
+        return speech('すみません、パソコンをスリープ状態にできませんでした。');
     } catch (error) {
         console.error('エラー:', error);
-        
-        // エラーレスポンスを返す
-        return {
-            version: '1.0',
-            response: {
-                outputSpeech: {
-                    type: 'PlainText',
-                    text: 'すみません、パソコンをスリープ状態にできませんでした。'
-                },
-                shouldEndSession: true
-            }
-        };
+        if (error.code === 'ETIMEDOUT') {
+            return speech('パソコンから時間内に応答がありませんでした。');
+        }
+        return speech('すみません、パソコンをスリープ状態にできませんでした。');
     }
 };
 """
 
 # Lambda関数のコードテンプレート (Python)
+# 標準ライブラリのhttp.clientのみを使用する
 PYTHON_LAMBDA_CODE = """
 import json
-import urllib.request
-import urllib.error
+import time
+import socket
 import logging
+import http.client
+from urllib.parse import urlsplit
 
 # ロガー設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# エンドポイントと接続はモジュールスコープで保持し、
+# ウォーム起動時は既存のTCP/TLS接続を再利用する
+ENDPOINT = urlsplit({{ENDPOINT_URL}})
+SLEEP_PATH = ENDPOINT.path.rstrip('/') + '/api/sleep'
+API_KEY = {{API_KEY}}
+
+# Alexaは8秒以内の応答を要求する。応答を組み立てる時間を残して打ち切る
+ALEXA_BUDGET = 8.0
+RESPONSE_MARGIN = 0.7
+MIN_CALL_TIME = 0.3
+
+_connection = None
+
+
+def _get_connection(timeout):
+    global _connection
+    if _connection is None:
+        if ENDPOINT.scheme == 'http':
+            _connection = http.client.HTTPConnection(ENDPOINT.hostname, ENDPOINT.port, timeout=timeout)
+        else:
+            _connection = http.client.HTTPSConnection(ENDPOINT.hostname, ENDPOINT.port, timeout=timeout)
+    # 既存の接続にも今回の呼び出しのタイムアウトを適用
+    _connection.timeout = timeout
+    if _connection.sock is not None:
+        _connection.sock.settimeout(timeout)
+    return _connection
+
+
+def _reset_connection():
+    global _connection
+    if _connection is not None:
+        _connection.close()
+    _connection = None
+
+
+def call_deadline(context, started_at):
+    # Alexaの残り時間とLambdaの残り時間の短い方から呼び出しの期限を求める
+    remaining = ALEXA_BUDGET - (time.monotonic() - started_at)
+    if context is not None:
+        remaining = min(remaining, context.get_remaining_time_in_millis() / 1000.0)
+    return time.monotonic() + remaining - RESPONSE_MARGIN
+
+
+def post_sleep(deadline):
+    # POST /api/sleep を送信し (status, body) を返す
+    for attempt in range(2):
+        timeout = deadline - time.monotonic()
+        if timeout < MIN_CALL_TIME:
+            raise socket.timeout('deadline exceeded')
+        conn = _get_connection(timeout)
+        reused = conn.sock is not None
+        try:
+            conn.request('POST', SLEEP_PATH, body=b'', headers={'X-API-Key': API_KEY})
+            resp = conn.getresponse()
+            body = resp.read().decode('utf-8', 'replace')
+            if resp.will_close:
+                _reset_connection()
+            return resp.status, body
+        except socket.timeout:
+            _reset_connection()
+            raise
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            _reset_connection()
+            # 再利用したキープアライブ接続がサーバー側で閉じられていた場合は一度だけ再試行
+            if not reused or attempt:
+                raise
+        except Exception:
+            _reset_connection()
+            raise
+
+
+def speech(text):
+    return {
+        'version': '1.0',
+        'response': {
+            'outputSpeech': {
+                'type': 'PlainText',
+                'text': text
+            },
+            'shouldEndSession': True
+        }
+    }
+
+
 def lambda_handler(event, context):
+    started_at = time.monotonic()
+    request = event.get('request', {})
+
+    # 特定のインテントかどうかを確認
+    if request.get('type') != 'IntentRequest' or request.get('intent', {}).get('name') != 'SleepIntent':
+        # 対応していないリクエストの場合
+        return speech('その操作はサポートされていません。コンピューターをスリープ状態にするには、「パソコンをスリープして」と言ってください。')
+
     try:
-        # リクエストからスキル情報を取得
-        request_type = event.get('request', {}).get('type')
-        
-        # レスポンス初期化
-        response = {
-            'version': '1.0',
-            'response': {
-                'outputSpeech': {},
-                'shouldEndSession': True
+        # APIにスリープリクエストを送信 (202 = 受付済み)
+        status, body = post_sleep(call_deadline(context, started_at))
+        logger.info(f"API response: {status} {body}")
+        if 200 <= status < 300:
+            return speech('コンピューターをスリープ状態にします。')
+        if status == 401:
+            return speech('APIキーが無効なため、パソコンをスリープ状態にできませんでした。')
+        if status == 429:
+            return speech('リクエストが多すぎます。少し待ってからもう一度お試しください。')
+        return speech('すみません、パソコンをスリープ状態にできませんでした。')
+    except socket.timeout:
+        logger.error("API request timed out")
+        return speech('パソコンから時間内に応答がありませんでした。')
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        return speech('すみません、パソコンをスリープ状態にできませんでした。')
+"""
+
+# 複数のPCを同時にスリープさせるLambda関数のコードテンプレート (Node.js)
+# {{TARGETS_JSON}} は group_template_params() で対象PCの一覧に置換する
+NODEJS_GROUP_LAMBDA_CODE = """
+const http = require('http');
+const https = require('https');
+
+// 対象のPC一覧: [{"name", "endpoint_url", "api_key", "groups": [...]}, ...]
+const TARGETS = JSON.parse({{TARGETS_JSON}});
+
+// キープアライブ接続はモジュールスコープで保持し、ウォーム起動時に再利用する
+const AGENTS = {
+    'http:': new http.Agent({ keepAlive: true }),
+    'https:': new https.Agent({ keepAlive: true })
+};
+
+// Alexaは8秒以内の応答を要求する。応答を組み立てる時間を残して打ち切る
+const ALEXA_BUDGET_MS = 8000;
+const RESPONSE_MARGIN_MS = 700;
+const MIN_CALL_MS = 300;
+
+function speech(text) {
+    return {
+        version: '1.0',
+        response: {
+            outputSpeech: {
+                type: 'PlainText',
+                text: text
+            },
+            shouldEndSession: true
+        }
+    };
+}
+
+function callDeadline(context, startedAt) {
+    // 呼び出し開始からのAlexaの残り時間と、Lambda自体の残り時間の短い方
+    const alexaRemaining = ALEXA_BUDGET_MS - (Date.now() - startedAt);
+    const lambdaRemaining = context && context.getRemainingTimeInMillis ?
+        context.getRemainingTimeInMillis() : alexaRemaining;
+    return Date.now() + Math.min(alexaRemaining, lambdaRemaining) - RESPONSE_MARGIN_MS;
+}
+
+function postSleep(target, deadline, retried) {
+    return new Promise((resolve, reject) => {
+        const timeoutMs = deadline - Date.now();
+        if (timeoutMs < MIN_CALL_MS) {
+            reject(Object.assign(new Error('deadline exceeded'), { code: 'ETIMEDOUT' }));
+            return;
+        }
+        const endpoint = new URL(target.endpoint_url);
+        const client = endpoint.protocol === 'http:' ? http : https;
+        const req = client.request({
+            protocol: endpoint.protocol,
+            hostname: endpoint.hostname,
+            port: endpoint.port || undefined,
+            path: endpoint.pathname.replace(/[/]+$/, '') + '/api/sleep',
+            method: 'POST',
+            agent: AGENTS[endpoint.protocol],
+            headers: {
+                'X-API-Key': target.api_key,
+                'Content-Length': 0
+            }
+        }, (res) => {
+            res.resume();
+            res.on('end', () => {
+                clearTimeout(timer);
+                resolve(res.statusCode);
+            });
+        });
+        const timer = setTimeout(() => {
+            req.destroy(Object.assign(new Error('request timed out'), { code: 'ETIMEDOUT' }));
+        }, timeoutMs);
+        req.on('error', (error) => {
+            clearTimeout(timer);
+            // 再利用したキープアライブ接続がサーバー側で閉じられていた場合は一度だけ再試行
+            if (req.reusedSocket && error.code === 'ECONNRESET' && !retried) {
+                resolve(postSleep(target, deadline, true));
+            } else {
+                reject(error);
             }
+        });
+        req.end();
+    });
+}
+
+function selectTargets(request) {
+    // SleepGroupIntentはgroupスロットのグループ、SleepIntentは全てのPCが対象
+    const intent = request.intent || {};
+    if (intent.name === 'SleepIntent') {
+        return { group: null, targets: TARGETS };
+    }
+    const slot = (intent.slots || {}).group || {};
+    let group = slot.value;
+    const authorities = (slot.resolutions || {}).resolutionsPerAuthority || [];
+    for (const authority of authorities) {
+        if (authority.status && authority.status.code === 'ER_SUCCESS_MATCH' && authority.values && authority.values.length) {
+            group = authority.values[0].value.id;
+            break;
         }
-        
-        # 特定のインテントかどうかを確認
-        if (request_type == 'IntentRequest' and 
-            event.get('request', {}).get('intent', {}).get('name') == 'SleepIntent'):
-            
-            # APIにスリープリクエストを送信
-            req = urllib.request.Request('{{ENDPOINT_URL}}/api/sleep', 
-                                        data=None,
-                                        headers={
-                                            'X-API-Key': '{{API_KEY}}'
-                                        },
-                                        method='POST')
-            
-            with urllib.request.urlopen(req) as resp:
-                result = json.loads(resp.read().decode('utf-8'))
-                logger.info(f"API response: {result}")
-            
-            # 成功メッセージを設定
-            response['response']['outputSpeech'] = {
-                'type': 'PlainText',
-                'text': 'コンピューターをスリープ状態にします。'
+    }
+    return { group: group, targets: TARGETS.filter((target) => (target.groups || []).includes(group)) };
+}
+
+function summarize(results) {
+    // PCごとの結果を1つの応答文にまとめる
+    const succeeded = results.filter((r) => r.outcome === 'ok').map((r) => r.name);
+    const timedOut = results.filter((r) => r.outcome === 'timeout').map((r) => r.name);
+    const failed = results.filter((r) => r.outcome === 'error').map((r) => r.name);
+    let text;
+    if (succeeded.length === 0) {
+        text = 'パソコンをスリープ状態にできませんでした。';
+    } else if (succeeded.length === results.length) {
+        return `${succeeded.length}台のパソコンをスリープ状態にします。`;
+    } else {
+        text = `${results.length}台中${succeeded.length}台のパソコンをスリープ状態にします。`;
+    }
+    if (timedOut.length) {
+        text += timedOut.join('、') + 'から時間内に応答がありませんでした。';
+    }
+    if (failed.length) {
+        text += failed.join('、') + 'はスリープできませんでした。';
+    }
+    return text;
+}
+
+exports.handler = async function(event, context) {
+    const startedAt = Date.now();
+    const request = event.request || {};
+
+    // 特定のインテントかどうかを確認
+    if (request.type !== 'IntentRequest' || !request.intent ||
+        (request.intent.name !== 'SleepIntent' && request.intent.name !== 'SleepGroupIntent')) {
+        return speech('その操作はサポートされていません。「オフィスのパソコンをスリープして」のように言ってください。');
+    }
+
+    const { group, targets } = selectTargets(request);
+    if (targets.length === 0) {
+        return speech(`${group || ''}というグループのパソコンが見つかりませんでした。`);
+    }
+
+    // 全てのPCに同時にリクエストを送る (各呼び出しは共通の期限で打ち切られる)
+    const deadline = callDeadline(context, startedAt);
+    const settled = await Promise.allSettled(targets.map((target) => postSleep(target, deadline, false)));
+    const results = settled.map((result, i) => {
+        const name = targets[i].name;
+        if (result.status === 'fulfilled') {
+            if (result.value >= 200 && result.value < 300) {
+                return { name: name, outcome: 'ok' };
             }
-            
+            console.error(`${name}: API error ${result.value}`);
+            return { name: name, outcome: 'error' };
+        }
+        console.error(`${name}:`, result.reason);
+        return { name: name, outcome: result.reason.code === 'ETIMEDOUT' ? 'timeout' : 'error' };
+    });
+
+    console.log('Results:', JSON.stringify(results));
+    return speech(summarize(results));
+};
+"""
+
+# 複数のPCを同時にスリープさせるLambda関数のコードテンプレート (Python)
+PYTHON_GROUP_LAMBDA_CODE = """
+import json
+import time
+import socket
+import logging
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# ロガー設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 対象のPC一覧: [{"name", "endpoint_url", "api_key", "groups": [...]}, ...]
+TARGETS = json.loads({{TARGETS_JSON}})
+
+# Alexaは8秒以内の応答を要求する。応答を組み立てる時間を残して打ち切る
+ALEXA_BUDGET = 8.0
+RESPONSE_MARGIN = 0.7
+MIN_CALL_TIME = 0.3
+
+# スレッドプールとPCごとの接続はモジュールスコープで保持し、ウォーム起動時に再利用する
+_executor = ThreadPoolExecutor(max_workers=max(1, min(32, len(TARGETS))))
+_connections = {}
+
+
+def _get_connection(target, timeout):
+    conn = _connections.get(target['name'])
+    if conn is None:
+        endpoint = urlsplit(target['endpoint_url'])
+        if endpoint.scheme == 'http':
+            conn = http.client.HTTPConnection(endpoint.hostname, endpoint.port, timeout=timeout)
         else:
-            # 対応していないリクエストの場合
-            response['response']['outputSpeech'] = {
+            conn = http.client.HTTPSConnection(endpoint.hostname, endpoint.port, timeout=timeout)
+        _connections[target['name']] = conn
+    # 既存の接続にも今回の呼び出しのタイムアウトを適用
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def _reset_connection(target):
+    conn = _connections.pop(target['name'], None)
+    if conn is not None:
+        conn.close()
+
+
+def call_deadline(context, started_at):
+    # Alexaの残り時間とLambdaの残り時間の短い方から呼び出しの期限を求める
+    remaining = ALEXA_BUDGET - (time.monotonic() - started_at)
+    if context is not None:
+        remaining = min(remaining, context.get_remaining_time_in_millis() / 1000.0)
+    return time.monotonic() + remaining - RESPONSE_MARGIN
+
+
+def post_sleep(target, deadline):
+    # 1台のPCに POST /api/sleep を送信し、HTTPステータスを返す
+    path = urlsplit(target['endpoint_url']).path.rstrip('/') + '/api/sleep'
+    for attempt in range(2):
+        timeout = deadline - time.monotonic()
+        if timeout < MIN_CALL_TIME:
+            raise socket.timeout('deadline exceeded')
+        conn = _get_connection(target, timeout)
+        reused = conn.sock is not None
+        try:
+            conn.request('POST', path, body=b'', headers={'X-API-Key': target['api_key']})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.will_close:
+                _reset_connection(target)
+            return resp.status
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            _reset_connection(target)
+            # 再利用したキープアライブ接続がサーバー側で閉じられていた場合は一度だけ再試行
+            if not reused or attempt:
+                raise
+        except Exception:
+            _reset_connection(target)
+            raise
+
+
+def select_targets(request):
+    # SleepGroupIntentはgroupスロットのグループ、SleepIntentは全てのPCが対象
+    intent = request.get('intent', {})
+    if intent.get('name') == 'SleepIntent':
+        return None, TARGETS
+    slot = intent.get('slots', {}).get('group', {})
+    group = slot.get('value')
+    for authority in slot.get('resolutions', {}).get('resolutionsPerAuthority', []):
+        values = authority.get('values') or []
+        if authority.get('status', {}).get('code') == 'ER_SUCCESS_MATCH' and values:
+            group = values[0]['value']['id']
+            break
+    return group, [target for target in TARGETS if group in target.get('groups', [])]
+
+
+def speech(text):
+    return {
+        'version': '1.0',
+        'response': {
+            'outputSpeech': {
                 'type': 'PlainText',
-                'text': 'その操作はサポートされていません。コンピューターをスリープ状態にするには、「パソコンをスリープして」と言ってください。'
-            }
-        
-        return response
-        
-    except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        
-        # エラーレスポンスを返す
-        return {
-            'version': '1.0',
-            'response': {
-                'outputSpeech': {
-                    'type': 'PlainText',
-                    'text': 'すみません、パソコンをスリープ状態にできませんでした。'
-                },
-                'shouldEndSession': True
-            }
+                'text': text
+            },
+            'shouldEndSession': True
         }
+    }
+
+
+def summarize(results):
+    # PCごとの結果を1つの応答文にまとめる
+    succeeded = [name for name, outcome in results if outcome == 'ok']
+    timed_out = [name for name, outcome in results if outcome == 'timeout']
+    failed = [name for name, outcome in results if outcome == 'error']
+    if not succeeded:
+        text = 'パソコンをスリープ状態にできませんでした。'
+    elif len(succeeded) == len(results):
+        return f'{len(succeeded)}台のパソコンをスリープ状態にします。'
+    else:
+        text = f'{len(results)}台中{len(succeeded)}台のパソコンをスリープ状態にします。'
+    if timed_out:
+        text += '、'.join(timed_out) + 'から時間内に応答がありませんでした。'
+    if failed:
+        text += '、'.join(failed) + 'はスリープできませんでした。'
+    return text
+
+
+def lambda_handler(event, context):
+    started_at = time.monotonic()
+    request = event.get('request', {})
+
+    # 特定のインテントかどうかを確認
+    intent_name = request.get('intent', {}).get('name')
+    if request.get('type') != 'IntentRequest' or intent_name not in ('SleepIntent', 'SleepGroupIntent'):
+        return speech('その操作はサポートされていません。「オフィスのパソコンをスリープして」のように言ってください。')
+
+    group, targets = select_targets(request)
+    if not targets:
+        return speech(f'{group or ""}というグループのパソコンが見つかりませんでした。')
+
+    # 全てのPCに同時にリクエストを送り、共通の期限まで待つ
+    deadline = call_deadline(context, started_at)
+    futures = {_executor.submit(post_sleep, target, deadline): target for target in targets}
+    done, _ = wait(futures, timeout=max(0, deadline - time.monotonic()))
+
+    results = []
+    for future, target in futures.items():
+        if future not in done:
+            outcome = 'timeout'
+        else:
+            try:
+                status = future.result()
+                outcome = 'ok' if 200 <= status < 300 else 'error'
+                if outcome == 'error':
+                    logger.error(f"{target['name']}: API error {status}")
+            except socket.timeout:
+                outcome = 'timeout'
+            except Exception as e:
+                logger.error(f"{target['name']}: {str(e)}")
+                outcome = 'error'
+        results.append((target['name'], outcome))
+
+    logger.info(f"Results: {results}")
+    return speech(summarize(results))
 """
 
+def group_template_params(targets):
+    """
+    グループ用テンプレートのプレースホルダーの値を作成する
+    
+    Args:
+        targets (list): 対象PCの一覧。各要素は name, endpoint_url, api_key と
+            任意の groups (グループ名のリスト) を持つdict
+        
+    Returns:
+        dict: PackageBuilder.build() に渡すパラメータ
+    """
+    targets = [{
+        'name': target['name'],
+        'endpoint_url': target['endpoint_url'],
+        'api_key': target['api_key'],
+        'groups': list(target.get('groups') or []),
+    } for target in targets]
+    # render() が文字列リテラルにするので、テンプレートでは JSON.parse / json.loads で読む
+    return {'TARGETS_JSON': json.dumps(targets, sort_keys=True)}
+
+# デプロイパッケージのビルダー (同じ入力からは常に同じバイト列のZipを生成し、キャッシュする)
+package_builder = PackageBuilder()
+
 # Zipファイル作成用のヘルパー関数
 def create_lambda_package(code, runtime):
     """
     Lambda関数用のデプロイパッケージを作成
     
+    エントリの順序・タイムスタンプ・圧縮レベルが固定されているため、
+    同じコードからは常に同じバイト列が生成されます。
+    
     Args:
         code (str): Lambda関数のコード
         runtime (str): ランタイム ("nodejs" または "python")
@@ -157,18 +623,30 @@ def create_lambda_package(code, runtime):
     Returns:
         bytes: Zipファイルのバイナリデータ
     """
-    import io
-    import zipfile
-    
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED) as zip_file:
-        if runtime == "nodejs":
-            zip_file.writestr('index.js', code)
-        else:  # python
-            zip_file.writestr('lambda_function.py', code)
+    return build_zip({ENTRY_FILES[runtime]: code})
+
+def deploy_lambda_code(lambda_client, function_name, package, current_sha256=None):
+    """
+    既存のLambda関数のコードを更新する (変更がない場合はアップロードしない)
     
-    zip_buffer.seek(0)
-    return zip_buffer.read()
+    Args:
+        lambda_client: boto3のLambdaクライアント
+        function_name (str): Lambda関数名
+        package (LambdaPackage): PackageBuilder.build() の戻り値
+        current_sha256 (str): 取得済みの関数設定の CodeSha256
+            (省略時は get_function_configuration で取得する)
+        
+    Returns:
+        bool: コードをアップロードした場合はTrue、既に同じコードの場合はFalse
+    """
+    if current_sha256 is None:
+        current_sha256 = lambda_client.get_function_configuration(FunctionName=function_name).get('CodeSha256')
+    if current_sha256 == package.sha256:
+        logger.info(f"Lambda function {function_name} is up to date ({package.sha256})")
+        return False
+    lambda_client.update_function_code(FunctionName=function_name, ZipFile=package.data, Publish=True)
+    logger.info(f"Lambda function code updated: {function_name} ({package.sha256})")
+    return True
 
 def create_lambda_function(api_key, endpoint_url, aws_access_key=None, aws_secret_key=None, 
                           aws_region='us-east-1', runtime="nodejs"):
@@ -186,121 +664,53 @@ def create_lambda_function(api_key, endpoint_url, aws_access_key=None, aws_secre
     Returns:
         dict: 作成されたLambda関数の情報
     """
+    # セッション・クライアント・IAMロール・アカウントIDは認証情報ごとに共有する
+    from lambda_fleet import get_provisioner
+    
     try:
-        # AWSセッション設定
-        session_kwargs = {}
-        if aws_access_key and aws_secret_key:
-            session_kwargs['aws_access_key_id'] = aws_access_key
-            session_kwargs['aws_secret_access_key'] = aws_secret_key
-        
-        session = boto3.Session(region_name=aws_region, **session_kwargs)
-        lambda_client = session.client('lambda')
-        
-        # ランタイム設定
-        if runtime == "nodejs":
-            runtime_str = "nodejs18.x"
-            code_template = NODEJS_LAMBDA_CODE
-            handler = "index.handler"
-        else:  # python
-            runtime_str = "python3.9"
-            code_template = PYTHON_LAMBDA_CODE
-            handler = "lambda_function.lambda_handler"
-        
-        # コード内のプレースホルダーを置換
-        code = code_template.replace("{{API_KEY}}", api_key).replace("{{ENDPOINT_URL}}", endpoint_url)
-        
-        # Lambdaロール作成（もしくは既存のロールを使用）
-        iam = session.client('iam')
-        role_name = 'alexa_sleep_controller_role'
-        
-        # ロールが存在するか確認
-        try:
-            role_response = iam.get_role(RoleName=role_name)
-            role_arn = role_response['Role']['Arn']
-        except ClientError:
-            # ロールが存在しない場合は作成
-            trust_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"Service": "lambda.amazonaws.com"},
-                        "Action": "sts:AssumeRole"
-                    }
-                ]
-            }
-            
-            role_response = iam.create_role(
-                RoleName=role_name,
-                AssumeRolePolicyDocument=json.dumps(trust_policy),
-                Description='Role for Alexa Sleep Controller Lambda function'
-            )
-            
-            # 基本的なログ記録ポリシーをアタッチ
-            iam.attach_role_policy(
-                RoleName=role_name,
-                PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
-            )
-            
-            role_arn = role_response['Role']['Arn']
-            
-            # ロールが有効になるまで少し待機
-            import time
-            time.sleep(10)
-        
-        # Lambda関数パッケージを作成
-        zip_file = create_lambda_package(code, runtime)
+        provisioner = get_provisioner(aws_access_key, aws_secret_key, aws_region)
         
         # Lambda関数を作成
         function_name = f"AlexaSleepController_{base64.b32encode(os.urandom(3)).decode('utf-8').lower()}"
-        response = lambda_client.create_function(
-            FunctionName=function_name,
-            Runtime=runtime_str,
-            Role=role_arn,
-            Handler=handler,
-            Code={'ZipFile': zip_file},
-            Description='Lambda function to control PC sleep via Alexa',
-            Timeout=10,
-            MemorySize=128,
-            Publish=True,
-            Tags={
-                'Service': 'AlexaSleepController'
-            }
-        )
-        
-        # Alexaスキルのエンドポイントとして設定するための権限を追加
-        lambda_client.add_permission(
-            FunctionName=function_name,
-            StatementId='alexa-skill-kit-statement',
-            Action='lambda:InvokeFunction',
-            Principal='alexa-appkit.amazon.com',
-            SourceAccount=session.client('sts').get_caller_identity()['Account']
-        )
-        
-        logger.info(f"Lambda function created: {function_name}")
+        result = provisioner.provision(api_key, endpoint_url, runtime,
+                                       function_name=function_name, update_existing=False)
         
         return {
-            'function_name': function_name,
-            'function_arn': response['FunctionArn'],
-            'runtime': runtime_str,
-            'region': aws_region
+            'function_name': result.function_name,
+            'function_arn': result.function_arn,
+            'runtime': result.runtime,
+            'region': aws_region,
+            'code_sha256': result.code_sha256
         }
     
     except Exception as e:
         logger.error(f"Lambda function creation failed: {str(e)}")
         raise
 
-def generate_alexa_skill_json(lambda_arn):
+# グループ指定のスリープ用インテントの発話サンプル ({group} はスロット)
+GROUP_INTENT_SAMPLES = {
+    "ja-JP": [
+        "{group}のパソコンをスリープして",
+        "{group}のコンピューターをスリープして",
+        "{group}のPCをスリープ状態にして",
+        "{group}をスリープして"
+    ],
+    "en-US": [
+        "put the {group} computers to sleep",
+        "sleep the {group} pcs",
+        "put {group} to sleep",
+        "sleep {group}"
+    ]
+}
+
+@functools.lru_cache(maxsize=None)
+def _base_skill_definition():
     """
-    Alexaスキル定義JSONを生成する
+    ロケールごとのスキル定義 (Lambda ARNとグループを除く)
     
-    Args:
-        lambda_arn (str): Lambda関数のARN
-        
-    Returns:
-        str: Alexaスキル定義JSON
+    プロセスごとに一度だけ構築する。戻り値は共有されるため変更しないこと。
     """
-    skill_json = {
+    return {
         "manifest": {
             "publishingInformation": {
                 "locales": {
@@ -349,7 +759,7 @@ def generate_alexa_skill_json(lambda_arn):
             "apis": {
                 "custom": {
                     "endpoint": {
-                        "uri": lambda_arn
+                        "uri": None
                     }
                 }
             },
@@ -446,19 +856,95 @@ def generate_alexa_skill_json(lambda_arn):
             }
         }
     }
+
+@functools.lru_cache(maxsize=256)
+def interaction_model(locale, groups=()):
+    """
+    ロケールの対話モデルを返す (Alexa Developer ConsoleのJSONエディター形式)
     
-    return json.dumps(skill_json, indent=2)
+    Args:
+        locale (str): "ja-JP" または "en-US"
+        groups (tuple): グループ名。指定するとグループ用Lambda関数
+            (NODEJS_GROUP_LAMBDA_CODE / PYTHON_GROUP_LAMBDA_CODE) 向けに
+            SleepGroupIntent とスロットタイプ PC_GROUP を追加する
+        
+    Returns:
+        dict: 対話モデル (キャッシュされ共有されるため変更しないこと)
+    """
+    base = _base_skill_definition()["interactionModel"][locale]
+    if not groups:
+        return base
+    
+    model = copy.deepcopy(base)
+    language_model = model["interactionModel"]["languageModel"]
+    language_model["intents"].append({
+        "name": "SleepGroupIntent",
+        "slots": [{"name": "group", "type": "PC_GROUP"}],
+        "samples": list(GROUP_INTENT_SAMPLES[locale])
+    })
+    language_model["types"].append({
+        "name": "PC_GROUP",
+        "values": [{"id": group, "name": {"value": group}} for group in groups]
+    })
+    return model
+
+def build_alexa_skill(lambda_arn, groups=None):
+    """
+    Alexaスキル定義を組み立てる
+    
+    ロケールのデータはキャッシュ済みのものを共有し、エンドポイントだけを差し替える。
+    
+    Args:
+        lambda_arn (str): Lambda関数のARN
+        groups (list): グループ名のリスト (interaction_model() を参照)
+        
+    Returns:
+        dict: manifest と interactionModel (ロケール別) を持つスキル定義
+    """
+    groups = tuple(groups or ())
+    base = _base_skill_definition()
+    manifest = dict(base["manifest"])
+    manifest["apis"] = {
+        "custom": {
+            "endpoint": {
+                "uri": lambda_arn
+            }
+        }
+    }
+    return {
+        "manifest": manifest,
+        "interactionModel": {locale: interaction_model(locale, groups) for locale in base["interactionModel"]}
+    }
+
+def generate_alexa_skill_json(lambda_arn, groups=None):
+    """
+    Alexaスキル定義JSONを生成する
+    
+    Args:
+        lambda_arn (str): Lambda関数のARN
+        groups (list): グループ名のリスト。指定するとグループ用Lambda関数
+            (NODEJS_GROUP_LAMBDA_CODE / PYTHON_GROUP_LAMBDA_CODE) 向けに
+            SleepGroupIntent とスロットタイプ PC_GROUP を追加する
+        
+    Returns:
+        str: Alexaスキル定義JSON
+    """
+    return json.dumps(build_alexa_skill(lambda_arn, groups), indent=2)
 
-def get_alexa_skill_setup_instructions(lambda_info):
+def get_alexa_skill_setup_instructions(lambda_info, model=None):
     """
     Alexaスキルの設定手順を生成する
     
     Args:
         lambda_info (dict): Lambda関数の情報
+        model (dict): 手順に載せる対話モデル。スキルパッケージと同じものを渡す
+            (省略時は単一PC用の ja-JP モデル)
         
     Returns:
         str: 設定手順
     """
+    if model is None:
+        model = interaction_model('ja-JP')
     instructions = f"""
 # Alexaスキルの設定手順
 
@@ -493,7 +979,7 @@ Lambda関数が正常に作成されました。以下の情報を使ってAlexa
 9. 以下のJSONをアップロードするか、コピー＆ペーストしてください:
 
 ```json
-{json.dumps(json.loads(generate_alexa_skill_json(lambda_info['function_arn']))['interactionModel']['ja-JP'], indent=2, ensure_ascii=False)}
+{json.dumps(model, indent=2, ensure_ascii=False)}
 ```
 
 10. **「保存」**をクリックし、**「モデルを構築」**をクリックします
@@ -0,0 +1,371 @@
+"""
+Load test and benchmark for the /api/sleep hot path.
+
+Drives /api/sleep with the simulated sleep backend under configurable
+concurrency and sweeps:
+
+- key-store sizes (number of stored API keys)
+- auth modes (X-API-Key or Basic auth)
+- servers: in-process test client, Flask dev server (main.py), waitress,
+  gunicorn (workers x threads)
+
+Each combination runs against a fresh temporary data directory, with the
+admission-control rate limits turned off so every request reaches the code
+being measured. Results (throughput and p50/p95/p99 latency of the 2xx
+responses, and a count of the others) are written to a JSON file so runs can
+be compared between commits. The exit status is 1 if any request failed.
+
+Example:
+    python benchmarks/bench_api_sleep.py --servers inproc,waitress \\
+        --key-counts 1,100,1000 --concurrency 1,16 --requests 500
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import socket
+import argparse
+import platform
+import datetime
+import tempfile
+import threading
+import subprocess
+import http.client
+from multiprocessing import Pool
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+ADMIN_USERNAME = 'bench'
+ADMIN_PASSWORD = 'bench-password'
+
+
+def _hash_key(api_key):
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(api_key)
+
+
+def create_key_file(path, count, legacy=False):
+    """
+    Write an api_keys.json with ``count`` keys and return one valid key.
+
+    With ``legacy`` the keys are stored without key IDs, which exercises the
+    old scan-every-hash verification path.
+    """
+    if legacy:
+        keys = [str(uuid.uuid4()) for _ in range(count)]
+    else:
+        keys = [f"{uuid.uuid4().hex[:8]}.{uuid.uuid4()}" for _ in range(count)]
+    with Pool() as pool:
+        hashes = pool.map(_hash_key, keys)
+
+    if legacy:
+        data = hashes
+    else:
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        data = {
+            'version': 2,
+            'keys': {key.split('.', 1)[0]: {'hash': h, 'created': now} for key, h in zip(keys, hashes)},
+            'legacy': [],
+        }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    # The last key is the worst case for a legacy scan
+    return keys[-1]
+
+
+def app_environment(data_dir, args):
+    """Environment variables that point the app at a private data directory."""
+    env = dict(os.environ)
+    env.update({
+        'API_KEYS_FILE': os.path.join(data_dir, 'api_keys.json'),
+        'DATABASE_URL': f"sqlite:///{os.path.join(data_dir, 'alexa_sleep.db')}",
+        'SLEEP_BACKENDS': 'simulated',
+        'SLEEP_HISTORY_FILE': os.path.join(data_dir, 'sleep_history.ring'),
+        'SLEEP_HISTORY_SIZE': '10000',
+        'METRICS_DIR': os.path.join(data_dir, 'metrics'),
+        'ADMIN_USERNAME': ADMIN_USERNAME,
+        'ADMIN_PASSWORD': ADMIN_PASSWORD,
+        'API_KEY_CACHE_TTL': str(args.cache_ttl),
+        # The benchmark client is one IP sending one key as fast as it can;
+        # rate limits would turn most requests into 429s
+        'ADMISSION_IP_RATE': '0',
+        'ADMISSION_KEY_RATE': '0',
+        # Enough KDF slots that no client thread is turned away with a 429
+        'ADMISSION_KDF_CONCURRENCY': str(max(parse_list(args.concurrency, int))),
+        'LOG_LEVEL': 'WARNING',
+        'PYTHONPATH': ROOT + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    return env
+
+
+def auth_headers(auth_mode, api_key):
+    if auth_mode == 'api_key':
+        return {'X-API-Key': api_key}
+    token = base64.b64encode(f"{ADMIN_USERNAME}:{ADMIN_PASSWORD}".encode('utf-8')).decode('ascii')
+    return {'Authorization': f"Basic {token}"}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def succeeded(status):
+    return isinstance(status, int) and 200 <= status < 300
+
+
+def summarise(latencies, statuses, elapsed):
+    """Throughput and latency of the 2xx responses; other outcomes are only counted."""
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    latencies = sorted(latency for latency, status in zip(latencies, statuses) if succeeded(status))
+    return {
+        'requests': len(statuses),
+        'succeeded': len(latencies),
+        'failed': len(statuses) - len(latencies),
+        'elapsed_seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'p50': percentile(latencies, 0.50) * 1000 if latencies else None,
+            'p95': percentile(latencies, 0.95) * 1000 if latencies else None,
+            'p99': percentile(latencies, 0.99) * 1000 if latencies else None,
+            'max': latencies[-1] * 1000 if latencies else None,
+        },
+        'status_counts': counts,
+    }
+
+
+def run_load(send, concurrency, total_requests):
+    """Call ``send()`` ``total_requests`` times from ``concurrency`` threads."""
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker():
+        request = send()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            status = request()
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                statuses.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, statuses, time.perf_counter() - start)
+
+
+def http_sender(port, headers):
+    """Factory returning a per-thread function that POSTs over one keep-alive connection."""
+    def make():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+        def request():
+            nonlocal conn
+            try:
+                conn.request('POST', '/api/sleep', body=b'', headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                return response.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                return type(e).__name__
+        return request
+    return make
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(server, port, args):
+    python = sys.executable
+    if server == 'flask':
+        return [python, '-c',
+                f"import main; main.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    if server == 'waitress':
+        return [python, '-m', 'waitress', f'--listen=127.0.0.1:{port}',
+                f'--threads={args.threads}', 'main:app']
+    if server == 'gunicorn':
+        return [python, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(args.workers), '--threads', str(args.threads),
+                '--preload', 'main:app']
+    raise ValueError(f"Unknown server: {server}")
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not open port {port} within {timeout}s")
+
+
+def bench_server(server, env, headers, args, concurrency):
+    port = free_port()
+    process = subprocess.Popen(server_command(server, port, args), cwd=env['BENCH_DATA_DIR'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        send = http_sender(port, headers)
+        if args.warmup:
+            run_load(send, 1, args.warmup)
+        return run_load(send, concurrency, args.requests)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def bench_inproc(env, headers, args, concurrency):
+    """Run the in-process benchmark in a child so each run imports a fresh app."""
+    command = [sys.executable, os.path.abspath(__file__), '--inproc-child',
+               '--requests', str(args.requests), '--warmup', str(args.warmup),
+               '--concurrency', str(concurrency), '--headers', json.dumps(headers)]
+    output = subprocess.run(command, cwd=env['BENCH_DATA_DIR'], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def inproc_child(args):
+    """Entry point of the in-process child: drive app.api_sleep via the test client."""
+    import logging
+    from app import app
+    logging.disable(logging.WARNING)
+    headers = json.loads(args.headers)
+
+    def make():
+        client = app.test_client()
+        return lambda: client.post('/api/sleep', headers=headers).status_code
+
+    if args.warmup:
+        run_load(make, 1, args.warmup)
+    result = run_load(make, int(args.concurrency), args.requests)
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--servers', default='inproc', help='inproc,flask,waitress,gunicorn')
+    parser.add_argument('--key-counts', default='1,10,100', help='comma-separated key-store sizes')
+    parser.add_argument('--auth', default='api_key,basic', help='api_key,basic')
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated client thread counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per run')
+    parser.add_argument('--warmup', type=int, default=10, help='warm-up requests per run')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='waitress/gunicorn threads')
+    parser.add_argument('--legacy-keys', action='store_true', help='store keys without key IDs')
+    parser.add_argument('--cache-ttl', type=float, default=300,
+                        help='verified-key cache TTL; 0 measures the full KDF on every request')
+    parser.add_argument('--output', default='bench_results.json', help='JSON result file')
+    parser.add_argument('--inproc-child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--headers', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.inproc_child:
+        inproc_child(args)
+        return
+
+    results = []
+    for key_count in parse_list(args.key_counts, int):
+        with tempfile.TemporaryDirectory(prefix='bench_api_sleep_') as data_dir:
+            print(f"Creating {key_count} keys...", file=sys.stderr)
+            api_key = create_key_file(os.path.join(data_dir, 'api_keys.json'), key_count,
+                                      legacy=args.legacy_keys)
+            env = app_environment(data_dir, args)
+            env['BENCH_DATA_DIR'] = data_dir
+
+            for server in parse_list(args.servers):
+                for auth_mode in parse_list(args.auth):
+                    headers = auth_headers(auth_mode, api_key)
+                    for concurrency in parse_list(args.concurrency, int):
+                        label = f"server={server} keys={key_count} auth={auth_mode} concurrency={concurrency}"
+                        print(f"Running {label}", file=sys.stderr)
+                        if server == 'inproc':
+                            summary = bench_inproc(env, headers, args, concurrency)
+                        else:
+                            summary = bench_server(server, env, headers, args, concurrency)
+                        summary.update({
+                            'server': server,
+                            'key_count': key_count,
+                            'auth': auth_mode,
+                            'concurrency': concurrency,
+                            'workers': args.workers if server == 'gunicorn' else 1,
+                            'threads': args.threads if server in ('waitress', 'gunicorn') else None,
+                        })
+                        latency = summary['latency_ms']
+                        if summary['succeeded']:
+                            print(f"  {summary['throughput_rps']:.1f} req/s, "
+                                  f"p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, "
+                                  f"p99 {latency['p99']:.2f} ms", file=sys.stderr)
+                        if summary['failed']:
+                            print(f"  FAILED: {summary['failed']} of {summary['requests']} requests "
+                                  f"({summary['status_counts']})", file=sys.stderr)
+                        results.append(summary)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'legacy_keys': args.legacy_keys,
+            'cache_ttl': args.cache_ttl,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    failed = sum(result['failed'] for result in results)
+    if failed:
+        print(f"{failed} requests did not get a 2xx response; the figures cover the rest only",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
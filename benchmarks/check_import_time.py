@@ -0,0 +1,95 @@
+"""
+Import-time budget check for server startup.
+
+Imports the app in a fresh interpreter with ``python -X importtime`` and
+fails (exit status 1) if:
+
+- a module that must stay lazy is imported at startup (boto3, botocore and
+  the AWS integration are only needed by /setup-aws-lambda), or
+- the cumulative import time of the app exceeds the budget.
+
+Each run uses a fresh temporary data directory and the simulated sleep
+backend. The fastest of ``--runs`` runs is compared with the budget, so a
+single slow run on a busy machine does not fail the check.
+
+Example:
+    python benchmarks/check_import_time.py --module app --budget-ms 1000
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Modules that must not be imported when a worker starts
+FORBIDDEN = ('boto3', 'botocore', 's3transfer', 'aws_integration', 'lambda_fleet')
+
+DEFAULT_BUDGET_MS = 1000
+
+
+def measure(module):
+    """
+    Import ``module`` in a new interpreter.
+
+    Returns:
+        dict: module name -> (self µs, cumulative µs)
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ,
+                   PYTHONPATH=ROOT,
+                   SLEEP_BACKENDS='simulated',
+                   METRICS_DIR=os.path.join(data_dir, 'metrics'),
+                   LOG_LEVEL='ERROR')
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                                cwd=data_dir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fail if server startup imports too much or takes too long.')
+    parser.add_argument('--module', default='app', help='module to import (default: app)')
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.environ.get('IMPORT_BUDGET_MS', DEFAULT_BUDGET_MS)),
+                        help='maximum cumulative import time (default: IMPORT_BUDGET_MS or 1000)')
+    parser.add_argument('--runs', type=int, default=3, help='imports to run; the fastest is checked')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    parser.add_argument('--forbid', default=','.join(FORBIDDEN),
+                        help='comma-separated modules that must not be imported')
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    fastest = min(runs, key=lambda times: times[args.module][1])
+    total_ms = fastest[args.module][1] / 1000
+
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms, "
+          f"fastest of {args.runs}), {len(fastest)} modules")
+    print("Slowest modules (self time):")
+    for name, (self_us, _) in sorted(fastest.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    forbidden = [name.strip() for name in args.forbid.split(',') if name.strip()]
+    imported = sorted(name for name in fastest if name.split('.')[0] in forbidden)
+    if imported:
+        failures.append(f"lazy modules imported at startup: {', '.join(imported)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""
+Controller mode: sleep a group of PCs with one call.
+
+Enabled with APP_ROLE=controller. The controller keeps a registry of agent
+hosts (other instances of this app) in the ``agent_hosts`` table and adds:
+
+- POST   /api/groups/<name>/sleep  forward /api/sleep to every host in the
+                                   group ("all" means every host)
+- GET    /api/hosts                list registered hosts
+- POST   /api/hosts                add or update a host (JSON: name,
+                                   endpoint_url, api_key, groups)
+- DELETE /api/hosts/<name>         remove a host
+
+The group endpoint calls all hosts concurrently (at most
+CONTROLLER_CONCURRENCY at a time) over pooled keep-alive connections, each
+with its own timeout (CONTROLLER_HOST_TIMEOUT), and streams one NDJSON line
+per host as results arrive, so a group finishes in roughly the time of its
+slowest host.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, request, jsonify
+from sqlalchemy import select
+from models import db, AgentHost
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_HOST_TIMEOUT = 5.0
+
+# Idle keep-alive connections kept per agent, and how long they stay usable
+MAX_IDLE_PER_HOST = 4
+IDLE_TIMEOUT = 60
+
+ALL_HOSTS = 'all'
+
+NDJSON = 'application/x-ndjson'
+
+
+def split_groups(value):
+    """Group names from a list or a ';'-separated string."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    return [group.strip() for group in value if group.strip()]
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to the agents, reused across calls."""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, origin, timeout):
+        """Return (connection, reused) for an origin (scheme, host, port)."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(origin, [])
+            while idle:
+                conn, released = idle.pop()
+                if now - released < self.idle_timeout:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+        scheme, host, port = origin
+        factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return factory(host, port, timeout=timeout), False
+
+    def _release(self, origin, conn):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def post(self, url, headers, timeout):
+        """
+        POST an empty body to ``url``.
+
+        A reused connection that the agent has closed in the meantime is
+        retried once on a fresh connection.
+
+        Returns:
+            tuple: (status, body bytes)
+        """
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        for attempt in range(2):
+            conn, reused = self._acquire(origin, timeout)
+            try:
+                conn.request('POST', path, body=b'', headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused or attempt:
+                    raise
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(origin, conn)
+            return response.status, body
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class GroupSleeper:
+    """Forwards sleep requests to many agents concurrently."""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, host_timeout=DEFAULT_HOST_TIMEOUT, pool=None):
+        self.host_timeout = host_timeout
+        self.pool = pool or ConnectionPool()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='controller')
+
+    def sleep_host(self, host):
+        """
+        Call one agent's /api/sleep.
+
+        Args:
+            host (dict): name, endpoint_url, api_key
+
+        Returns:
+            dict: per-host result line
+        """
+        started = time.perf_counter()
+        result = {'host': host['name']}
+        try:
+            status, body = self.pool.post(
+                host['endpoint_url'].rstrip('/') + '/api/sleep',
+                {'X-API-Key': host['api_key'], 'Content-Length': '0'},
+                self.host_timeout
+            )
+            result['status'] = status
+            result['ok'] = 200 <= status < 300
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = {}
+            if isinstance(payload, dict):
+                result['job_id'] = payload.get('job_id')
+                result['message'] = payload.get('message') or payload.get('error')
+        except Exception as e:
+            result['ok'] = False
+            result['error'] = 'timeout' if isinstance(e, TimeoutError) else str(e) or type(e).__name__
+        elapsed = time.perf_counter() - started
+        result['elapsed_ms'] = round(elapsed * 1000, 1)
+        metrics.AGENT_CALL_SECONDS.observe(elapsed, result='success' if result['ok'] else 'failure')
+        if not result['ok']:
+            logger.warning(f"Agent {host['name']} did not accept sleep: {result.get('error') or result.get('status')}")
+        return result
+
+    def sleep_hosts(self, hosts):
+        """Call every host concurrently and yield each result as it completes."""
+        futures = [self._executor.submit(self.sleep_host, host) for host in hosts]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self.pool.close()
+
+
+def host_to_dict(host, include_key=False):
+    data = {
+        'name': host.name,
+        'endpoint_url': host.endpoint_url,
+        'groups': split_groups(host.groups),
+        'created': host.created.isoformat(timespec='seconds') if host.created else None,
+    }
+    if include_key:
+        data['api_key'] = host.api_key
+    return data
+
+
+def hosts_in_group(group):
+    """Return the registered hosts of a group (every host for "all")."""
+    hosts = db.session.execute(select(AgentHost).order_by(AgentHost.name)).scalars().all()
+    if group == ALL_HOSTS:
+        return hosts
+    return [host for host in hosts if group in split_groups(host.groups)]
+
+
+def create_blueprint(authenticate, authenticate_admin, sleeper):
+    """
+    Build the controller routes.
+
+    Reading the registry and group sleeps accept API keys; registering and
+    removing hosts needs the administrator, since the registry holds the
+    agents' keys and endpoints.
+
+    Args:
+        authenticate: app.authenticate_api_request, returning (key_id, error)
+        authenticate_admin: app.authenticate_admin_request, returning (None, error)
+        sleeper (GroupSleeper): forwards the calls
+    """
+    bp = Blueprint('controller', __name__)
+
+    @bp.route('/api/groups/<name>/sleep', methods=['POST'])
+    def group_sleep(name):
+        """Sleep every host of a group, streaming one NDJSON line per host."""
+        _, error = authenticate()
+        if error:
+            return error
+
+        # Read the registry inside the request; the stream runs after it
+        hosts = [host_to_dict(host, include_key=True) for host in hosts_in_group(name)]
+        if not hosts:
+            return jsonify({"error": f"グループ {name} にホストが登録されていません"}), 404
+        logger.info(f"Group sleep for {name} ({len(hosts)} hosts) from {request.remote_addr}")
+
+        def stream():
+            started = time.perf_counter()
+            yield json.dumps({'event': 'start', 'group': name, 'hosts': len(hosts)}, ensure_ascii=False) + '\n'
+            succeeded = 0
+            for result in sleeper.sleep_hosts(hosts):
+                succeeded += result['ok']
+                yield json.dumps(dict(result, event='result'), ensure_ascii=False) + '\n'
+            yield json.dumps({
+                'event': 'done',
+                'group': name,
+                'succeeded': succeeded,
+                'failed': len(hosts) - succeeded,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            }, ensure_ascii=False) + '\n'
+
+        # Disable proxy buffering so progress reaches the client as it happens
+        return Response(stream(), mimetype=NDJSON, headers={'X-Accel-Buffering': 'no'})
+
+    @bp.route('/api/hosts', methods=['GET'])
+    def list_hosts():
+        _, error = authenticate()
+        if error:
+            return error
+        hosts = db.session.execute(select(AgentHost).order_by(AgentHost.name)).scalars().all()
+        return jsonify([host_to_dict(host) for host in hosts]), 200
+
+    @bp.route('/api/hosts', methods=['POST'])
+    def save_host():
+        """Register a host, or update it if the name exists."""
+        _, error = authenticate_admin()
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        missing = [field for field in ('name', 'endpoint_url', 'api_key') if not data.get(field)]
+        if missing:
+            return jsonify({"error": f"必須項目がありません: {', '.join(missing)}"}), 400
+        if urlsplit(data['endpoint_url']).scheme not in ('http', 'https'):
+            return jsonify({"error": "endpoint_url は http:// または https:// で始まる必要があります"}), 400
+
+        host = db.session.execute(select(AgentHost).filter_by(name=data['name'])).scalar_one_or_none()
+        created = host is None
+        if created:
+            host = AgentHost(name=data['name'])
+            db.session.add(host)
+        host.endpoint_url = data['endpoint_url']
+        host.api_key = data['api_key']
+        host.groups = ';'.join(split_groups(data.get('groups')))
+        db.session.commit()
+        logger.info(f"Agent host {'registered' if created else 'updated'}: {host.name}")
+        return jsonify(host_to_dict(host)), 201 if created else 200
+
+    @bp.route('/api/hosts/<name>', methods=['DELETE'])
+    def delete_host(name):
+        _, error = authenticate_admin()
+        if error:
+            return error
+        host = db.session.execute(select(AgentHost).filter_by(name=name)).scalar_one_or_none()
+        if host is None:
+            return jsonify({"error": "ホストが見つかりません"}), 404
+        db.session.delete(host)
+        db.session.commit()
+        logger.info(f"Agent host removed: {name}")
+        return '', 204
+
+    return bp
+
+
+def init_app(app, authenticate, authenticate_admin):
+    """
+    Register the controller endpoints on the Flask app.
+
+    Returns:
+        GroupSleeper: the fan-out worker, configured from CONTROLLER_* variables
+    """
+    sleeper = GroupSleeper(
+        concurrency=int(os.environ.get('CONTROLLER_CONCURRENCY', DEFAULT_CONCURRENCY)),
+        host_timeout=float(os.environ.get('CONTROLLER_HOST_TIMEOUT', DEFAULT_HOST_TIMEOUT)),
+    )
+    app.register_blueprint(create_blueprint(authenticate, authenticate_admin, sleeper))
+    logger.info("Controller mode enabled")
+    return sleeper
@@ -0,0 +1,86 @@
+"""
+In-process cache of recently verified API keys.
+
+Alexa sends the same X-API-Key on every call, so after a key has passed the
+(slow, scrypt-based) hash check once, later requests only need an HMAC and a
+dictionary lookup. Raw keys are never kept: entries are indexed by an
+HMAC-SHA256 digest of the key under a server secret.
+"""
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Default cache settings, overridable through environment variables
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 256
+
+
+class CredentialCache:
+    """Bounded LRU cache mapping key digests to verified key IDs, with a TTL."""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, secret=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._secret = secret or os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, api_key):
+        """Return the keyed digest used as the cache key for an API key."""
+        return hmac.new(self._secret, api_key.encode('utf-8'), hashlib.sha256).digest()
+
+    def get(self, api_key):
+        """Return the cached key ID for a verified key, or None on a miss."""
+        if self.ttl <= 0:
+            return None
+        digest = self.digest(api_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            key_id, expires = entry
+            if expires <= now:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return key_id
+
+    def put(self, api_key, key_id):
+        """Remember that an API key verified as key_id."""
+        if self.ttl <= 0:
+            return
+        digest = self.digest(api_key)
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[digest] = (key_id, expires)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key_id=None):
+        """Drop cached entries for one key ID, or everything if key_id is None."""
+        with self._lock:
+            if key_id is None:
+                self._entries.clear()
+                return
+            stale = [d for d, (cached_id, _) in self._entries.items() if cached_id == key_id]
+            for digest in stale:
+                del self._entries[digest]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def from_environment():
+    """Create a cache configured from API_KEY_CACHE_* environment variables."""
+    secret = os.environ.get('API_KEY_CACHE_SECRET')
+    return CredentialCache(
+        ttl=float(os.environ.get('API_KEY_CACHE_TTL', DEFAULT_TTL)),
+        max_size=int(os.environ.get('API_KEY_CACHE_SIZE', DEFAULT_MAX_SIZE)),
+        secret=secret.encode('utf-8') if secret else None,
+    )
@@ -0,0 +1,297 @@
+"""
+SQLite persistence for API keys, sleep history and settings.
+
+The database runs in WAL mode so several server workers can read while one
+writes. API key lookups still go through the in-memory index of
+``SqlKeyStore``; workers notice each other's changes through a generation
+value in the settings table, and ``last_used`` timestamps are written in
+batches by a background thread instead of on the request path.
+"""
+import os
+import atexit
+import hashlib
+import logging
+import secrets
+import datetime
+import threading
+from sqlalchemy import event, inspect, select, update, insert
+from sqlalchemy.schema import CreateColumn
+from models import db, ApiKey, SleepEvent, Setting
+from key_store import BaseKeyStore, ApiKeyStore, DEFAULT_RECHECK_INTERVAL
+from file_lock import locked
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_URL = 'sqlite:///alexa_sleep.db'
+
+# Seconds between batched writes of API key last_used timestamps
+LAST_USED_FLUSH_INTERVAL = 30
+
+# Settings keys used internally
+KEYS_GENERATION = 'keys_generation'
+API_KEYS_JSON_IMPORTED = 'api_keys_json_imported'
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Enable WAL mode and a busy timeout on every new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
+def init_app(app):
+    """
+    Configure the database for the Flask app and create missing tables.
+
+    Returns:
+        Engine: the SQLAlchemy engine
+    """
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI',
+                          os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _configure_sqlite)
+
+        # Several workers may start at once; create the schema one at a time
+        os.makedirs(app.instance_path, exist_ok=True)
+        with locked(os.path.join(app.instance_path, 'schema')):
+            db.create_all()
+            _add_missing_columns(engine)
+
+    # Workers forked from a preloaded master must not share its pooled connections
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+    return engine
+
+
+def _add_missing_columns(engine):
+    """
+    Add columns introduced after a table was created.
+
+    create_all() only creates missing tables; new columns must be nullable
+    or have a server default so existing rows stay valid.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                    logger.info(f"Added column {table.name}.{column.name}")
+
+
+def get_setting(conn, key, default=None):
+    """Read a setting value using an open connection."""
+    value = conn.execute(select(Setting.value).where(Setting.key == key)).scalar()
+    return default if value is None else value
+
+
+def set_setting(conn, key, value):
+    """Insert or update a setting using an open connection."""
+    now = datetime.datetime.now()
+    result = conn.execute(update(Setting).where(Setting.key == key).values(value=value, updated=now))
+    if result.rowcount == 0:
+        conn.execute(insert(Setting).values(key=key, value=value, updated=now))
+
+
+def _legacy_key_id(key_hash):
+    """Stable row ID for a legacy hash-only key."""
+    return f"legacy-{hashlib.sha256(key_hash.encode('utf-8')).hexdigest()[:12]}"
+
+
+class SqlKeyStore(BaseKeyStore):
+    """Key store backed by the ``api_keys`` table."""
+
+    def __init__(self, engine, recheck_interval=DEFAULT_RECHECK_INTERVAL, on_reload=None,
+                 flush_interval=LAST_USED_FLUSH_INTERVAL):
+        super().__init__(recheck_interval, on_reload)
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self._generation = None
+        self._last_used = {}
+        # Guards _last_used between request threads (touch) and the flusher
+        self._last_used_lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Restart the flusher lazily in a forked worker; the parent's thread is gone."""
+        self._flusher = None
+        self._stop = threading.Event()
+        self._last_used = {}
+        self._last_used_lock = threading.Lock()
+
+    def _read_generation(self, conn):
+        return get_setting(conn, KEYS_GENERATION, '')
+
+    def _changed(self):
+        with self.engine.connect() as conn:
+            return self._read_generation(conn) != self._generation
+
+    def _load(self):
+        with self.engine.connect() as conn:
+            generation = self._read_generation(conn)
+            rows = conn.execute(
+                select(ApiKey.id, ApiKey.key_hash, ApiKey.created, ApiKey.legacy)
+                .where(ApiKey.revoked.is_(False))
+            ).all()
+
+        keys, legacy = {}, []
+        for row in rows:
+            if row.legacy:
+                legacy.append(row.key_hash)
+            else:
+                keys[row.id] = {
+                    'hash': row.key_hash,
+                    'created': row.created.isoformat(timespec='seconds'),
+                }
+        self.keys, self.legacy = keys, legacy
+        self._generation = generation
+
+    def update(self, mutate):
+        """
+        Apply ``mutate(store)`` to the current keys and write the difference.
+
+        New keys become new rows and removed keys are marked revoked, so
+        concurrent writers in other workers never overwrite each other.
+        """
+        with self._reload_lock:
+            self._load()
+            before_keys, before_legacy = dict(self.keys), list(self.legacy)
+            self.keys, self.legacy = dict(self.keys), list(self.legacy)
+            result = mutate(self)
+
+            added = [key_id for key_id in self.keys if key_id not in before_keys]
+            removed = [key_id for key_id in before_keys if key_id not in self.keys]
+            removed += [_legacy_key_id(h) for h in before_legacy if h not in self.legacy]
+
+            with self.engine.begin() as conn:
+                for key_id in added:
+                    conn.execute(insert(ApiKey).values(
+                        id=key_id,
+                        key_hash=self.keys[key_id]['hash'],
+                        created=datetime.datetime.fromisoformat(self.keys[key_id]['created']),
+                    ))
+                if removed:
+                    conn.execute(update(ApiKey).where(ApiKey.id.in_(removed)).values(revoked=True))
+                generation = secrets.token_hex(8)
+                set_setting(conn, KEYS_GENERATION, generation)
+            self._generation = generation
+            self._next_check = 0.0
+        if self.on_reload:
+            self.on_reload()
+        return result
+
+    def import_json(self, path):
+        """
+        Copy keys from an ``api_keys.json`` file into the database, once.
+
+        Both key-ID and legacy hash-only entries are imported; the file is left
+        in place.
+        """
+        if not os.path.exists(path):
+            return 0
+        with locked(path):
+            with self.engine.begin() as conn:
+                if get_setting(conn, API_KEYS_JSON_IMPORTED):
+                    return 0
+                source = ApiKeyStore(path)
+                source._load()
+                existing = set(conn.execute(select(ApiKey.id)).scalars())
+
+                rows = []
+                for key_id, entry in source.keys.items():
+                    rows.append({
+                        'id': key_id,
+                        'key_hash': entry['hash'],
+                        'created': datetime.datetime.fromisoformat(entry['created']),
+                        'legacy': False,
+                    })
+                for key_hash in source.legacy:
+                    rows.append({
+                        'id': _legacy_key_id(key_hash),
+                        'key_hash': key_hash,
+                        'created': datetime.datetime.now(),
+                        'legacy': True,
+                    })
+                rows = [row for row in rows if row['id'] not in existing]
+                if rows:
+                    conn.execute(insert(ApiKey), rows)
+                set_setting(conn, API_KEYS_JSON_IMPORTED, datetime.datetime.now().isoformat())
+                set_setting(conn, KEYS_GENERATION, secrets.token_hex(8))
+
+        logger.info(f"Imported {len(rows)} API keys from {path}")
+        return len(rows)
+
+    def touch(self, key_id):
+        """Queue a last_used update for a key; written by the flusher thread."""
+        used = datetime.datetime.now()
+        with self._last_used_lock:
+            self._last_used[key_id] = used
+        if self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._reload_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='last-used-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write queued last_used timestamps in one transaction."""
+        with self._last_used_lock:
+            pending, self._last_used = self._last_used, {}
+        if not pending:
+            return
+        try:
+            with self.engine.begin() as conn:
+                for key_id, used in pending.items():
+                    conn.execute(update(ApiKey).where(ApiKey.id == key_id).values(last_used=used))
+        except Exception as e:
+            logger.error(f"Error writing API key last_used times: {e}")
+
+    def close(self):
+        """Stop the flusher thread and write anything still queued."""
+        self._stop.set()
+        self.flush()
+
+
+def record_sleep_event(timestamp, ip, user_agent, key_id, success, message, coalesced=False):
+    """Store a sleep request in the history table."""
+    try:
+        db.session.add(SleepEvent(
+            timestamp=timestamp,
+            ip=ip,
+            user_agent=user_agent,
+            key_id=key_id,
+            success=success,
+            message=message,
+            coalesced=coalesced,
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error recording sleep event: {e}")
+
+
+def recent_sleep_events(limit=20):
+    """Return the most recent sleep events, oldest first."""
+    events = db.session.execute(
+        select(SleepEvent).order_by(SleepEvent.timestamp.desc()).limit(limit)
+    ).scalars().all()
+    return list(reversed(events))
@@ -0,0 +1,313 @@
+"""
+Live dashboard events (Server-Sent Events and long-poll).
+
+One watcher thread per process turns changes in the shared stores into
+events:
+
+- ``sleep``: new records in the shared sleep-history ring, found by reading
+  its write index (every worker appends to the same ring)
+- ``job``: power job status changes, read from the ``power_jobs`` table
+
+Each event is encoded as an SSE frame once and handed to every open stream,
+so many dashboards cost one small write per event instead of one full page
+render per refresh, and the stores are polled once per process however many
+dashboards are open. The watcher only runs while someone is listening.
+
+Sleep events use the ring sequence number as their SSE id. It is the same in
+every worker, so a reconnecting EventSource (Last-Event-ID) or a long-poll
+client (``?after=``) gets exactly the records it missed from whichever worker
+answers. Job events carry no id; a new stream starts with the jobs that are
+still queued or running.
+"""
+import os
+import json
+import logging
+import datetime
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 0.5
+# Events kept in memory for streams that fall behind; older ones come from the ring
+DEFAULT_BACKLOG = 256
+DEFAULT_MAX_STREAMS = 4
+# Seconds between keep-alive comments, and before a stream is ended to free its thread
+DEFAULT_HEARTBEAT = 15
+DEFAULT_STREAM_SECONDS = 300
+
+# Event types
+SLEEP = 'sleep'
+JOB = 'job'
+
+# version: position in this process's event sequence (None for replayed events)
+Event = namedtuple('Event', 'version kind id data frame')
+
+
+def format_frame(kind, data, event_id=None):
+    """Encode one SSE frame."""
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {kind}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def sleep_event_data(record):
+    """JSON-safe form of a sleep-history ring record."""
+    return {
+        'seq': record['seq'],
+        'timestamp': record['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        'ip': record['ip'],
+        'user_agent': record['user_agent'],
+        'success': record['success'],
+        'coalesced': record['coalesced'],
+        'latency_ms': round(record['latency_ms'], 1),
+    }
+
+
+class Cursor:
+    """Position of one stream: the last bus version and sleep record it was sent."""
+
+    def __init__(self, bus, after_seq):
+        self.bus = bus
+        self.version = bus.version
+        self.last_seq = after_seq
+
+    def _unseen(self, events):
+        unseen = []
+        for event in events:
+            if event.kind == SLEEP:
+                if event.id <= self.last_seq:
+                    continue
+                self.last_seq = event.id
+            unseen.append(event)
+        return unseen
+
+    def missed(self):
+        """Sleep records written after the client's last one."""
+        return self._unseen(self.bus.replay(self.last_seq))
+
+    def start(self):
+        """Events to send first on a new stream: missed records, then jobs in progress."""
+        return self.missed() + self.bus.active_jobs()
+
+    def take(self, events, complete=True):
+        """Advance past the result of EventBus.wait() and return what to send."""
+        if not events:
+            return []
+        self.version = events[-1].version
+        if not complete:
+            # Fell behind the in-memory buffer: take sleep records from the ring
+            events = self.bus.replay(self.last_seq) + [event for event in events if event.kind != SLEEP]
+        return self._unseen(events)
+
+
+class EventBus:
+    """Broadcasts sleep and job events to the streams of this process."""
+
+    def __init__(self, history, load_jobs=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 backlog=DEFAULT_BACKLOG, max_streams=DEFAULT_MAX_STREAMS,
+                 heartbeat=DEFAULT_HEARTBEAT, stream_seconds=DEFAULT_STREAM_SECONDS):
+        """
+        Args:
+            history (SleepHistoryRing): shared sleep history
+            load_jobs (callable): load_jobs(since) returning job_to_dict() of
+                jobs unfinished or finished at or after ``since``
+            poll_interval (float): seconds between checks of the stores
+            backlog (int): recent events kept in memory for slow streams
+            max_streams (int): streams that may hold a server thread at once
+            heartbeat (float): seconds between keep-alive comments on a stream
+            stream_seconds (float): how long a thread-holding stream stays open
+        """
+        self.history = history
+        self.load_jobs = load_jobs
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.stream_seconds = stream_seconds
+
+        self._events = deque(maxlen=backlog)
+        self._version = 0
+        self._cond = threading.Condition()
+        self._listeners = set()
+        self._subscribers = 0
+        self._blocking_streams = 0
+        self._thread = None
+
+        # Watcher state
+        self._ring_cursor = None
+        self._jobs = {}
+        self._jobs_since = None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    # Subscribers ----------------------------------------------------------
+
+    def subscribe(self, listener=None, blocking=True):
+        """
+        Register a stream and start the watcher if needed.
+
+        Args:
+            listener (callable): called with no arguments, from the watcher
+                thread, after new events are published (for event loops)
+            blocking (bool): the stream holds a server thread while it waits;
+                at most ``max_streams`` of those are allowed
+
+        Returns:
+            bool: False if the stream was refused
+        """
+        with self._cond:
+            if blocking:
+                if self._blocking_streams >= self.max_streams:
+                    return False
+                self._blocking_streams += 1
+            if listener is not None:
+                self._listeners.add(listener)
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-watcher', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return True
+
+    def unsubscribe(self, listener=None, blocking=True):
+        with self._cond:
+            if blocking:
+                self._blocking_streams -= 1
+            self._listeners.discard(listener)
+            self._subscribers -= 1
+
+    def wake(self):
+        """Check the stores now instead of at the next poll."""
+        with self._cond:
+            self._cond.notify_all()
+
+    # Reading --------------------------------------------------------------
+
+    def events_after(self, version):
+        """
+        Return the buffered events newer than ``version``.
+
+        Returns:
+            tuple: (events, complete); complete is False if some events were
+            already dropped from the buffer
+        """
+        with self._cond:
+            events = [event for event in self._events if event.version > version]
+        complete = not events or events[0].version == version + 1
+        return events, complete
+
+    def wait(self, version, timeout):
+        """Block until there are events newer than ``version`` or ``timeout`` passes."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version > version, timeout)
+        return self.events_after(version)
+
+    def replay(self, after_seq, limit=DEFAULT_BACKLOG):
+        """Sleep events with a ring sequence number above ``after_seq``, oldest first."""
+        events = []
+        for record in self.history.recent(limit, after=after_seq):
+            data = sleep_event_data(record)
+            events.append(Event(None, SLEEP, record['seq'], data, format_frame(SLEEP, data, record['seq'])))
+        return events
+
+    def cursor(self, after_seq=None):
+        """New stream position; ``after_seq`` None means only new events."""
+        return Cursor(self, self.last_id if after_seq is None else after_seq)
+
+    def active_jobs(self):
+        """Job events for the jobs currently queued or running."""
+        with self._cond:
+            jobs = [job for job in self._jobs.values() if not job['finished']]
+        return [Event(None, JOB, None, job, format_frame(JOB, job)) for job in jobs]
+
+    @property
+    def last_id(self):
+        """Sequence number of the newest sleep record."""
+        return self.history.write_index - 1
+
+    # Watcher --------------------------------------------------------------
+
+    def _publish(self, items):
+        with self._cond:
+            for kind, data, event_id in items:
+                self._version += 1
+                self._events.append(Event(self._version, kind, event_id, data,
+                                          format_frame(kind, data, event_id)))
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def _poll_ring(self):
+        end = self.history.write_index
+        if self._ring_cursor is None:
+            self._ring_cursor = end - 1
+        if end - 1 <= self._ring_cursor:
+            return []
+        records = self.history.recent(DEFAULT_BACKLOG, after=self._ring_cursor)
+        self._ring_cursor = end - 1
+        return [(SLEEP, sleep_event_data(record), record['seq']) for record in records]
+
+    def _poll_jobs(self):
+        if self.load_jobs is None:
+            return []
+        now = datetime.datetime.now()
+        since = self._jobs_since or now
+        # Finish times come from other workers' clocks too; look back a little
+        jobs = self.load_jobs(since - datetime.timedelta(seconds=2 * self.poll_interval + 1))
+        self._jobs_since = now
+
+        items = []
+        seen = {}
+        for job in jobs:
+            seen[job['job_id']] = job
+            known = self._jobs.get(job['job_id'])
+            if known is None or known['status'] != job['status']:
+                items.append((JOB, job, None))
+        with self._cond:
+            self._jobs = seen
+        return items
+
+    def poll(self):
+        """Check the stores once and publish what changed."""
+        items = self._poll_ring()
+        try:
+            items += self._poll_jobs()
+        except Exception:
+            logger.exception("Error reading power jobs for live events")
+        if items:
+            self._publish(items)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._subscribers:
+                    # Nobody listening: forget the cursors and sleep until a subscriber arrives
+                    self._ring_cursor = None
+                    self._jobs_since = None
+                    self._cond.wait_for(lambda: self._subscribers > 0)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Error polling for live events")
+            with self._cond:
+                self._cond.wait(self.poll_interval)
+
+
+def from_environment(history, load_jobs=None):
+    """Create an event bus configured from EVENTS_* environment variables."""
+    return EventBus(
+        history,
+        load_jobs=load_jobs,
+        poll_interval=float(os.environ.get('EVENTS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)),
+        max_streams=int(os.environ.get('EVENTS_MAX_STREAMS', DEFAULT_MAX_STREAMS)),
+        heartbeat=float(os.environ.get('EVENTS_HEARTBEAT', DEFAULT_HEARTBEAT)),
+        stream_seconds=float(os.environ.get('EVENTS_STREAM_SECONDS', DEFAULT_STREAM_SECONDS)),
+    )
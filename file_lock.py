@@ -0,0 +1,106 @@
+"""
+Cross-process file helpers: advisory locks and atomic replacement.
+
+Used wherever several server workers (gunicorn, waitress, the Windows service)
+may write the same data file at once.
+"""
+import os
+import time
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# How long to keep retrying a Windows lock before giving up (seconds)
+WINDOWS_LOCK_TIMEOUT = 30
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive advisory lock for ``path`` while the block runs.
+
+    The lock lives in a sidecar ``<path>.lock`` file so the data file itself
+    can be atomically replaced while the lock is held.
+    """
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            deadline = time.monotonic() + WINDOWS_LOCK_TIMEOUT
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+def try_lock(path):
+    """
+    Take the exclusive advisory lock for ``path`` without waiting.
+
+    The lock is held until the returned descriptor is closed or the process
+    exits, so it can mark one process out of several (e.g. a leader).
+
+    Returns:
+        int: the lock file descriptor, or None if another process holds it
+    """
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def atomic_write(path, data):
+    """
+    Replace ``path`` with ``data`` (bytes) so readers never see a partial file.
+
+    The data goes to a temporary file in the same directory, is flushed and
+    fsynced, then renamed over the target.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if hasattr(os, 'O_DIRECTORY'):
+        # Persist the rename itself (POSIX only)
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -0,0 +1,191 @@
+"""
+Shared sleep-history ring buffer.
+
+A fixed-size, memory-mapped file of fixed-width records that every server
+worker appends to, so the dashboard sees one history rather than a per-worker
+subset. Writers serialise on a short advisory lock to claim a slot; readers
+take no lock at all and instead validate each record with the sequence number
+stored at both ends of it (a seqlock), skipping records that are mid-write.
+"""
+import os
+import mmap
+import zlib
+import socket
+import struct
+import logging
+import datetime
+import threading
+from file_lock import locked
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 100000
+
+MAGIC = b'ASLH'
+VERSION = 1
+
+# magic, version, capacity, record size, next sequence number
+HEADER = struct.Struct('<4sIIIQ')
+HEADER_SIZE = 64
+WRITE_INDEX_OFFSET = 16
+
+# seq, timestamp, latency (ms), outcome, IP family, IP, user-agent CRC32,
+# user-agent (UTF-8, truncated), seq again
+RECORD = struct.Struct('<QdfBB2x16sI96sQ')
+SEQ = struct.Struct('<Q')
+USER_AGENT_BYTES = 96
+
+# Outcome codes
+OUTCOME_UNKNOWN = 0
+OUTCOME_SUCCESS = 1
+OUTCOME_FAILURE = 2
+# Flag added to the outcome of a request that shared another request's job
+OUTCOME_COALESCED = 0x80
+
+
+def _pack_ip(ip):
+    """Return (family, 16 packed bytes) for an IP address string."""
+    if ip:
+        for family, code in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+            try:
+                return code, socket.inet_pton(family, ip)
+            except (OSError, ValueError):
+                pass
+    return 0, (ip or '').encode('utf-8')[:16]
+
+
+def _unpack_ip(family, packed):
+    if family == 4:
+        return socket.inet_ntop(socket.AF_INET, packed[:4])
+    if family == 6:
+        return socket.inet_ntop(socket.AF_INET6, packed)
+    return packed.rstrip(b'\0').decode('utf-8', errors='replace')
+
+
+def _truncate_utf8(text, size):
+    data = text.encode('utf-8')[:size]
+    return data.decode('utf-8', errors='ignore').encode('utf-8')
+
+
+class SleepHistoryRing:
+    """Memory-mapped ring of sleep request records shared across processes."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self._local_lock = threading.Lock()
+        with locked(path):
+            if not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE:
+                self._create(capacity)
+            self._file = open(path, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, file_capacity, record_size, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a compatible sleep history file")
+        if file_capacity != capacity:
+            logger.warning(f"{path} holds {file_capacity} entries; ignoring configured size {capacity}")
+        self.capacity = file_capacity
+
+    def _create(self, capacity):
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, capacity, RECORD.size, 0).ljust(HEADER_SIZE, b'\0'))
+            f.truncate(HEADER_SIZE + capacity * RECORD.size)
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * RECORD.size
+
+    @property
+    def write_index(self):
+        """Sequence number the next record will get (total records written)."""
+        return SEQ.unpack_from(self._map, WRITE_INDEX_OFFSET)[0]
+
+    def append(self, timestamp, ip, user_agent, outcome=OUTCOME_UNKNOWN, latency_ms=0.0):
+        """
+        Add a record.
+
+        Args:
+            timestamp (datetime): when the request arrived
+            ip (str): client IP address
+            user_agent (str): client user agent (truncated to 96 bytes)
+            outcome (int): one of the OUTCOME_* codes, optionally with
+                OUTCOME_COALESCED set
+            latency_ms (float): time from request to result
+
+        Returns:
+            int: the record's sequence number
+        """
+        family, packed_ip = _pack_ip(ip)
+        user_agent = user_agent or ''
+        body = RECORD.pack(
+            0,
+            timestamp.timestamp(),
+            latency_ms,
+            outcome,
+            family,
+            packed_ip,
+            zlib.crc32(user_agent.encode('utf-8')),
+            _truncate_utf8(user_agent, USER_AGENT_BYTES),
+            0,
+        )
+
+        with self._local_lock, locked(self.path):
+            seq = self.write_index
+            offset = self._offset(seq)
+            marker = SEQ.pack(seq + 1)
+            # Leading sequence first, payload, trailing sequence last
+            self._map[offset:offset + SEQ.size] = marker
+            self._map[offset + SEQ.size:offset + RECORD.size - SEQ.size] = body[SEQ.size:-SEQ.size]
+            self._map[offset + RECORD.size - SEQ.size:offset + RECORD.size] = marker
+            SEQ.pack_into(self._map, WRITE_INDEX_OFFSET, seq + 1)
+        return seq
+
+    def _read(self, seq):
+        """Read one record without locking; None if it was overwritten or is mid-write."""
+        offset = self._offset(seq)
+        end = offset + RECORD.size
+        # Mirror image of the write order: trailing sequence, payload, leading sequence
+        trailing = SEQ.unpack_from(self._map, end - SEQ.size)[0]
+        payload = self._map[offset + SEQ.size:end - SEQ.size]
+        leading = SEQ.unpack_from(self._map, offset)[0]
+        if leading != seq + 1 or trailing != seq + 1:
+            return None
+
+        (_, timestamp, latency_ms, outcome, family, packed_ip,
+         ua_hash, user_agent, _) = RECORD.unpack(SEQ.pack(0) + payload + SEQ.pack(0))
+        return {
+            'seq': seq,
+            'timestamp': datetime.datetime.fromtimestamp(timestamp),
+            'ip': _unpack_ip(family, packed_ip),
+            'user_agent': user_agent.rstrip(b'\0').decode('utf-8', errors='replace'),
+            'user_agent_hash': ua_hash,
+            'outcome': outcome & ~OUTCOME_COALESCED,
+            'success': {OUTCOME_SUCCESS: True, OUTCOME_FAILURE: False}.get(outcome & ~OUTCOME_COALESCED),
+            'coalesced': bool(outcome & OUTCOME_COALESCED),
+            'latency_ms': latency_ms,
+        }
+
+    def recent(self, limit=20, after=None):
+        """
+        Return up to ``limit`` of the newest records, oldest first.
+
+        Args:
+            after (int): only return records with a sequence number above this
+        """
+        end = self.write_index
+        start = max(0, end - min(limit, self.capacity))
+        if after is not None:
+            start = max(start, after + 1)
+        records = (self._read(seq) for seq in range(start, end))
+        return [record for record in records if record is not None]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def from_environment():
+    """Open the ring named by SLEEP_HISTORY_FILE with SLEEP_HISTORY_SIZE entries."""
+    return SleepHistoryRing(
+        os.environ.get('SLEEP_HISTORY_FILE', 'sleep_history.ring'),
+        capacity=int(os.environ.get('SLEEP_HISTORY_SIZE', DEFAULT_CAPACITY)),
+    )
@@ -0,0 +1,234 @@
+"""
+Background execution of power actions.
+
+``/api/sleep`` only queues a job and returns ``202 Accepted`` with its ID; the
+slow OS call runs on a worker thread here. Job state is kept in the
+``power_jobs`` table so ``GET /api/jobs/<id>`` works from any server worker.
+
+Requests for an action that is already queued or running, or that finished
+less than ``coalesce_window`` seconds ago, attach to that job instead of
+creating a new one, so retries and bursts share one result. Each attached
+request is still reported (``on_coalesced``) once the job it shares has
+finished, so the history counts every request.
+"""
+import time
+import uuid
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import delete, select, or_
+from models import db, PowerJob
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Finished jobs older than this are deleted when new jobs are submitted
+DEFAULT_RETENTION_DAYS = 7
+
+
+def job_to_dict(job):
+    """Serialise a PowerJob row for the JSON API."""
+    def iso(value):
+        return value.isoformat(timespec='seconds') if value else None
+
+    return {
+        'job_id': job.id,
+        'action': job.action,
+        'status': job.status,
+        'message': job.message,
+        'created': iso(job.created),
+        'started': iso(job.started),
+        'finished': iso(job.finished),
+    }
+
+
+class JobExecutor:
+    """Runs power actions on a small thread pool and records their results."""
+
+    def __init__(self, app, actions, max_workers=1, retention_days=DEFAULT_RETENTION_DAYS,
+                 on_finished=None, on_coalesced=None, coalesce_window=0.0):
+        """
+        Args:
+            app (Flask): app whose database holds the job table
+            actions (dict): action name -> callable returning (success, message)
+            max_workers (int): number of actions that may run at once
+            retention_days (int): how long finished jobs are kept
+            on_finished (callable): called as on_finished(job) inside an app
+                context after each job completes
+            on_coalesced (callable): called as on_coalesced(job, created, ip,
+                user_agent, key_id) inside an app context for each request
+                attached to another job, once that job has finished
+            coalesce_window (float): seconds after a job finishes during which
+                new requests for the same action reuse it
+        """
+        self.app = app
+        self.actions = actions
+        self.retention = datetime.timedelta(days=retention_days)
+        self.on_finished = on_finished
+        self.on_coalesced = on_coalesced
+        self.coalesce_window = coalesce_window
+        # action -> (job_id, monotonic finish time or None while unfinished)
+        self._latest = {}
+        # job ID -> requests attached to it while it is unfinished
+        self._attached = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='power-job')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        """Number of jobs submitted by this process that have not finished."""
+        return self._pending
+
+    def submit(self, action, ip=None, user_agent=None, key_id=None):
+        """
+        Queue a power action.
+
+        Returns:
+            str: the job ID (an existing one if the request was coalesced)
+
+        Raises:
+            ValueError: if the action is unknown
+        """
+        if action not in self.actions:
+            raise ValueError(f"Unknown power action: {action}")
+
+        attached = {'created': datetime.datetime.now(), 'ip': ip, 'user_agent': user_agent, 'key_id': key_id}
+        coalesced = None
+        with self._lock:
+            latest = self._latest.get(action)
+            if latest is not None:
+                job_id, finished_at = latest
+                if finished_at is None:
+                    # Reported when the job finishes
+                    self._attached.setdefault(job_id, []).append(attached)
+                    coalesced = job_id
+                elif time.monotonic() - finished_at < self.coalesce_window:
+                    coalesced = job_id
+        if coalesced is not None:
+            logger.info(f"Power request coalesced into job {coalesced}: {action}")
+            if finished_at is not None:
+                self._report_coalesced(coalesced, [attached])
+            return coalesced
+
+        job = PowerJob(
+            id=uuid.uuid4().hex,
+            action=action,
+            status=QUEUED,
+            ip=ip,
+            user_agent=user_agent,
+            key_id=key_id,
+        )
+        db.session.add(job)
+        db.session.execute(
+            delete(PowerJob)
+            .where(PowerJob.finished.is_not(None))
+            .where(PowerJob.created < datetime.datetime.now() - self.retention)
+        )
+        db.session.commit()
+
+        with self._lock:
+            latest = self._latest.get(action)
+            if latest is not None and latest[1] is None:
+                # Another thread queued the same action meanwhile; attach to it
+                self._attached.setdefault(latest[0], []).append(attached)
+                self._discard(job.id)
+                return latest[0]
+            self._latest[action] = (job.id, None)
+            self._attached[job.id] = []
+            self._pending += 1
+        self._executor.submit(self._run, job.id, action)
+        logger.info(f"Power job {job.id} queued: {action}")
+        return job.id
+
+    def get(self, job_id):
+        """Return the job row, or None if it does not exist."""
+        return db.session.get(PowerJob, job_id)
+
+    def changed_since(self, since):
+        """
+        Return jobs still queued or running, or finished at or after ``since``.
+
+        Returns:
+            list: job_to_dict() of each job, oldest first
+        """
+        with self.app.app_context():
+            rows = db.session.execute(
+                select(PowerJob)
+                .where(or_(PowerJob.finished.is_(None), PowerJob.finished >= since))
+                .order_by(PowerJob.created)
+            ).scalars()
+            return [job_to_dict(job) for job in rows]
+
+    def _finish(self, job_id, action):
+        """Mark a job finished for coalescing; returns the requests attached to it."""
+        with self._lock:
+            if self._latest.get(action, (None,))[0] == job_id and self._latest[action][1] is None:
+                self._latest[action] = (job_id, time.monotonic())
+            return self._attached.pop(job_id, [])
+
+    def _report_coalesced(self, job_id, requests):
+        """Pass requests that shared a finished job to on_coalesced."""
+        if not self.on_coalesced or not requests:
+            return
+        job = db.session.get(PowerJob, job_id)
+        if job is None or job.finished is None:
+            return
+        for attached in requests:
+            try:
+                self.on_coalesced(job, **attached)
+            except Exception:
+                logger.exception(f"Error recording a request coalesced into job {job_id}")
+
+    def _discard(self, job_id):
+        """Delete a job row that lost a coalescing race before it was run."""
+        job = db.session.get(PowerJob, job_id)
+        if job is not None:
+            db.session.delete(job)
+            db.session.commit()
+
+    def _run(self, job_id, action):
+        try:
+            with self.app.app_context():
+                job = db.session.get(PowerJob, job_id)
+                job.status = RUNNING
+                job.started = datetime.datetime.now()
+                db.session.commit()
+
+                try:
+                    success, message = self.actions[job.action]()
+                except Exception as e:
+                    logger.exception(f"Power job {job_id} raised an error")
+                    success, message = False, str(e)
+
+                job.status = SUCCEEDED if success else FAILED
+                job.message = message
+                job.finished = datetime.datetime.now()
+                db.session.commit()
+                # Requests arriving from now on see a finished job
+                attached = self._finish(job_id, action)
+
+                if success:
+                    logger.info(f"Power job {job_id} succeeded: {message}")
+                else:
+                    logger.error(f"Power job {job_id} failed: {message}")
+
+                if self.on_finished:
+                    self.on_finished(job)
+                self._report_coalesced(job_id, attached)
+        except Exception:
+            logger.exception(f"Error running power job {job_id}")
+        finally:
+            self._finish(job_id, action)
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and optionally wait for running ones."""
+        self._executor.shutdown(wait=wait)
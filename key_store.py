@@ -0,0 +1,235 @@
+"""
+API key store indexed by public key ID.
+
+Keys issued by ``auth.create_api_key`` look like ``<key_id>.<secret>``. Only the
+hash of the full key is stored, under its key ID, so verifying a key costs one
+hash check no matter how many keys exist. Hash-only entries written before key
+IDs were introduced are kept as "legacy" hashes and still verify by scanning.
+
+Stores keep the key index in memory and only reload it when the backing
+storage reports a change, so the request path does no file parsing.
+``ApiKeyStore`` is backed by ``api_keys.json``; ``database.SqlKeyStore``
+by the SQLite database.
+"""
+import os
+import json
+import time
+import secrets
+import logging
+import datetime
+import threading
+import metrics
+from werkzeug.security import check_password_hash
+from file_lock import locked, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Separator between the public key ID and the secret part of an API key
+KEY_ID_SEPARATOR = '.'
+
+# Number of random bytes in a key ID (hex-encoded, so 8 characters)
+KEY_ID_BYTES = 4
+
+STORE_VERSION = 2
+
+# Minimum seconds between checks of the backing storage for changes
+DEFAULT_RECHECK_INTERVAL = 1.0
+
+
+def split_api_key(api_key):
+    """
+    Split an API key into its key ID and secret.
+
+    Returns:
+        tuple: (key_id, secret), or (None, api_key) for legacy keys without an ID
+    """
+    key_id, sep, secret = api_key.partition(KEY_ID_SEPARATOR)
+    if not sep or not key_id or not secret:
+        return None, api_key
+    return key_id, secret
+
+
+class BaseKeyStore:
+    """
+    In-memory API key index shared by the storage backends.
+
+    Subclasses implement ``_changed()``, ``_load()`` and ``update()``.
+    """
+
+    def __init__(self, recheck_interval=DEFAULT_RECHECK_INTERVAL, on_reload=None):
+        self.recheck_interval = recheck_interval
+        self.on_reload = on_reload
+        self.keys = {}
+        self.legacy = []
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _changed(self):
+        """Return True if the backing storage changed since the last load."""
+        raise NotImplementedError
+
+    def _load(self):
+        """Replace ``keys`` and ``legacy`` with the stored state."""
+        raise NotImplementedError
+
+    def update(self, mutate):
+        """
+        Apply ``mutate(store)`` to the latest stored state and persist it.
+
+        Returns:
+            whatever ``mutate`` returns
+        """
+        raise NotImplementedError
+
+    def refresh(self, force=False):
+        """
+        Reload the index if the backing storage changed.
+
+        Between checks (``recheck_interval`` seconds) this does no I/O at all.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self._reload_lock:
+            self._next_check = now + self.recheck_interval
+            if force or self._changed():
+                self._load()
+                if self.on_reload:
+                    self.on_reload()
+
+    def new_key_id(self):
+        """Return a random key ID not already in use."""
+        while True:
+            key_id = secrets.token_hex(KEY_ID_BYTES)
+            if key_id not in self.keys:
+                return key_id
+
+    def add(self, key_id, hashed_key):
+        """Store the hash of a newly issued key under its key ID."""
+        self.keys[key_id] = {
+            'hash': hashed_key,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def revoke(self, key_id):
+        """Remove a key. Returns True if the key existed."""
+        return self.keys.pop(key_id, None) is not None
+
+    def touch(self, key_id):
+        """Note that a key was just used. Backends may record this lazily."""
+
+    def hashes(self):
+        """Return every stored hash, ID-indexed and legacy."""
+        self.refresh()
+        return [entry['hash'] for entry in self.keys.values()] + list(self.legacy)
+
+    def verify(self, api_key):
+        """
+        Check an API key against the store.
+
+        Keys with an ID cost exactly one hash check; unknown IDs cost none.
+        Keys without an ID are checked against the legacy hashes only.
+        Picks up changes made by other processes before checking.
+
+        Returns:
+            str: the matching key ID (or "legacy"), or None if the key is invalid
+        """
+        with metrics.KEY_LOOKUP_SECONDS.time():
+            self.refresh()
+            key_id, _ = split_api_key(api_key)
+            entry = self.keys.get(key_id) if key_id is not None else None
+            legacy = self.legacy
+
+        if key_id is not None:
+            if entry and self._check(entry['hash'], api_key):
+                return key_id
+            return None
+
+        for stored_key in legacy:
+            if self._check(stored_key, api_key):
+                return 'legacy'
+        return None
+
+    def _check(self, stored_key, api_key):
+        with metrics.KDF_SECONDS.time():
+            return check_password_hash(stored_key, api_key)
+
+
+class ApiKeyStore(BaseKeyStore):
+    """
+    Key store backed by a JSON file.
+
+    The file is re-read only when its mtime or size changes. Writes happen
+    under an advisory lock and replace the file atomically, so workers creating
+    keys at the same time never lose each other's keys.
+    """
+
+    def __init__(self, path, recheck_interval=DEFAULT_RECHECK_INTERVAL, on_reload=None):
+        super().__init__(recheck_interval, on_reload)
+        self.path = path
+        self._stamp = None
+
+    def _file_stamp(self):
+        """Return (mtime_ns, size) of the key file, or None if it is missing."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _changed(self):
+        if self._file_stamp() is None:
+            with locked(self.path):
+                if self._file_stamp() is None:
+                    self._write({}, [])
+        return self._file_stamp() != self._stamp
+
+    def _load(self):
+        """Parse the key file into the in-memory index."""
+        stamp = self._file_stamp()
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+
+        if isinstance(data, list):
+            # Pre key-ID format: a bare list of hashes
+            keys, legacy = {}, list(data)
+        else:
+            keys = dict(data.get('keys', {}))
+            legacy = list(data.get('legacy', []))
+
+        # Swap in whole objects so concurrent readers see either state
+        self.keys, self.legacy = keys, legacy
+        self._stamp = stamp
+
+    def _write(self, keys, legacy):
+        """Atomically write the key file in the current format."""
+        data = {
+            'version': STORE_VERSION,
+            'keys': keys,
+            'legacy': legacy,
+        }
+        atomic_write(self.path, json.dumps(data, indent=2).encode('utf-8'))
+
+    def update(self, mutate):
+        """
+        Apply ``mutate(store)`` to the latest on-disk state and write it back.
+
+        The read-modify-write runs under the file lock, so concurrent writers
+        from other processes are serialised instead of overwriting each other.
+
+        Returns:
+            whatever ``mutate`` returns
+        """
+        with self._reload_lock, locked(self.path):
+            if self._file_stamp() is None:
+                self.keys, self.legacy = {}, []
+            else:
+                self._load()
+            self.keys, self.legacy = dict(self.keys), list(self.legacy)
+            result = mutate(self)
+            self._write(self.keys, self.legacy)
+            self._stamp = self._file_stamp()
+            self._next_check = time.monotonic() + self.recheck_interval
+        if self.on_reload:
+            self.on_reload()
+        return result
@@ -0,0 +1,448 @@
+"""
+Batch provisioning of the Alexa Lambda function for many PCs.
+
+One ``LambdaProvisioner`` holds a single boto3 session and one Lambda, IAM
+and STS client (thread-safe, sized for the worker pool). The execution role
+and account ID are resolved once per batch, a new IAM role is awaited with
+the ``role_exists`` waiter and by retrying ``create_function`` while Lambda
+cannot assume it yet (instead of a fixed sleep), and the functions are
+created concurrently in a bounded thread pool.
+
+Each host gets a stable function name (``AlexaSleepController_<host>``), so
+re-running a batch updates existing functions, and skips the upload entirely
+when the package's CodeSha256 has not changed.
+
+Command line:
+    python lambda_fleet.py hosts.csv --region ap-northeast-1 --workers 8
+
+hosts.csv has the columns ``name,endpoint_url,api_key`` and optionally
+``runtime`` (nodejs/python), ``function_name`` and ``groups`` (';'-separated);
+a JSON list of objects with the same keys also works. ``--endpoint-url``
+points every client at a local AWS stand-in (LocalStack, moto server) for
+testing. ``--group-function`` additionally deploys one fan-out function that
+sleeps all hosts (or one group) from a single voice command.
+"""
+import re
+import os
+import csv
+import sys
+import json
+import hmac
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import aws_integration
+
+logger = logging.getLogger(__name__)
+
+ROLE_NAME = 'alexa_sleep_controller_role'
+BASIC_EXECUTION_POLICY = 'arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
+FUNCTION_PREFIX = 'AlexaSleepController_'
+GROUP_FUNCTION_NAME = FUNCTION_PREFIX + 'group'
+
+DEFAULT_WORKERS = 8
+
+# How long get_provisioner reuses a provisioner for the same credentials (seconds)
+PROVISIONER_TTL = 900
+
+# Credential sets get_provisioner keeps provisioners for (least recently used go first)
+PROVISIONER_CACHE_SIZE = 8
+
+# How long create_function keeps retrying while a new role propagates (seconds)
+ROLE_PROPAGATION_TIMEOUT = 60
+
+# runtime -> (Lambda runtime, code template, handler)
+RUNTIMES = {
+    'nodejs': ('nodejs18.x', aws_integration.NODEJS_LAMBDA_CODE, 'index.handler'),
+    'python': ('python3.9', aws_integration.PYTHON_LAMBDA_CODE, 'lambda_function.lambda_handler'),
+}
+
+# Same for the fan-out function that reaches several PCs
+GROUP_RUNTIMES = {
+    'nodejs': ('nodejs18.x', aws_integration.NODEJS_GROUP_LAMBDA_CODE, 'index.handler'),
+    'python': ('python3.9', aws_integration.PYTHON_GROUP_LAMBDA_CODE, 'lambda_function.lambda_handler'),
+}
+
+TRUST_POLICY = {
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Principal": {"Service": "lambda.amazonaws.com"},
+            "Action": "sts:AssumeRole"
+        }
+    ]
+}
+
+Host = namedtuple('Host', ['name', 'endpoint_url', 'api_key', 'runtime', 'function_name', 'groups'])
+Host.__new__.__defaults__ = ('nodejs', None, ())
+
+ProvisionResult = namedtuple('ProvisionResult', [
+    'host', 'ok', 'action', 'function_name', 'function_arn', 'runtime', 'code_sha256', 'seconds', 'error'
+])
+
+
+def function_name_for(host_name):
+    """Return the stable Lambda function name for a host."""
+    return FUNCTION_PREFIX + re.sub(r'[^A-Za-z0-9_-]', '_', host_name)[:64 - len(FUNCTION_PREFIX)]
+
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+class LambdaProvisioner:
+    """Creates and updates Lambda functions through one shared set of clients."""
+
+    def __init__(self, aws_access_key=None, aws_secret_key=None, region='us-east-1',
+                 endpoint_url=None, max_workers=DEFAULT_WORKERS, role_name=ROLE_NAME, builder=None):
+        # boto3 is slow to import; load it only once something is provisioned
+        import boto3
+        from botocore.config import Config
+
+        session_kwargs = {}
+        if aws_access_key and aws_secret_key:
+            session_kwargs['aws_access_key_id'] = aws_access_key
+            session_kwargs['aws_secret_access_key'] = aws_secret_key
+        self.session = boto3.Session(region_name=region, **session_kwargs)
+        self.region = region
+        self.max_workers = max_workers
+        self.role_name = role_name
+        self.builder = builder or aws_integration.package_builder
+
+        # Clients are thread-safe; create them once, sized for the pool
+        config = Config(max_pool_connections=max(10, max_workers * 2),
+                        retries={'mode': 'adaptive', 'max_attempts': 8})
+        self.lambda_client = self.session.client('lambda', config=config, endpoint_url=endpoint_url)
+        self.iam = self.session.client('iam', config=config, endpoint_url=endpoint_url)
+        self.sts = self.session.client('sts', config=config, endpoint_url=endpoint_url)
+
+        self._lock = threading.Lock()
+        self._role_arn = None
+        self._account_id = None
+
+    @property
+    def account_id(self):
+        """AWS account ID, looked up once."""
+        with self._lock:
+            if self._account_id is None:
+                self._account_id = self.sts.get_caller_identity()['Account']
+            return self._account_id
+
+    def role_arn(self):
+        """Return the execution role ARN, creating the role on first use."""
+        with self._lock:
+            if self._role_arn is None:
+                self._role_arn = self._ensure_role()
+            return self._role_arn
+
+    def _ensure_role(self):
+        try:
+            return self.iam.get_role(RoleName=self.role_name)['Role']['Arn']
+        except self.iam.exceptions.ClientError as e:
+            if _error_code(e) != 'NoSuchEntity':
+                raise
+
+        try:
+            role = self.iam.create_role(
+                RoleName=self.role_name,
+                AssumeRolePolicyDocument=json.dumps(TRUST_POLICY),
+                Description='Role for Alexa Sleep Controller Lambda function'
+            )['Role']
+        except self.iam.exceptions.ClientError as e:
+            # Created concurrently by another provisioner
+            if _error_code(e) != 'EntityAlreadyExists':
+                raise
+            return self.iam.get_role(RoleName=self.role_name)['Role']['Arn']
+
+        self.iam.attach_role_policy(RoleName=self.role_name, PolicyArn=BASIC_EXECUTION_POLICY)
+        self.iam.get_waiter('role_exists').wait(RoleName=self.role_name,
+                                                WaiterConfig={'Delay': 1, 'MaxAttempts': 30})
+        logger.info(f"IAM role created: {self.role_name}")
+        return role['Arn']
+
+    def _create_function(self, **kwargs):
+        """
+        create_function, retried while Lambda cannot assume a new role yet.
+
+        IAM is eventually consistent: a role that get_role already returns may
+        still be rejected by Lambda for a few seconds.
+        """
+        deadline = time.monotonic() + ROLE_PROPAGATION_TIMEOUT
+        delay = 0.5
+        while True:
+            try:
+                return self.lambda_client.create_function(**kwargs)
+            except self.lambda_client.exceptions.ClientError as e:
+                message = e.response.get('Error', {}).get('Message', '')
+                if (_error_code(e) != 'InvalidParameterValueException' or 'assume' not in message
+                        or time.monotonic() + delay > deadline):
+                    raise
+                logger.debug(f"Role not assumable yet, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def _existing_function(self, function_name):
+        try:
+            return self.lambda_client.get_function_configuration(FunctionName=function_name)
+        except self.lambda_client.exceptions.ClientError as e:
+            if _error_code(e) == 'ResourceNotFoundException':
+                return None
+            raise
+
+    def provision(self, api_key, endpoint_url, runtime='nodejs', function_name=None, host=None,
+                  update_existing=True):
+        """
+        Create the Lambda function for one PC, or update it if it exists.
+
+        Args:
+            update_existing: look for an existing function of the same name
+                and update its code (skipped when unchanged); pass False for
+                freshly generated names to save the lookup
+
+        Returns:
+            ProvisionResult
+        """
+        host = host or function_name or endpoint_url
+        return self._deploy(host, function_name or function_name_for(host), RUNTIMES, runtime, {
+            'API_KEY': api_key,
+            'ENDPOINT_URL': endpoint_url,
+        }, update_existing)
+
+    def provision_group(self, hosts, function_name=GROUP_FUNCTION_NAME, runtime='nodejs'):
+        """
+        Create or update one fan-out function that sleeps all ``hosts`` at once.
+
+        SleepIntent reaches every host, SleepGroupIntent the hosts whose
+        ``groups`` contain the spoken group (see
+        aws_integration.generate_alexa_skill_json(groups=...)).
+
+        Returns:
+            ProvisionResult
+        """
+        params = aws_integration.group_template_params([host._asdict() for host in hosts])
+        return self._deploy(function_name, function_name, GROUP_RUNTIMES, runtime, params, True)
+
+    def _deploy(self, host, function_name, runtimes, runtime, params, update_existing):
+        started = time.monotonic()
+        if runtime not in runtimes:
+            raise ValueError(f"Unsupported runtime: {runtime}")
+        runtime_str, template, handler = runtimes[runtime]
+        package = self.builder.build(template, runtime, params)
+
+        existing = self._existing_function(function_name) if update_existing else None
+        if existing is not None:
+            updated = aws_integration.deploy_lambda_code(self.lambda_client, function_name, package,
+                                                         current_sha256=existing.get('CodeSha256'))
+            return ProvisionResult(host, True, 'updated' if updated else 'unchanged', function_name,
+                                   existing['FunctionArn'], runtime_str, package.sha256,
+                                   time.monotonic() - started, None)
+
+        response = self._create_function(
+            FunctionName=function_name,
+            Runtime=runtime_str,
+            Role=self.role_arn(),
+            Handler=handler,
+            Code={'ZipFile': package.data},
+            Description='Lambda function to control PC sleep via Alexa',
+            Timeout=10,
+            MemorySize=128,
+            Publish=True,
+            Tags={
+                'Service': 'AlexaSleepController'
+            }
+        )
+
+        # Alexaスキルのエンドポイントとして設定するための権限を追加
+        self.lambda_client.add_permission(
+            FunctionName=function_name,
+            StatementId='alexa-skill-kit-statement',
+            Action='lambda:InvokeFunction',
+            Principal='alexa-appkit.amazon.com',
+            SourceAccount=self.account_id
+        )
+        logger.info(f"Lambda function created: {function_name}")
+        return ProvisionResult(host, True, 'created', function_name, response['FunctionArn'],
+                               runtime_str, package.sha256, time.monotonic() - started, None)
+
+    def _failed(self, host, error, started):
+        logger.error(f"Provisioning {host.name} failed: {error}")
+        return ProvisionResult(host.name, False, 'failed',
+                               host.function_name or function_name_for(host.name), None,
+                               RUNTIMES.get(host.runtime, (host.runtime,))[0], None,
+                               time.monotonic() - started, str(error))
+
+    def provision_all(self, hosts, on_result=None):
+        """
+        Provision every host concurrently (at most ``max_workers`` at a time).
+
+        A failing host does not stop the others; its result has ok=False. If
+        the account ID or execution role cannot be resolved, every host fails.
+        Hosts whose names map to the same function name fail up front, since
+        each would overwrite the other's function.
+
+        Args:
+            hosts: iterable of Host
+            on_result: optional callback, called with each ProvisionResult as it finishes
+
+        Returns:
+            list: ProvisionResult per host, in input order
+        """
+        hosts = list(hosts)
+        if not hosts:
+            return []
+        started = time.monotonic()
+
+        def report(result):
+            if on_result:
+                on_result(result)
+            return result
+
+        results = [None] * len(hosts)
+        by_function = {}
+        for index, host in enumerate(hosts):
+            by_function.setdefault(host.function_name or function_name_for(host.name), []).append(index)
+        for function_name, indexes in by_function.items():
+            if len(indexes) > 1:
+                names = ', '.join(repr(hosts[index].name) for index in indexes)
+                for index in indexes:
+                    results[index] = report(self._failed(
+                        hosts[index], f"Function name {function_name} is used by several hosts: {names}", started))
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        # Resolve shared state once, before the workers race for it
+        try:
+            self.account_id
+            self.role_arn()
+        except Exception as e:
+            for index in pending:
+                results[index] = report(self._failed(hosts[index], e, started))
+            return results
+
+        def run(host):
+            started = time.monotonic()
+            try:
+                result = self.provision(host.api_key, host.endpoint_url, host.runtime or 'nodejs',
+                                        function_name=host.function_name, host=host.name)
+            except Exception as e:
+                result = self._failed(host, e, started)
+            return report(result)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='lambda-fleet') as pool:
+            for index, result in zip(pending, pool.map(run, [hosts[index] for index in pending])):
+                results[index] = result
+        return results
+
+
+# Provisioners shared between calls: credentials digest -> (provisioner, expiry).
+# Indexed by a keyed digest so the AWS secret is never kept as a dictionary key
+_provisioners = OrderedDict()
+_provisioners_lock = threading.Lock()
+_provisioners_secret = os.urandom(32)
+
+
+def get_provisioner(aws_access_key=None, aws_secret_key=None, region='us-east-1'):
+    """Return a shared provisioner (session and clients) for these credentials."""
+    token = '\0'.join((aws_access_key or '', aws_secret_key or '', region or ''))
+    digest = hmac.new(_provisioners_secret, token.encode('utf-8'), hashlib.sha256).digest()
+    with _provisioners_lock:
+        entry = _provisioners.get(digest)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                _provisioners.move_to_end(digest)
+                return entry[0]
+            del _provisioners[digest]
+
+    # Creating the clients is slow; do it outside the lock
+    provisioner = LambdaProvisioner(aws_access_key, aws_secret_key, region)
+    with _provisioners_lock:
+        _provisioners[digest] = (provisioner, time.monotonic() + PROVISIONER_TTL)
+        _provisioners.move_to_end(digest)
+        while len(_provisioners) > PROVISIONER_CACHE_SIZE:
+            _provisioners.popitem(last=False)
+    return provisioner
+
+
+def _groups(value):
+    """Group names from a JSON list or a ';'-separated CSV cell."""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(';')
+    return tuple(group.strip() for group in value if group.strip())
+
+
+def load_hosts(path):
+    """
+    Read hosts from a CSV file (with a header row) or a JSON list.
+
+    The optional ``groups`` column lists the host's groups, ';'-separated.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    hosts = []
+    for row in rows:
+        row = {key.strip(): (value.strip() if isinstance(value, str) else value)
+               for key, value in row.items() if key}
+        hosts.append(Host(
+            name=row['name'],
+            endpoint_url=row['endpoint_url'],
+            api_key=row['api_key'],
+            runtime=row.get('runtime') or 'nodejs',
+            function_name=row.get('function_name') or None,
+            groups=_groups(row.get('groups')),
+        ))
+    return hosts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or update the Alexa Lambda function for many PCs.')
+    parser.add_argument('hosts', help='CSV or JSON file with name, endpoint_url, api_key[, runtime, function_name]')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', 'us-east-1'))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent hosts')
+    parser.add_argument('--endpoint-url', help='AWS endpoint override, e.g. a local AWS stand-in')
+    parser.add_argument('--output', help='write per-host results to this JSON file')
+    parser.add_argument('--group-function', nargs='?', const=GROUP_FUNCTION_NAME,
+                        help='also deploy one fan-out function for all hosts (default name: %(const)s)')
+    parser.add_argument('--group-runtime', default='nodejs', choices=sorted(GROUP_RUNTIMES))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    provisioner = LambdaProvisioner(region=args.region, endpoint_url=args.endpoint_url,
+                                    max_workers=args.workers)
+
+    def report(result):
+        status = result.action if result.ok else f"FAILED: {result.error}"
+        print(f"{result.host}: {status} {result.function_name} ({result.seconds:.1f}s)", flush=True)
+
+    hosts = load_hosts(args.hosts)
+    results = provisioner.provision_all(hosts, on_result=report)
+    if args.group_function:
+        try:
+            result = provisioner.provision_group(hosts, args.group_function, args.group_runtime)
+        except Exception as e:
+            logger.error(f"Provisioning {args.group_function} failed: {e}")
+            result = ProvisionResult(args.group_function, False, 'failed', args.group_function,
+                                     None, None, None, 0.0, str(e))
+        report(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+
+    failed = sum(1 for result in results if not result.ok)
+    print(f"{len(results) - failed} succeeded, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
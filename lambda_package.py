@@ -0,0 +1,180 @@
+"""
+Reproducible Lambda deployment packages with an on-disk artifact cache.
+
+The same template, runtime and parameters always produce byte-identical zip
+files: entries are sorted, every entry gets a fixed timestamp and permission
+bits, and compression uses a fixed level. Built packages are stored in a
+content-addressed cache directory (LAMBDA_PACKAGE_CACHE, default
+``.lambda_cache``) keyed by a hash of the inputs, so a rebuild is a file read.
+
+Secret parameters (the API key, and the target list of the group handler,
+which holds the agents' keys) never reach the cache. The cached package is
+rendered from the other parameters only, with the secret placeholders left
+in place. Secrets are filled in, in memory, each time the package is built
+for a deployment. They are not part of the cache key either.
+
+Each package reports its SHA-256 in the base64 form Lambda uses for
+``CodeSha256``, so an unchanged deployment can be detected by comparing it
+with ``get_function_configuration`` instead of uploading the code again.
+"""
+import io
+import os
+import re
+import json
+import base64
+import hashlib
+import logging
+import zipfile
+from collections import namedtuple
+from file_lock import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '.lambda_cache'
+
+# Placeholders whose values are secret: rendered after the cache, never stored
+SECRET_PARAMS = frozenset({'API_KEY', 'TARGETS_JSON'})
+
+# Timestamp written for every zip entry (the earliest a zip file can store)
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Regular file, rw-r--r--, in the upper 16 bits of external_attr
+FILE_ATTRIBUTES = (0o100644 << 16)
+
+COMPRESS_LEVEL = 9
+
+# Bump when the zip layout changes so old cache entries are not reused
+PACKAGE_FORMAT = 2
+
+# Names of cache files (hex SHA-256 cache keys)
+CACHE_FILE = re.compile(r'^[0-9a-f]{64}\.zip$')
+
+# Name of the handler source file inside the package, per runtime
+ENTRY_FILES = {
+    'nodejs': 'index.js',
+    'python': 'lambda_function.py',
+}
+
+LambdaPackage = namedtuple('LambdaPackage', ['data', 'sha256', 'cache_key', 'path', 'cached'])
+
+
+def render(template, params):
+    """
+    Replace ``{{NAME}}`` placeholders in a code template with string literals.
+
+    Values are written as JSON strings, which are valid string literals in
+    both JavaScript and Python, so quotes or backslashes in a value cannot
+    break out of the literal.
+    """
+    code = template
+    for name, value in params.items():
+        code = code.replace('{{' + name + '}}', json.dumps(str(value)))
+    return code
+
+
+def build_zip(files):
+    """
+    Build a byte-reproducible zip archive.
+
+    Args:
+        files (dict): archive name -> str or bytes content
+
+    Returns:
+        bytes: the zip file
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in sorted(files):
+            content = files[name]
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            info = zipfile.ZipInfo(name, date_time=FIXED_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.create_system = 3  # Unix, so external_attr is honoured
+            info.external_attr = FILE_ATTRIBUTES
+            archive.writestr(info, content, compresslevel=COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def code_sha256(data):
+    """Return the SHA-256 of a package as Lambda reports it (base64)."""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+
+
+def cache_key(template, runtime, params):
+    """Return the content address of the package built from these (non-secret) inputs."""
+    source = json.dumps({
+        'format': PACKAGE_FORMAT,
+        'template': template,
+        'runtime': runtime,
+        'params': params,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+class PackageBuilder:
+    """Builds Lambda packages and keeps their secret-free form in a content-addressed cache."""
+
+    def __init__(self, cache_dir=None, secret_params=SECRET_PARAMS):
+        self.cache_dir = cache_dir or os.environ.get('LAMBDA_PACKAGE_CACHE', DEFAULT_CACHE_DIR)
+        self.secret_params = frozenset(secret_params)
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    def build(self, template, runtime, params):
+        """
+        Return the package for ``template`` rendered with ``params``.
+
+        Args:
+            template (str): handler code with ``{{NAME}}`` placeholders
+            runtime (str): "nodejs" or "python"
+            params (dict): placeholder values; those named in
+                ``secret_params`` are filled in after the cache lookup
+
+        Returns:
+            LambdaPackage: zip bytes, base64 SHA-256, cache key, cache file
+            path and whether the secret-free package came from the cache
+        """
+        if runtime not in ENTRY_FILES:
+            raise ValueError(f"Unsupported runtime: {runtime}")
+        public = {name: value for name, value in params.items() if name not in self.secret_params}
+        secrets = {name: value for name, value in params.items() if name in self.secret_params}
+        key = cache_key(template, runtime, public)
+        path = self._cache_path(key)
+        entry = ENTRY_FILES[runtime]
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            cached = True
+        except FileNotFoundError:
+            data = build_zip({entry: render(template, public)})
+            cached = False
+            try:
+                os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+                atomic_write(path, data)
+            except OSError as e:
+                # The cache is an optimisation; a read-only directory is not fatal
+                logger.warning(f"Could not cache Lambda package {key}: {e}")
+                path = None
+
+        if secrets:
+            # Render the secrets into the cached code; the result stays in memory
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                code = archive.read(entry).decode('utf-8')
+            data = build_zip({entry: render(code, secrets)})
+        return LambdaPackage(data, code_sha256(data), key, path, cached)
+
+    def clear(self):
+        """Delete every cached package. Returns the number of files removed."""
+        removed = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if CACHE_FILE.match(name):
+                os.unlink(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
@@ -0,0 +1,277 @@
+"""
+Non-blocking logging configuration.
+
+Request threads only put records on a queue (QueueHandler); a single
+background QueueListener thread formats them and writes them to rotating log
+files. Audit events from the ``sleep_events`` logger are also written to
+their own file, ``sleep_events.log``.
+
+Each server worker runs its own listener, and all of them append to the same
+files; whichever worker finds a file due for rotation rotates it under a
+lock, and the others reopen the new file.
+
+Environment variables:
+    LOG_LEVEL           root level (default INFO)
+    LOG_JSON            "1" to write JSON lines instead of plain text
+    LOG_MAX_BYTES       rotate when a file exceeds this size (default 10 MB)
+    LOG_ROTATE_SECONDS  rotate files older than this (default one day, 0 = never)
+    LOG_BACKUP_COUNT    rotated files to keep (default 7)
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import datetime
+import logging.handlers
+from file_lock import locked, atomic_write
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+EVENTS_FORMAT = '%(asctime)s - %(message)s'
+EVENTS_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Logger for sleep audit events
+EVENTS_LOGGER = 'sleep_events'
+
+_listener = None
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rolls over once the file gets too old, and
+    that several processes can share.
+
+    Every server worker writes to the same files. A rollover is done under an
+    advisory lock and only if the file is still the one this process has open;
+    the other processes see that the path now names a different file (as
+    WatchedFileHandler does) and continue in the new one. The age is counted
+    from the start time in a ``<file>.created`` sidecar, because every write
+    moves the file's mtime.
+
+    The file size is tracked from this process's own writes and refreshed
+    from ``os.stat`` at most every CHECK_INTERVAL seconds (which also notices
+    rotations by other processes), or when the estimate reaches the limit.
+    Each record is formatted once, for both its size and the write.
+    """
+
+    # Seconds between stat calls while the size estimate is below the limit
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, filename, max_bytes=0, rotate_seconds=0, backup_count=0, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.created_path = f"{self.baseFilename}.created"
+        self._identity = None
+        self._created = None
+        self._size = 0
+        self._next_check = 0.0
+        self._incoming = 0
+        self._formatted = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.baseFilename)
+        except OSError:
+            return None
+
+    def _open(self):
+        stream = super()._open()
+        st = os.fstat(stream.fileno())
+        self._identity = (st.st_dev, st.st_ino)
+        self._size = st.st_size
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+        self._created = self._read_created()
+        return stream
+
+    def _read_created(self):
+        try:
+            with open(self.created_path, encoding='ascii') as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            # No record of when this file was started: count from now
+            return self._write_created()
+
+    def _write_created(self):
+        created = time.time()
+        atomic_write(self.created_path, repr(created).encode('ascii'))
+        return created
+
+    def _is_current(self, st):
+        return st is not None and (st.st_dev, st.st_ino) == self._identity
+
+    def _check_file(self):
+        """Refresh the size from the file, or close it if another process rotated it."""
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+        st = self._stat()
+        if self._is_current(st):
+            # Other processes append to the same file
+            self._size = st.st_size
+        else:
+            # Rotated by another process: continue in the new file
+            self.stream.close()
+            self.stream = None
+
+    def _due(self, size):
+        if size == 0:
+            return False
+        if self.maxBytes > 0 and size + self._incoming >= self.maxBytes:
+            return True
+        return self.rotate_seconds > 0 and time.time() >= self._created + self.rotate_seconds
+
+    def format(self, record):
+        # shouldRollover already formatted this record to measure it
+        formatted = self._formatted
+        if formatted is not None and formatted[0] is record:
+            return formatted[1]
+        return super().format(record)
+
+    def shouldRollover(self, record):
+        if self.stream is not None and time.monotonic() >= self._next_check:
+            self._check_file()
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes > 0:
+            message = self.format(record)
+            self._formatted = (record, message)
+            self._incoming = len(message.encode(self.encoding or 'utf-8', errors='replace')) \
+                + len(self.terminator)
+        if not self._due(self._size):
+            return False
+        # The estimate says rotate; confirm against the file itself
+        self._check_file()
+        if self.stream is None:
+            self.stream = self._open()
+        return self._due(self._size)
+
+    def emit(self, record):
+        try:
+            super().emit(record)
+            self._size += self._incoming
+        finally:
+            self._formatted = None
+
+    def doRollover(self):
+        with locked(self.baseFilename):
+            # Another process may have rotated while this one waited for the lock
+            st = self._stat()
+            if self._is_current(st):
+                self._created = self._read_created()
+                if self._due(st.st_size):
+                    super().doRollover()
+                    self._created = self._write_created()
+                    return
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def rotating_file_handler(filename, formatter):
+    """Rotating file handler configured from the LOG_* environment variables."""
+    handler = SizeAndTimeRotatingFileHandler(
+        filename,
+        max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        rotate_seconds=float(os.environ.get('LOG_ROTATE_SECONDS', 24 * 60 * 60)),
+        backup_count=int(os.environ.get('LOG_BACKUP_COUNT', 7)),
+    )
+    handler.setFormatter(formatter)
+    return handler
+
+
+def configure_logging(log_file='alexa_sleep.log', events_file='sleep_events.log',
+                      level=None, json_lines=None):
+    """
+    Route all logging through a queue to rotating files and the console.
+
+    Safe to call more than once; only the first call has an effect.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if level is None:
+        level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    if json_lines is None:
+        json_lines = os.environ.get('LOG_JSON', '') == '1'
+
+    if json_lines:
+        formatter = events_formatter = JsonLineFormatter()
+    else:
+        formatter = logging.Formatter(LOG_FORMAT)
+        events_formatter = logging.Formatter(EVENTS_FORMAT, EVENTS_DATE_FORMAT)
+
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+
+    events = rotating_file_handler(events_file, events_formatter)
+    events.addFilter(logging.Filter(EVENTS_LOGGER))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue,
+        rotating_file_handler(log_file, formatter),
+        console,
+        events,
+        respect_handler_level=True
+    )
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    # Audit events are kept even when LOG_LEVEL is raised above INFO
+    logging.getLogger(EVENTS_LOGGER).setLevel(logging.INFO)
+
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def _restart_after_fork():
+    """
+    Give a forked worker its own queue and listener thread.
+
+    The parent's listener thread does not survive the fork, so records put on
+    the inherited queue would never be written.
+    """
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,424 @@
+"""
+Prometheus-style metrics for the /metrics endpoint.
+
+Each process keeps its counters and histograms in memory, guarded by one
+uncontended lock per metric. A background thread periodically writes a
+snapshot to ``METRICS_DIR/metrics_<pid>.json``; a scrape merges the snapshots
+of all workers, so the numbers cover every gunicorn/waitress process no
+matter which one answers. Gauges only count workers whose snapshot is recent.
+
+Counters and histograms of exited workers are kept: a process folds them into
+``metrics_retired.json`` and deletes its snapshot when it exits, and a scrape
+does the same for the snapshot of a process that is no longer running (killed
+or crashed), so a later worker reusing its PID cannot overwrite it.
+"""
+import os
+import json
+import time
+import re
+import glob
+import atexit
+import logging
+import threading
+from file_lock import atomic_write, locked
+
+logger = logging.getLogger(__name__)
+
+# Seconds between snapshot writes
+FLUSH_INTERVAL = 5
+
+# Default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Counters and histograms of processes that have exited
+RETIRED_SNAPSHOT = 'metrics_retired.json'
+SNAPSHOT_PID = re.compile(r'metrics_(\d+)\.json$')
+
+
+def pid_alive(pid):
+    """Return True if a process with this PID is running."""
+    if os.name == 'nt':
+        # os.kill() would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        try:
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        """Return this process's samples as {label values tuple: value}."""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Current value, either set directly or read from a callback at snapshot time."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Report ``function()`` as the (unlabelled) value."""
+        self._function = function
+
+    def snapshot(self):
+        values = super().snapshot()
+        if self._function is not None:
+            try:
+                values[()] = self._function()
+            except Exception:
+                logger.exception(f"Error reading gauge {self.name}")
+        return values
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            # Per-bucket counts (last slot is +Inf), then sum and count
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _copy(self, value):
+        return list(value)
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed time of its block."""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """Holds the metrics of this process and merges snapshots across workers."""
+
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def enable_multiprocess(self, directory):
+        """Share metrics with other workers through snapshot files in ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        if self._flusher is None:
+            # A snapshot under our PID belongs to an earlier process
+            self._retire_file(self._snapshot_path())
+            self._start_flusher()
+            atexit.register(self.retire)
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def _after_fork(self):
+        """
+        Start over in a worker forked from a preloaded master.
+
+        Samples recorded before the fork are already in the master's own
+        snapshot, and its flusher thread did not survive the fork.
+        """
+        for metric in self.metrics:
+            metric._values.clear()
+            metric._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self._flusher is not None:
+            self._retire_file(self._snapshot_path())
+            self._start_flusher()
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f"metrics_{pid or os.getpid()}.json")
+
+    def _snapshot(self):
+        return {
+            metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+            for metric in self.metrics
+        }
+
+    def flush(self):
+        """Write this process's snapshot for other workers to read."""
+        if self.directory is None:
+            return
+        data = {'updated': time.time(), 'metrics': self._snapshot()}
+        try:
+            atomic_write(self._snapshot_path(), json.dumps(data).encode('utf-8'))
+        except OSError as e:
+            logger.error(f"Error writing metrics snapshot: {e}")
+
+    def _flush_loop(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self.flush()
+
+    def _retired_path(self):
+        return os.path.join(self.directory, RETIRED_SNAPSHOT)
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fold(self, snapshot):
+        """Add the counters and histograms of a snapshot to the retired totals. Hold the lock."""
+        retired = (self._read(self._retired_path()) or {}).get('metrics', {})
+        types = {metric.name: metric.type for metric in self.metrics}
+        for name, samples in snapshot.items():
+            if types.get(name) not in ('counter', 'histogram'):
+                continue
+            merged = {tuple(key): value for key, value in retired.get(name, [])}
+            for key, value in samples:
+                merged[tuple(key)] = _add(types[name], merged.get(tuple(key)), value)
+            retired[name] = [[list(key), value] for key, value in merged.items()]
+        data = {'updated': time.time(), 'metrics': retired}
+        atomic_write(self._retired_path(), json.dumps(data).encode('utf-8'))
+
+    def _retire_locked(self, path):
+        """Fold a dead process's snapshot into the retired totals and delete it. Hold the lock."""
+        try:
+            # Read under the lock: another process may have retired it already
+            data = self._read(path)
+            if data is not None:
+                self._fold(data.get('metrics', {}))
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Error retiring metrics snapshot {path}: {e}")
+
+    def _retire_file(self, path):
+        with locked(self._retired_path()):
+            self._retire_locked(path)
+
+    def retire(self):
+        """On exit: keep this process's counters in the retired totals and remove its snapshot."""
+        if self.directory is None:
+            return
+        self._stop.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=1)
+        path = self._snapshot_path()
+        try:
+            with locked(self._retired_path()):
+                self._fold(self._snapshot())
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:
+            logger.error(f"Error retiring metrics snapshot: {e}")
+        # Later calls (atexit after worker_exit) have nothing left to do
+        self.directory = None
+
+    def _collect(self):
+        """Return [(snapshot metrics dict, is_live)] for every process."""
+        snapshots = [(self._snapshot(), True)]
+        if self.directory is None:
+            return snapshots
+        stale_before = time.time() - 3 * FLUSH_INTERVAL
+        # Under the lock, so an exiting worker is counted either live or retired, not both
+        with locked(self._retired_path()):
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                match = SNAPSHOT_PID.search(os.path.basename(path))
+                if match is None or int(match.group(1)) == os.getpid():
+                    continue
+                if not pid_alive(int(match.group(1))):
+                    self._retire_locked(path)
+                    continue
+                data = self._read(path)
+                if data is not None:
+                    snapshots.append((data.get('metrics', {}), data.get('updated', 0) >= stale_before))
+            retired = self._read(self._retired_path())
+        if retired is not None:
+            snapshots.append((retired.get('metrics', {}), False))
+        return snapshots
+
+    def render(self):
+        """Return all metrics, merged across workers, in Prometheus text format."""
+        snapshots = self._collect()
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for snapshot, live in snapshots:
+                if metric.type == 'gauge' and not live:
+                    continue
+                samples = snapshot.get(metric.name, [])
+                for key, value in samples:
+                    key = tuple(key)
+                    merged[key] = _add(metric.type, merged.get(key), value)
+
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, value in sorted(merged.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.type == 'histogram':
+                    cumulative = 0
+                    bounds = [repr(float(b)) for b in metric.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, value[:-2]):
+                        cumulative += count
+                        lines.append(f"{metric.name}_bucket{_labels(labels + [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_labels(labels)} {value[-2]}")
+                    lines.append(f"{metric.name}_count{_labels(labels)} {value[-1]}")
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _add(metric_type, current, value):
+    """Merge one sample into another of the same metric."""
+    if current is None:
+        return value
+    if metric_type == 'histogram':
+        return [a + b for a, b in zip(current, value)]
+    return current + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+REGISTRY = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+# Metrics recorded by the application
+REQUESTS = Counter(
+    'alexa_sleep_requests_total',
+    'Sleep API requests by authentication type and outcome',
+    ('auth', 'outcome')
+)
+API_KEY_CACHE = Counter(
+    'alexa_sleep_api_key_cache_total',
+    'Verified API key cache lookups',
+    ('result',)
+)
+ADMISSION = Counter(
+    'alexa_sleep_admission_total',
+    'Admission control decisions for uncached API keys',
+    ('result',)
+)
+KDF_SECONDS = Histogram(
+    'alexa_sleep_kdf_verify_seconds',
+    'Time spent in API key hash (KDF) verification',
+)
+KEY_LOOKUP_SECONDS = Histogram(
+    'alexa_sleep_key_store_lookup_seconds',
+    'Time to find the stored hash for an API key, excluding the KDF',
+)
+BACKEND_ATTEMPT_SECONDS = Histogram(
+    'alexa_sleep_backend_attempt_seconds',
+    'Latency of each power backend attempt',
+    ('backend', 'result')
+)
+AGENT_CALL_SECONDS = Histogram(
+    'alexa_sleep_agent_call_seconds',
+    'Latency of controller calls to agent /api/sleep',
+    ('result',)
+)
+JOB_QUEUE_DEPTH = Gauge(
+    'alexa_sleep_job_queue_depth',
+    'Power jobs queued or running',
+)
+EVENT_STREAMS = Gauge(
+    'alexa_sleep_event_streams',
+    'Open live dashboard streams (SSE and long-poll)',
+)
+SCHEDULES_PENDING = Gauge(
+    'alexa_sleep_schedules_pending',
+    'Pending schedules in the scheduler heap (leader process only)',
+)
+SCHEDULE_RUNS = Counter(
+    'alexa_sleep_schedule_runs_total',
+    'Scheduled power actions by outcome (success, failure, missed)',
+    ('result',)
+)
+
+
+def observe_backend_attempt(backend, seconds, success):
+    """PowerController.on_attempt hook."""
+    BACKEND_ATTEMPT_SECONDS.observe(seconds, backend=backend, result='success' if success else 'failure')
@@ -0,0 +1,104 @@
+"""
+Database models for API keys, sleep events, power jobs, schedules, settings
+and the agent host registry used in controller mode.
+"""
+import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+db = SQLAlchemy(model_class=Base)
+
+
+class ApiKey(db.Model):
+    """Hash of an issued API key, indexed by its public key ID."""
+    __tablename__ = 'api_keys'
+
+    id = db.Column(db.String(64), primary_key=True)
+    key_hash = db.Column(db.String(256), nullable=False)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    last_used = db.Column(db.DateTime)
+    revoked = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    # Hash-only keys imported from api_keys.json, verified without a key ID
+    legacy = db.Column(db.Boolean, nullable=False, default=False)
+
+
+class SleepEvent(db.Model):
+    """An accepted /api/sleep request and its outcome."""
+    __tablename__ = 'sleep_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, index=True)
+    ip = db.Column(db.String(64))
+    user_agent = db.Column(db.String(512))
+    key_id = db.Column(db.String(64), index=True)
+    success = db.Column(db.Boolean)
+    message = db.Column(db.Text)
+    # True if the request shared the job of an earlier request
+    coalesced = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+
+
+class PowerJob(db.Model):
+    """A power action queued by /api/sleep and run in the background."""
+    __tablename__ = 'power_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    action = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, index=True)
+    message = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, index=True)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    ip = db.Column(db.String(64))
+    user_agent = db.Column(db.String(512))
+    key_id = db.Column(db.String(64))
+
+
+class Schedule(db.Model):
+    """A delayed or recurring power action, run by the scheduler."""
+    __tablename__ = 'schedules'
+
+    id = db.Column(db.String(32), primary_key=True)
+    action = db.Column(db.String(32), nullable=False)
+    # pending, done, missed or cancelled
+    status = db.Column(db.String(16), nullable=False, index=True)
+    # Next time the action runs (local time)
+    run_at = db.Column(db.DateTime, nullable=False)
+    # "mon,tue,wed,thu,fri 23:00" for recurring schedules, None for one-off
+    recurrence = db.Column(db.String(64))
+    # Host group to sleep in controller mode; None means this PC
+    target = db.Column(db.String(128))
+    key_id = db.Column(db.String(64))
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, index=True)
+    last_run = db.Column(db.DateTime)
+    last_result = db.Column(db.Text)
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Setting(db.Model):
+    """Simple key/value settings shared by all workers."""
+    __tablename__ = 'settings'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now,
+                        onupdate=datetime.datetime.now)
+
+
+class AgentHost(db.Model):
+    """A PC running this app as an agent, reachable by the controller."""
+    __tablename__ = 'agent_hosts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128), nullable=False, unique=True)
+    endpoint_url = db.Column(db.String(512), nullable=False)
+    # The agent's own API key; the controller must present it in plain text
+    api_key = db.Column(db.String(256), nullable=False)
+    # ';'-separated group names
+    groups = db.Column(db.String(512), nullable=False, default='')
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
@@ -0,0 +1,325 @@
+"""
+Pluggable power backends used by sleep_controller.
+
+Each backend wraps one way of suspending the machine. ``PowerController``
+probes the configured backends once, then tries them in order, starting with
+whichever one worked last time so later calls skip the slow fallbacks.
+"""
+import os
+import time
+import ctypes
+import asyncio
+import shutil
+import logging
+import platform
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Audit log of sleep actions (written to sleep_events.log by logging_setup)
+events_logger = logging.getLogger('sleep_events')
+
+# Timeout for command-based backends (seconds)
+COMMAND_TIMEOUT = 30
+
+SUCCESS_MESSAGE = "スリープコマンドが正常に送信されました"
+SIMULATED_MESSAGE = "スリープコマンドが正常にシミュレートされました（デモモード）"
+
+
+class PowerBackendError(Exception):
+    """Raised when a backend fails to suspend the system."""
+
+
+class PowerBackend:
+    """Base class for a way of putting the system to sleep."""
+
+    name = None
+
+    def probe(self):
+        """Return True if this backend can be used on this system."""
+        return True
+
+    def suspend(self):
+        """
+        Suspend the system.
+
+        Returns:
+            str: message describing the result
+
+        Raises:
+            PowerBackendError: if the system could not be suspended
+        """
+        raise NotImplementedError
+
+    async def suspend_async(self):
+        """Async variant of suspend(); by default runs it on a worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.suspend)
+
+
+class SetSuspendStateBackend(PowerBackend):
+    """Calls powrprof.SetSuspendState through ctypes (no child process)."""
+
+    name = 'ctypes'
+
+    def probe(self):
+        if platform.system() != 'Windows':
+            return False
+        try:
+            ctypes.windll.powrprof.SetSuspendState
+            return True
+        except (AttributeError, OSError):
+            return False
+
+    def suspend(self):
+        # SetSuspendState(hibernate=False, force=True, disable_wake_events=False)
+        if not ctypes.windll.powrprof.SetSuspendState(0, 1, 0):
+            raise PowerBackendError(f"SetSuspendState failed: {ctypes.WinError()}")
+        return SUCCESS_MESSAGE
+
+
+class CommandBackend(PowerBackend):
+    """Runs an external command to suspend the system."""
+
+    # Operating system the command exists on, or None for any
+    system = None
+    argv = ()
+
+    def probe(self):
+        if self.system and platform.system() != self.system:
+            return False
+        return shutil.which(self.argv[0]) is not None
+
+    def suspend(self):
+        try:
+            subprocess.run(list(self.argv), check=True, capture_output=True, timeout=COMMAND_TIMEOUT)
+        except (subprocess.SubprocessError, OSError) as e:
+            raise PowerBackendError(str(e)) from e
+        return SUCCESS_MESSAGE
+
+    async def suspend_async(self):
+        """Run the command without blocking the event loop."""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            raise PowerBackendError(str(e)) from e
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise PowerBackendError(f"{self.argv[0]} timed out after {COMMAND_TIMEOUT} seconds")
+        if process.returncode != 0:
+            raise PowerBackendError(
+                f"{self.argv[0]} exited with code {process.returncode}: "
+                f"{stderr.decode('utf-8', errors='ignore').strip()}"
+            )
+        return SUCCESS_MESSAGE
+
+
+class Rundll32Backend(CommandBackend):
+    name = 'rundll32'
+    system = 'Windows'
+    argv = ('rundll32.exe', 'powrprof.dll,SetSuspendState', '0,1,0')
+
+
+class PowerShellBackend(CommandBackend):
+    name = 'powershell'
+    system = 'Windows'
+    argv = (
+        'powershell', '-NoProfile', '-Command',
+        "Add-Type -Assembly System.Windows.Forms; "
+        "[System.Windows.Forms.Application]::SetSuspendState('Suspend', $false, $false)",
+    )
+
+
+class SystemctlBackend(CommandBackend):
+    """Suspends a Linux machine through systemd-logind."""
+
+    name = 'systemctl'
+    system = 'Linux'
+    argv = ('systemctl', 'suspend')
+
+
+class SimulatedBackend(PowerBackend):
+    """Only records the event, for demos and non-Windows environments (e.g. Replit)."""
+
+    name = 'simulated'
+
+    def suspend(self):
+        logger.info("スリープモードをシミュレートしています（デモモード）")
+        events_logger.info("SIMULATED SLEEP TRIGGERED")
+        return SIMULATED_MESSAGE
+
+
+class FakeBackend(PowerBackend):
+    """Scriptable backend for tests: records calls and succeeds or fails on demand."""
+
+    def __init__(self, name='fake', available=True, succeed=True, message='fake sleep'):
+        self.name = name
+        self.available = available
+        self.succeed = succeed
+        self.message = message
+        self.calls = 0
+
+    def probe(self):
+        return self.available
+
+    def suspend(self):
+        self.calls += 1
+        if not self.succeed:
+            raise PowerBackendError(f"{self.name} failed")
+        return self.message
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (SetSuspendStateBackend, Rundll32Backend, PowerShellBackend,
+                    SystemctlBackend, SimulatedBackend)
+}
+
+
+def default_backend_names():
+    """Backend order used when SLEEP_BACKENDS is not set."""
+    if platform.system() == 'Windows':
+        return ['ctypes', 'rundll32', 'powershell']
+    # Never suspend a non-Windows host unless asked to (SLEEP_BACKENDS=systemctl)
+    return ['simulated']
+
+
+def backends_from_names(names):
+    """Instantiate backends by name, skipping unknown names."""
+    backends = []
+    for name in names:
+        backend = BACKENDS.get(name.strip())
+        if backend is None:
+            logger.warning(f"Unknown sleep backend: {name}")
+            continue
+        backends.append(backend())
+    return backends
+
+
+class PowerController:
+    """Tries power backends in order, remembering the one that last worked."""
+
+    def __init__(self, backends, on_attempt=None):
+        """
+        Args:
+            backends (list): PowerBackend instances in fallback order
+            on_attempt (callable): called as on_attempt(name, seconds, success)
+                after every backend attempt
+        """
+        self.backends = list(backends)
+        self.on_attempt = on_attempt
+        self.available = None
+        self.preferred = None
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """Check which backends can run here. Done once; later calls are free."""
+        if self.available is not None:
+            return self.available
+        with self._lock:
+            if self.available is None:
+                available = []
+                for backend in self.backends:
+                    try:
+                        usable = backend.probe()
+                    except Exception as e:
+                        logger.warning(f"Sleep backend {backend.name} probe failed: {e}")
+                        usable = False
+                    if usable:
+                        available.append(backend)
+                if platform.system() == 'Windows':
+                    self._check_admin()
+                logger.info(f"Available sleep backends: {[b.name for b in available]}")
+                self.available = available
+        return self.available
+
+    def _check_admin(self):
+        try:
+            if ctypes.windll.shell32.IsUserAnAdmin() == 0:
+                logger.warning("プロセスが管理者権限で実行されていません")
+        except Exception as e:
+            logger.warning(f"管理者ステータスを確認できませんでした: {e}")
+
+    def ordered_backends(self):
+        """Available backends, with the last successful one first."""
+        backends = self.probe()
+        preferred = self.preferred
+        if preferred is None or preferred not in backends:
+            return backends
+        return [preferred] + [b for b in backends if b is not preferred]
+
+    def trigger(self):
+        """
+        Suspend the system using the first backend that works.
+
+        Returns:
+            tuple: (success, message)
+        """
+        backends = self.ordered_backends()
+        if not backends:
+            return False, "利用可能なスリープ方法がありません"
+
+        for backend in backends:
+            logger.debug(f"スリープ方法を試行中: {backend.name}")
+            start = time.perf_counter()
+            try:
+                message = backend.suspend()
+            except Exception as e:
+                self._failed(backend, start, e)
+                continue
+            return self._succeeded(backend, start, message)
+
+        return False, "利用可能なすべての方法でスリープモードの起動に失敗しました"
+
+    async def trigger_async(self):
+        """
+        Async variant of trigger(): command backends are awaited as subprocesses.
+
+        Returns:
+            tuple: (success, message)
+        """
+        backends = self.ordered_backends()
+        if not backends:
+            return False, "利用可能なスリープ方法がありません"
+
+        for backend in backends:
+            logger.debug(f"スリープ方法を試行中: {backend.name}")
+            start = time.perf_counter()
+            try:
+                message = await backend.suspend_async()
+            except Exception as e:
+                self._failed(backend, start, e)
+                continue
+            return self._succeeded(backend, start, message)
+
+        return False, "利用可能なすべての方法でスリープモードの起動に失敗しました"
+
+    def _succeeded(self, backend, start, message):
+        self._record(backend, start, True)
+        if not isinstance(backend, SimulatedBackend):
+            events_logger.info(f"SLEEP TRIGGERED via {backend.name}")
+        self.preferred = backend
+        return True, message
+
+    def _failed(self, backend, start, error):
+        self._record(backend, start, False)
+        logger.error(f"{backend.name}を使用したスリープに失敗しました: {str(error)}")
+
+    def _record(self, backend, start, success):
+        if self.on_attempt:
+            try:
+                self.on_attempt(backend.name, time.perf_counter() - start, success)
+            except Exception:
+                logger.exception("Error in sleep backend attempt hook")
+
+
+def controller_from_environment():
+    """Create a controller from SLEEP_BACKENDS (comma-separated backend names)."""
+    names = os.environ.get('SLEEP_BACKENDS')
+    names = names.split(',') if names else default_backend_names()
+    return PowerController(backends_from_names(names))
@@ -0,0 +1,548 @@
+"""
+Delayed and recurring power actions.
+
+Schedules live in the ``schedules`` table, so they survive restarts and can
+be created from any server worker. Exactly one process runs them: the one
+holding the ``instance/scheduler.lock`` file lock (the leader). Every other
+process retries the lock every SCHEDULER_SYNC_INTERVAL seconds and takes
+over if the leader exits. A process that forks workers (the gunicorn master
+with preload) stops competing and leaves the schedules to its workers.
+
+The leader keeps pending schedules in a heap ordered by run time and waits
+on a single timer thread for the earliest one, so thousands of schedules
+cost memory, not threads. Adding or rescheduling is O(log n). Cancelling
+marks the heap entry dead in O(1); dead entries are dropped when they reach
+the top, and the heap is compacted when most of it is dead. Schedules added
+or cancelled by other workers are picked up from the table's ``updated``
+column on the same interval. Due actions run on a small thread pool so a
+slow action never delays the timer.
+
+A schedule that is due while the service was down still runs if it is at
+most SCHEDULER_MISFIRE_GRACE seconds late; otherwise a one-off schedule is
+marked ``missed`` and a recurring one moves on to its next time.
+
+Endpoints (API key or Basic auth):
+
+- POST   /api/schedules        create. JSON: action ("sleep"), and either
+                               delay_minutes, run_at (ISO local time), or
+                               at ("23:00") with days ("daily", "weekdays",
+                               "weekends" or e.g. "mon,wed,fri"); optional
+                               target (host group, controller mode only).
+                               One-off times may be up to 366 days ahead;
+                               run_at may not be in the past
+- GET    /api/schedules        pending schedules (?status=all for every one)
+- GET    /api/schedules/<id>
+- DELETE /api/schedules/<id>   cancel
+"""
+import os
+import time
+import uuid
+import math
+import heapq
+import logging
+import datetime
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify, url_for
+from sqlalchemy import select, update
+from models import db, Schedule
+from file_lock import try_lock
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Schedule states
+PENDING = 'pending'
+DONE = 'done'
+MISSED = 'missed'
+CANCELLED = 'cancelled'
+
+DEFAULT_SYNC_INTERVAL = 1.0
+DEFAULT_MISFIRE_GRACE = 300
+DEFAULT_RUN_WORKERS = 4
+
+# How far ahead a one-off schedule may be set (delay_minutes / run_at)
+MAX_SCHEDULE_AHEAD = datetime.timedelta(days=366)
+
+# How far in the past run_at may be (client clocks and request latency)
+RUN_AT_TOLERANCE = datetime.timedelta(seconds=60)
+
+# Longest single wait of the timer thread, so wall-clock jumps (suspend,
+# clock changes) are noticed within this many seconds
+MAX_WAIT = 30
+
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY_ALIASES = {
+    'daily': DAY_NAMES,
+    'weekdays': DAY_NAMES[:5],
+    'weekends': DAY_NAMES[5:],
+}
+
+
+def parse_recurrence(days, at):
+    """
+    Normalise a weekly recurrence to its stored form, "mon,tue 23:00".
+
+    Args:
+        days: "daily", "weekdays", "weekends", "mon,wed" or a list of day names
+        at (str): local time of day, "HH:MM"
+
+    Raises:
+        ValueError: if either part is invalid
+    """
+    if isinstance(days, str):
+        days = DAY_ALIASES.get(days.strip().lower()) or days.split(',')
+    if not isinstance(days, (list, tuple)) or not all(isinstance(day, str) for day in days):
+        raise ValueError(f"曜日が正しくありません: {days}")
+    if not isinstance(at, str):
+        raise ValueError(f"時刻は HH:MM 形式で指定してください: {at}")
+    names = {day.strip().lower()[:3] for day in days}
+    unknown = names - set(DAY_NAMES)
+    if not names or unknown:
+        raise ValueError(f"曜日が正しくありません: {', '.join(sorted(unknown)) or days}")
+    try:
+        time_of_day = datetime.datetime.strptime(at.strip(), '%H:%M').time()
+    except ValueError:
+        raise ValueError(f"時刻は HH:MM 形式で指定してください: {at}")
+    ordered = ','.join(day for day in DAY_NAMES if day in names)
+    return f"{ordered} {time_of_day.strftime('%H:%M')}"
+
+
+def next_occurrence(recurrence, after):
+    """First time after ``after`` that matches a stored recurrence."""
+    days, time_of_day = recurrence.split(' ')
+    weekdays = {DAY_NAMES.index(day) for day in days.split(',')}
+    hour, minute = (int(part) for part in time_of_day.split(':'))
+    start = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    for offset in range(8):
+        candidate = start + datetime.timedelta(days=offset)
+        if candidate.weekday() in weekdays and candidate > after:
+            return candidate
+    raise ValueError(f"Invalid recurrence: {recurrence}")
+
+
+def schedule_to_dict(schedule):
+    """Serialise a Schedule row for the JSON API."""
+    def iso(value):
+        return value.isoformat(timespec='seconds') if value else None
+
+    return {
+        'schedule_id': schedule.id,
+        'action': schedule.action,
+        'status': schedule.status,
+        'run_at': iso(schedule.run_at),
+        'recurrence': schedule.recurrence,
+        'target': schedule.target,
+        'created': iso(schedule.created),
+        'last_run': iso(schedule.last_run),
+        'last_result': schedule.last_result,
+        'run_count': schedule.run_count,
+    }
+
+
+class Scheduler:
+    """Runs due schedules from a heap on one timer thread (in the leader process only)."""
+
+    def __init__(self, app, run_action, actions=('sleep',), lock_path=None,
+                 sync_interval=DEFAULT_SYNC_INTERVAL, misfire_grace=DEFAULT_MISFIRE_GRACE,
+                 run_workers=DEFAULT_RUN_WORKERS):
+        """
+        Args:
+            app (Flask): app whose database holds the schedules
+            run_action (callable): run_action(schedule) runs a due schedule
+                inside an app context and returns a result message
+            actions (iterable): action names that may be scheduled
+            lock_path (str): leader lock (default: <instance>/scheduler)
+            sync_interval (float): seconds between leader checks and syncs
+            misfire_grace (float): how late a missed run may still start
+            run_workers (int): actions that may run at once
+        """
+        self.app = app
+        self.run_action = run_action
+        self.actions = frozenset(actions)
+        self.lock_path = lock_path or os.path.join(app.instance_path, 'scheduler')
+        self.sync_interval = sync_interval
+        self.misfire_grace = misfire_grace
+        self.run_workers = run_workers
+
+        # Heap of [run time (epoch), tie-breaker, schedule ID, alive]
+        self._heap = []
+        # schedule ID -> its live heap entry
+        self._entries = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._lock_fd = None
+        self._synced_at = None
+        self._thread = None
+        self._retired = False
+        self._runner = ThreadPoolExecutor(max_workers=run_workers, thread_name_prefix='schedule-run')
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_parent=self._retire, after_in_child=self._after_fork)
+
+    @property
+    def is_leader(self):
+        return self._lock_fd is not None
+
+    @property
+    def pending(self):
+        """Schedules waiting in this process's heap (0 unless it is the leader)."""
+        return len(self._entries) if self.is_leader else 0
+
+    # Heap -----------------------------------------------------------------
+
+    def _push(self, schedule_id, when):
+        """Add or move a schedule; O(log n). Call with the condition held."""
+        self._remove(schedule_id)
+        entry = [when, next(self._counter), schedule_id, True]
+        self._entries[schedule_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._cond.notify()
+
+    def _remove(self, schedule_id):
+        """Drop a schedule from the heap; O(1). Call with the condition held."""
+        entry = self._entries.pop(schedule_id, None)
+        if entry is None:
+            return
+        entry[3] = False
+        # Rebuild once dead entries make up most of the heap
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [entry for entry in self._heap if entry[3]]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now):
+        """Remove and return the IDs of schedules due at ``now``; O(k log n)."""
+        due = []
+        while self._heap and (self._heap[0][0] <= now or not self._heap[0][3]):
+            when, _, schedule_id, alive = heapq.heappop(self._heap)
+            if alive:
+                del self._entries[schedule_id]
+                due.append(schedule_id)
+        return due
+
+    def _next_wait(self, now):
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+        wait = min(self.sync_interval, MAX_WAIT)
+        if self._heap:
+            wait = min(wait, max(0.0, self._heap[0][0] - now))
+        return wait
+
+    # Table ----------------------------------------------------------------
+
+    def _sync(self):
+        """Apply schedules created, moved or cancelled since the last sync."""
+        now = datetime.datetime.now()
+        query = select(Schedule.id, Schedule.status, Schedule.run_at)
+        if self._synced_at is None:
+            query = query.where(Schedule.status == PENDING)
+        else:
+            # Other workers' commits may land slightly out of order
+            query = query.where(Schedule.updated >= self._synced_at - datetime.timedelta(seconds=5))
+        with self.app.app_context():
+            rows = db.session.execute(query).all()
+        with self._cond:
+            for schedule_id, status, run_at in rows:
+                if status == PENDING:
+                    entry = self._entries.get(schedule_id)
+                    if entry is None or entry[0] != run_at.timestamp():
+                        self._push(schedule_id, run_at.timestamp())
+                else:
+                    self._remove(schedule_id)
+        if self._synced_at is None:
+            logger.info(f"Scheduler leader in PID {os.getpid()}: {len(rows)} pending schedules")
+        self._synced_at = now
+
+    def create(self, action, run_at, recurrence=None, target=None, key_id=None):
+        """
+        Store a new schedule (inside a request or app context).
+
+        Returns:
+            Schedule: the new row
+
+        Raises:
+            ValueError: if the action is unknown
+        """
+        if action not in self.actions:
+            raise ValueError(f"不明なアクションです: {action}")
+        now = datetime.datetime.now()
+        schedule = Schedule(
+            id=uuid.uuid4().hex,
+            action=action,
+            status=PENDING,
+            run_at=run_at,
+            recurrence=recurrence,
+            target=target,
+            key_id=key_id,
+            created=now,
+            updated=now,
+        )
+        db.session.add(schedule)
+        db.session.commit()
+        if self.is_leader:
+            with self._cond:
+                self._push(schedule.id, run_at.timestamp())
+        logger.info(f"Schedule {schedule.id} created: {action} at {run_at.isoformat(timespec='seconds')}"
+                    + (f", repeating {recurrence}" if recurrence else ''))
+        return schedule
+
+    def cancel(self, schedule_id):
+        """
+        Cancel a pending schedule (inside a request or app context).
+
+        Returns:
+            bool: False if it does not exist or is no longer pending
+        """
+        result = db.session.execute(
+            update(Schedule)
+            .where(Schedule.id == schedule_id, Schedule.status == PENDING)
+            .values(status=CANCELLED, updated=datetime.datetime.now())
+        )
+        db.session.commit()
+        if result.rowcount and self.is_leader:
+            with self._cond:
+                self._remove(schedule_id)
+        if result.rowcount:
+            logger.info(f"Schedule {schedule_id} cancelled")
+        return bool(result.rowcount)
+
+    # Running --------------------------------------------------------------
+
+    def _fire(self, schedule_id):
+        """Claim a due schedule, advance or finish it, then run its action."""
+        try:
+            with self.app.app_context():
+                schedule = db.session.get(Schedule, schedule_id)
+                if schedule is None or schedule.status != PENDING:
+                    return
+                now = datetime.datetime.now()
+                due_at = schedule.run_at
+                late = (now - due_at).total_seconds()
+                missed = late > self.misfire_grace
+
+                values = {'updated': now}
+                next_run = None
+                if schedule.recurrence:
+                    next_run = next_occurrence(schedule.recurrence, max(now, due_at))
+                    values['run_at'] = next_run
+                else:
+                    values['status'] = MISSED if missed else DONE
+                if missed:
+                    values['last_result'] = f"{int(late)} 秒遅れのため実行されませんでした"
+                else:
+                    values['last_run'] = now
+                    values['run_count'] = Schedule.run_count + 1
+
+                # Claim the run: only one process may move a schedule past this run_at
+                claimed = db.session.execute(
+                    update(Schedule)
+                    .where(Schedule.id == schedule_id, Schedule.status == PENDING,
+                           Schedule.run_at == due_at)
+                    .values(**values)
+                ).rowcount
+                db.session.commit()
+                if not claimed:
+                    return
+                if next_run is not None:
+                    with self._cond:
+                        self._push(schedule_id, next_run.timestamp())
+                if missed:
+                    logger.warning(f"Schedule {schedule_id} missed its run at {due_at} ({int(late)}s late)")
+                    metrics.SCHEDULE_RUNS.inc(result='missed')
+                    return
+
+                db.session.refresh(schedule)
+                try:
+                    result, outcome = self.run_action(schedule), 'success'
+                    logger.info(f"Schedule {schedule_id} ran {schedule.action}: {result}")
+                except Exception as e:
+                    logger.exception(f"Schedule {schedule_id} failed")
+                    result, outcome = f"エラー: {e}", 'failure'
+                metrics.SCHEDULE_RUNS.inc(result=outcome)
+                db.session.execute(update(Schedule).where(Schedule.id == schedule_id)
+                                   .values(last_result=result))
+                db.session.commit()
+        except Exception:
+            logger.exception(f"Error running schedule {schedule_id}")
+
+    def _run(self):
+        while not self._retired:
+            if not self.is_leader:
+                self._lock_fd = try_lock(self.lock_path)
+                if not self.is_leader:
+                    time.sleep(self.sync_interval)
+                    continue
+            try:
+                now = time.time()
+                if self._synced_at is None or now - self._synced_at.timestamp() >= self.sync_interval:
+                    self._sync()
+                with self._cond:
+                    due = self._pop_due(time.time())
+                for schedule_id in due:
+                    self._runner.submit(self._fire, schedule_id)
+                with self._cond:
+                    self._cond.wait(self._next_wait(time.time()))
+            except Exception:
+                logger.exception("Error in scheduler loop")
+                time.sleep(self.sync_interval)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def start(self):
+        """Start the timer thread; it runs schedules once this process becomes leader."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def _retire(self):
+        """After forking a worker: let the workers hold the leadership."""
+        self._retired = True
+        with self._cond:
+            self._cond.notify()
+
+    def _after_fork(self):
+        """A forked worker starts as a follower with an empty heap."""
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self._retired = False
+        self._heap = []
+        self._entries = {}
+        self._synced_at = None
+        self._cond = threading.Condition()
+        self._runner = ThreadPoolExecutor(max_workers=self.run_workers, thread_name_prefix='schedule-run')
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+
+def parse_request(data, now=None):
+    """
+    Turn a POST /api/schedules body into (run_at, recurrence).
+
+    Raises:
+        ValueError: with a message for the client
+    """
+    now = now or datetime.datetime.now()
+    if data.get('at') is not None or data.get('days') is not None:
+        recurrence = parse_recurrence(data.get('days', 'daily'), data.get('at', ''))
+        return next_occurrence(recurrence, now), recurrence
+    if data.get('delay_minutes') is not None:
+        max_minutes = int(MAX_SCHEDULE_AHEAD.total_seconds() // 60)
+        invalid = f"delay_minutes は 0 から {max_minutes} までの数値で指定してください"
+        try:
+            minutes = float(data['delay_minutes'])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(invalid)
+        # Also rejects nan and inf, which timedelta cannot represent
+        if not (math.isfinite(minutes) and 0 <= minutes <= max_minutes):
+            raise ValueError(invalid)
+        return now + datetime.timedelta(minutes=minutes), None
+    if data.get('run_at'):
+        invalid = f"run_at は {MAX_SCHEDULE_AHEAD.days} 日以内の日時を ISO 形式で指定してください: {data['run_at']}"
+        try:
+            run_at = datetime.datetime.fromisoformat(str(data['run_at']))
+            if run_at.tzinfo is not None:
+                # Stored as local time, like every other timestamp
+                run_at = run_at.astimezone().replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            raise ValueError(invalid)
+        if run_at - now > MAX_SCHEDULE_AHEAD:
+            raise ValueError(invalid)
+        if run_at < now - RUN_AT_TOLERANCE:
+            raise ValueError(f"run_at が過去の日時です: {data['run_at']}")
+        return run_at, None
+    raise ValueError("delay_minutes、run_at、または at と days のいずれかを指定してください")
+
+
+def create_blueprint(authenticate, scheduler, allow_targets=False):
+    """
+    Build the schedule routes.
+
+    Args:
+        authenticate: app.authenticate_api_request, returning (key_id, error)
+        scheduler (Scheduler): stores and runs the schedules
+        allow_targets (bool): accept host group targets (controller mode)
+    """
+    bp = Blueprint('scheduler', __name__)
+
+    @bp.route('/api/schedules', methods=['POST'])
+    def create_schedule():
+        key_id, error = authenticate()
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "JSON オブジェクトを送信してください"}), 400
+        action = data.get('action', 'sleep')
+        if not isinstance(action, str):
+            return jsonify({"error": "action は文字列で指定してください"}), 400
+        target = data.get('target') or None
+        if target is not None and not isinstance(target, str):
+            return jsonify({"error": "target はホストグループ名の文字列で指定してください"}), 400
+        if target and not allow_targets:
+            return jsonify({"error": "target はコントローラーモードでのみ指定できます"}), 400
+        try:
+            run_at, recurrence = parse_request(data)
+            schedule = scheduler.create(action, run_at, recurrence, target, key_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        location = url_for('scheduler.get_schedule', schedule_id=schedule.id)
+        return jsonify(schedule_to_dict(schedule)), 201, {'Location': location}
+
+    @bp.route('/api/schedules', methods=['GET'])
+    def list_schedules():
+        _, error = authenticate()
+        if error:
+            return error
+        query = select(Schedule).order_by(Schedule.run_at)
+        if request.args.get('status') != 'all':
+            query = query.where(Schedule.status == PENDING)
+        schedules = db.session.execute(query).scalars().all()
+        return jsonify([schedule_to_dict(schedule) for schedule in schedules]), 200
+
+    @bp.route('/api/schedules/<schedule_id>', methods=['GET'])
+    def get_schedule(schedule_id):
+        _, error = authenticate()
+        if error:
+            return error
+        schedule = db.session.get(Schedule, schedule_id)
+        if schedule is None:
+            return jsonify({"error": "スケジュールが見つかりません"}), 404
+        return jsonify(schedule_to_dict(schedule)), 200
+
+    @bp.route('/api/schedules/<schedule_id>', methods=['DELETE'])
+    def cancel_schedule(schedule_id):
+        _, error = authenticate()
+        if error:
+            return error
+        if not scheduler.cancel(schedule_id):
+            if db.session.get(Schedule, schedule_id) is None:
+                return jsonify({"error": "スケジュールが見つかりません"}), 404
+            return jsonify({"error": "このスケジュールは既に終了しています"}), 409
+        return '', 204
+
+    return bp
+
+
+def init_app(app, authenticate, run_action, actions=('sleep',), allow_targets=False):
+    """
+    Register the schedule endpoints and start the scheduler.
+
+    Returns:
+        Scheduler: configured from SCHEDULER_* variables
+    """
+    scheduler = Scheduler(
+        app,
+        run_action,
+        actions=actions,
+        sync_interval=float(os.environ.get('SCHEDULER_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)),
+        misfire_grace=float(os.environ.get('SCHEDULER_MISFIRE_GRACE', DEFAULT_MISFIRE_GRACE)),
+    )
+    app.register_blueprint(create_blueprint(authenticate, scheduler, allow_targets))
+    metrics.SCHEDULES_PENDING.set_function(lambda: scheduler.pending)
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,224 @@
+"""
+Production server for the Flask app.
+
+Two servers are supported, both declared dependencies:
+
+- gunicorn (default outside Windows): SERVER_WORKERS processes with
+  SERVER_THREADS threads each (gthread workers). The app is imported once in
+  the master and forked into the workers (preload), so a worker starts
+  without repeating the startup work and a broken app fails before any
+  worker is spawned. SIGTERM stops accepting and lets in-flight requests
+  finish for up to SERVER_GRACEFUL_TIMEOUT seconds.
+- waitress (default on Windows, where gunicorn does not run): one process
+  with SERVER_THREADS threads. SIGTERM, Ctrl-C and Ctrl-Break close the
+  listening socket, wait up to SERVER_GRACEFUL_TIMEOUT seconds for
+  in-flight requests, then exit.
+
+Keep-alive connections are held by the server's event loop, not by a
+thread, so a long SERVER_KEEPALIVE lets warm Lambda functions reuse their
+connection cheaply.
+
+Environment variables (command line flags take precedence):
+    SERVER                   gunicorn | waitress (default: per platform)
+    SERVER_HOST              bind address (default 0.0.0.0)
+    SERVER_PORT              port (default 5000)
+    SERVER_WORKERS           gunicorn worker processes (default 2)
+    SERVER_THREADS           threads per process (default 8)
+    SERVER_BACKLOG           listen backlog (default 2048)
+    SERVER_KEEPALIVE         seconds an idle keep-alive connection stays open (default 75)
+    SERVER_TIMEOUT           gunicorn: restart a worker silent for this long (default 30)
+    SERVER_GRACEFUL_TIMEOUT  seconds to drain in-flight requests on stop (default 10)
+    SERVER_CONNECTION_LIMIT  waitress: open connections accepted at once (default 1000)
+
+Example:
+    python serve.py --server waitress --threads 16
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import importlib
+
+logger = logging.getLogger(__name__)
+
+SERVERS = ('gunicorn', 'waitress')
+
+DEFAULT_APP = 'app:app'
+
+DEFAULTS = {
+    'host': '0.0.0.0',
+    'port': 5000,
+    'workers': 2,
+    'threads': 8,
+    'backlog': 2048,
+    'keepalive': 75,
+    'timeout': 30,
+    'graceful_timeout': 10,
+    'connection_limit': 1000,
+}
+
+
+def default_server():
+    """gunicorn where it can fork workers, waitress on Windows."""
+    return 'waitress' if os.name == 'nt' else 'gunicorn'
+
+
+def load_app(spec):
+    """Import a WSGI app from a "module:attribute" string."""
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def options_from_environment():
+    """Server options from the SERVER_* environment variables."""
+    options = {}
+    for name, default in DEFAULTS.items():
+        value = os.environ.get(f"SERVER_{name.upper()}")
+        if value:
+            options[name] = type(default)(value)
+    return options
+
+
+def _worker_exit(server, worker):
+    """gunicorn hook, run in the exiting worker: keep its counters for /metrics."""
+    import metrics
+    metrics.REGISTRY.retire()
+
+
+def run_gunicorn(app_spec, host, port, workers, threads, backlog, keepalive, timeout,
+                 graceful_timeout, preload=True, **_):
+    """Run gunicorn with gthread workers until it is stopped."""
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f"{host}:{port}",
+                'workers': workers,
+                'worker_class': 'gthread',
+                'threads': threads,
+                'backlog': backlog,
+                'keepalive': keepalive,
+                'timeout': timeout,
+                'graceful_timeout': graceful_timeout,
+                'preload_app': preload,
+                'worker_exit': _worker_exit,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With preload_app this runs once in the master, before fork
+            return load_app(app_spec)
+
+    Application().run()
+
+
+def run_waitress(app_spec, host, port, threads, backlog, keepalive, graceful_timeout,
+                 connection_limit, **_):
+    """Run waitress until SIGTERM/SIGINT, then drain in-flight requests."""
+    import waitress
+    from waitress import wasyncore
+
+    server = waitress.create_server(
+        load_app(app_spec),
+        host=host,
+        port=port,
+        threads=threads,
+        backlog=backlog,
+        channel_timeout=keepalive,
+        connection_limit=connection_limit,
+    )
+    stopping = []
+
+    def request_stop(signum, frame):
+        stopping.append(signum)
+        server.pull_trigger()
+
+    for name in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), request_stop)
+
+    logger.info(f"Serving on http://{host}:{port} with waitress ({threads} threads)")
+    adj = server.adj
+    while not stopping:
+        wasyncore.loop(timeout=adj.asyncore_loop_timeout, map=server._map,
+                       use_poll=adj.asyncore_use_poll, count=1)
+
+    # Stop accepting, then keep the loop running until running requests
+    # have been answered and their responses written. This uses waitress
+    # internals (the socket map, task dispatcher and channels); waitress is
+    # kept below 4 in pyproject.toml and tests/test_serve.py covers the drain
+    logger.info("Stopping: draining in-flight requests")
+    wasyncore.dispatcher.close(server)
+    dispatcher = server.task_dispatcher
+    deadline = time.monotonic() + graceful_timeout
+    while time.monotonic() < deadline:
+        busy = dispatcher.active_count or dispatcher.queue or any(
+            channel.requests or channel.total_outbufs_len
+            for channel in server._map.values() if hasattr(channel, 'requests')
+        )
+        if not busy:
+            break
+        wasyncore.loop(timeout=0.1, map=server._map, use_poll=adj.asyncore_use_poll, count=1)
+    else:
+        logger.warning(f"Requests still running after {graceful_timeout}s, closing them")
+    dispatcher.shutdown(timeout=1)
+    wasyncore.close_all(server._map)
+    server.trigger.close()
+    logger.info("Server stopped")
+
+
+def serve(app_spec=DEFAULT_APP, server=None, **options):
+    """
+    Run the production server until it is stopped.
+
+    Args:
+        app_spec (str): "module:attribute" of the WSGI app
+        server (str): "gunicorn" or "waitress"; None picks the platform default
+        **options: overrides for DEFAULTS and SERVER_* variables
+    """
+    settings = dict(DEFAULTS, **options_from_environment())
+    settings.update({key: value for key, value in options.items() if value is not None})
+    server = server or os.environ.get('SERVER') or default_server()
+    if server not in SERVERS:
+        raise ValueError(f"Unknown server: {server}")
+
+    if server == 'gunicorn':
+        try:
+            import gunicorn  # noqa: F401 -- not importable on Windows
+        except ImportError:
+            logger.warning("gunicorn is not available, falling back to waitress")
+            server = 'waitress'
+
+    if server == 'gunicorn':
+        run_gunicorn(app_spec, **settings)
+    else:
+        run_waitress(app_spec, **settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the Alexa Sleep Service with a production server.')
+    parser.add_argument('--app', default=DEFAULT_APP, help='WSGI app as module:attribute (default: app:app)')
+    parser.add_argument('--server', choices=SERVERS, help='default: SERVER, else gunicorn (waitress on Windows)')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, help='threads per process')
+    parser.add_argument('--backlog', type=int)
+    parser.add_argument('--keepalive', type=int, help='idle keep-alive seconds')
+    parser.add_argument('--graceful-timeout', type=int, help='seconds to drain requests on stop')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='gunicorn: import the app in each worker instead of the master')
+    args = parser.parse_args(argv)
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO)
+    options = {key: value for key, value in vars(args).items() if key not in ('app', 'server')}
+    serve(args.app, args.server, **options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
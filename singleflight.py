@@ -0,0 +1,71 @@
+"""
+Single-flight call coalescing.
+
+When several callers ask for the same action at once (Alexa retries, several
+Echo devices firing together), only the first one actually runs it; the others
+wait for and share its result. Callers arriving within ``window`` seconds after
+it finished also get that result instead of running the action again.
+"""
+import time
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """Coalesces concurrent and near-simultaneous calls that share a key."""
+
+    def __init__(self, window=0.0):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run ``fn()`` for ``key`` unless an equivalent call is in flight or
+        finished less than ``window`` seconds ago; in that case return (or
+        raise) that call's outcome.
+        """
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or (
+                call.finished_at is not None and now - call.finished_at >= self.window
+            )
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                call.finished_at = time.monotonic()
+                if self.window <= 0 and self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def forget(self, key):
+        """Drop any remembered result for ``key`` so the next call runs."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.finished_at is not None:
+                del self._calls[key]
@@ -0,0 +1,237 @@
+"""
+Offline generator for per-host Alexa skill and Lambda artifacts.
+
+Reads a CSV or JSON list of hosts (same format as lambda_fleet.py) and writes,
+for every host, without any AWS calls or credentials:
+
+    <output>/<host>/skill-package/skill.json                     manifest
+    <output>/<host>/skill-package/interactionModels/custom/<locale>.json
+    <output>/<host>/lambda.zip                                   deployment package
+    <output>/<host>/INSTRUCTIONS.md                              setup instructions
+
+Each host's skill has only SleepIntent, matching its single-PC Lambda
+handler. With ``--group-function`` the same files are also written for one
+fan-out function that reaches every host (the group handler and a skill with
+SleepGroupIntent for the hosts' ``groups``), as ``lambda_fleet.py
+--group-function`` deploys it. INSTRUCTIONS.md always embeds the interaction
+model written to the skill package next to it.
+
+Hosts are spread across worker processes; each worker writes its host's files
+directly and the parent streams one JSON line per finished host to stdout and
+to ``<output>/index.ndjson``. Locale data is built once per worker process.
+
+Example:
+    python skill_artifacts.py hosts.csv --output artifacts --region ap-northeast-1 \\
+        --account-id 123456789012
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import aws_integration
+import lambda_package
+from lambda_fleet import RUNTIMES, GROUP_RUNTIMES, GROUP_FUNCTION_NAME, load_hosts, function_name_for
+
+# Used in ARNs when no --account-id is given; replace before uploading
+ACCOUNT_ID_PLACEHOLDER = 'ACCOUNT_ID'
+
+
+def _safe_name(name):
+    """
+    Directory name for a host: characters outside [A-Za-z0-9._-] become "_".
+
+    Raises:
+        ValueError: if nothing usable is left ("", "." or "..")
+    """
+    safe = re.sub(r'[^A-Za-z0-9._-]', '_', name)
+    if not safe.strip('.'):
+        raise ValueError(f"Invalid host name for an output directory: {name!r}")
+    return safe
+
+
+def _check_directories(names):
+    """
+    Find names that cannot get an output directory of their own.
+
+    Returns:
+        dict: name -> error, for invalid names and names whose directories collide
+    """
+    errors = {}
+    owners = {}
+    for name in names:
+        try:
+            owners.setdefault(_safe_name(name), []).append(name)
+        except ValueError as e:
+            errors[name] = str(e)
+    for directory, shared in owners.items():
+        if len(shared) > 1:
+            for name in shared:
+                errors[name] = (f"Output directory {directory} would be shared by: "
+                                f"{', '.join(repr(other) for other in shared)}")
+    return errors
+
+
+def _write(path, data, private=False):
+    """Write str or bytes to ``path``; ``private`` files (containing API keys) get 0600."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if private else 0o644)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+
+
+def _dump(value):
+    return json.dumps(value, indent=2, ensure_ascii=False)
+
+
+def _write_artifacts(directory, function_name, region, account_id, runtimes, runtime, params, groups=None):
+    """
+    Write the skill package, Lambda package and instructions of one function.
+
+    Returns:
+        dict: function name, ARN and CodeSha256 for the index
+    """
+    if runtime not in runtimes:
+        raise ValueError(f"Unsupported runtime: {runtime}")
+    runtime_str, template, _ = runtimes[runtime]
+    function_arn = f"arn:aws:lambda:{region}:{account_id}:function:{function_name}"
+
+    skill = aws_integration.build_alexa_skill(function_arn, groups)
+    package_dir = os.path.join(directory, 'skill-package')
+    _write(os.path.join(package_dir, 'skill.json'), _dump({'manifest': skill['manifest']}))
+    for locale, model in skill['interactionModel'].items():
+        _write(os.path.join(package_dir, 'interactionModels', 'custom', f"{locale}.json"), _dump(model))
+
+    code = lambda_package.render(template, params)
+    data = lambda_package.build_zip({lambda_package.ENTRY_FILES[runtime]: code})
+    _write(os.path.join(directory, 'lambda.zip'), data, private=True)
+
+    lambda_info = {
+        'function_name': function_name,
+        'function_arn': function_arn,
+        'region': region,
+        'runtime': runtime_str,
+    }
+    _write(os.path.join(directory, 'INSTRUCTIONS.md'),
+           aws_integration.get_alexa_skill_setup_instructions(lambda_info, skill['interactionModel']['ja-JP']))
+
+    return {
+        'directory': directory,
+        'function_name': function_name,
+        'function_arn': function_arn,
+        'code_sha256': lambda_package.code_sha256(data),
+    }
+
+
+def build_host_artifacts(host, output_dir, region, account_id):
+    """
+    Write every artifact of one host.
+
+    Returns:
+        dict: summary line for the index
+    """
+    try:
+        written = _write_artifacts(
+            os.path.join(output_dir, _safe_name(host.name)),
+            host.function_name or function_name_for(host.name),
+            region, account_id, RUNTIMES, host.runtime or 'nodejs',
+            {'API_KEY': host.api_key, 'ENDPOINT_URL': host.endpoint_url},
+        )
+        return dict(host=host.name, ok=True, **written)
+    except Exception as e:
+        return {'host': host.name, 'ok': False, 'error': str(e)}
+
+
+def build_group_artifacts(hosts, output_dir, region, account_id, function_name=GROUP_FUNCTION_NAME,
+                          runtime='nodejs'):
+    """
+    Write the artifacts of the fan-out function that reaches all ``hosts``.
+
+    Returns:
+        dict: summary line for the index
+    """
+    try:
+        groups = sorted({group for host in hosts for group in host.groups})
+        written = _write_artifacts(
+            os.path.join(output_dir, _safe_name(function_name)),
+            function_name, region, account_id, GROUP_RUNTIMES, runtime,
+            aws_integration.group_template_params([host._asdict() for host in hosts]),
+            groups,
+        )
+        return dict(host=function_name, ok=True, groups=groups, **written)
+    except Exception as e:
+        return {'host': function_name, 'ok': False, 'error': str(e)}
+
+
+def generate(hosts, output_dir, region, account_id=ACCOUNT_ID_PLACEHOLDER, workers=None, on_result=None,
+             group_function=None, group_runtime='nodejs'):
+    """
+    Build the artifacts of all hosts across ``workers`` processes.
+
+    With ``group_function``, the fan-out function for all hosts is built too.
+    Results are passed to ``on_result`` (and returned) as each host finishes.
+    Hosts whose names give no usable directory, or the same directory as
+    another host, fail before any worker starts.
+    """
+    hosts = list(hosts)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    names = [host.name for host in hosts] + ([group_function] if group_function else [])
+    errors = _check_directories(names)
+    for name in names:
+        if name in errors:
+            finish({'host': name, 'ok': False, 'error': errors[name]})
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(build_host_artifacts, host, output_dir, region, account_id)
+                   for host in hosts if host.name not in errors]
+        if group_function and group_function not in errors:
+            futures.append(pool.submit(build_group_artifacts, hosts, output_dir, region, account_id,
+                                       group_function, group_runtime))
+        for future in as_completed(futures):
+            finish(future.result())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write Alexa skill and Lambda artifacts for many PCs, offline.')
+    parser.add_argument('hosts', help='CSV or JSON file with name, endpoint_url, api_key[, runtime, function_name, groups]')
+    parser.add_argument('--output', default='artifacts', help='output directory')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', 'us-east-1'))
+    parser.add_argument('--account-id', default=ACCOUNT_ID_PLACEHOLDER, help='AWS account ID used in function ARNs')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--group-function', nargs='?', const=GROUP_FUNCTION_NAME,
+                        help='also write the fan-out function for all hosts (default name: %(const)s)')
+    parser.add_argument('--group-runtime', default='nodejs', choices=sorted(GROUP_RUNTIMES))
+    args = parser.parse_args(argv)
+
+    failed = 0
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'index.ndjson'), 'w', encoding='utf-8') as index:
+        def stream(result):
+            nonlocal failed
+            failed += not result['ok']
+            line = json.dumps(result, ensure_ascii=False)
+            index.write(line + '\n')
+            index.flush()
+            print(line, flush=True)
+
+        results = generate(load_hosts(args.hosts), args.output, args.region, args.account_id,
+                           args.workers, on_result=stream,
+                           group_function=args.group_function, group_runtime=args.group_runtime)
+
+    print(f"{len(results) - failed} hosts written to {args.output}, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,9 @@
 import logging
-import ctypes
-import subprocess
-import platform
-import time
+import threading
 import os
+from singleflight import SingleFlight
+from power_backends import controller_from_environment
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -15,89 +15,75 @@ ES_AWAYMODE_REQUIRED = 0x00000040
 ES_HIBERNATE = 0x00000010
 ES_SYSTEM_REQUIRED = 0x00000001
 
+# Seconds after a sleep attempt during which new requests reuse its result
+SLEEP_COALESCE_WINDOW = float(os.environ.get('SLEEP_COALESCE_WINDOW', 5))
+
+_sleep_flight = SingleFlight(window=SLEEP_COALESCE_WINDOW)
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_controller():
+    """Return the process-wide PowerController, probing backends on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                controller = controller_from_environment()
+                controller.on_attempt = metrics.observe_backend_attempt
+                controller.probe()
+                _controller = controller
+    return _controller
+
+def set_controller(controller):
+    """Replace the PowerController (e.g. with FakeBackends in tests)."""
+    global _controller
+    with _controller_lock:
+        _controller = controller
+
 def trigger_sleep():
     """
-    Attempt to put the Windows system into sleep mode.
+    Attempt to put the system into sleep mode.
+    
+    Backends are configured with SLEEP_BACKENDS (ctypes, rundll32, powershell,
+    systemctl, simulated); the default is the Windows chain on Windows and
+    simulation elsewhere.
     
     Returns:
         tuple: (success, message)
     """
     logger.info("スリープコマンドが起動されました")
     
-    # Check if running on Windows
-    if platform.system() != 'Windows':
-        logger.info("Windowsプラットフォームで実行されていません - シミュレートされたスリープを使用します")
-        
-        # Simulated sleep mode for demonstration in non-Windows environments (e.g., Replit)
-        try:
-            logger.info("スリープモードをシミュレートしています（デモモード）")
-            # Just log the event for simulation
-            with open("sleep_events.log", "a") as f:
-                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - SIMULATED SLEEP TRIGGERED\n")
-            return True, "スリープコマンドが正常にシミュレートされました（デモモード）"
-        except Exception as e:
-            logger.error(f"スリープシミュレーションでエラー: {str(e)}")
-            return False, f"スリープシミュレーションでエラーが発生しました: {str(e)}"
-    
     try:
-        # Import Windows specific modules
-        try:
-            import win32api
-            import win32security
-            import win32con
-        except ImportError:
-            logger.warning("Windows固有のモジュールが利用できません")
-            # Fallback to simulation mode
-            logger.info("代わりにシミュレートされたスリープモードを使用します")
-            with open("sleep_events.log", "a") as f:
-                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - SIMULATED SLEEP TRIGGERED\n")
-            return True, "スリープコマンドが正常にシミュレートされました（デモモード）"
-        
-        # Check for admin privileges
-        try:
-            is_admin = ctypes.windll.shell32.IsUserAnAdmin() != 0
-            if not is_admin:
-                logger.warning("プロセスが管理者権限で実行されていません")
-        except Exception as e:
-            logger.warning(f"管理者ステータスを確認できませんでした: {e}")
-        
-        logger.info("システムをスリープ状態にしようとしています...")
-        
-        # Method 1: Using Windows API through ctypes
-        try:
-            logger.debug("スリープ方法1を試行中: SetSuspendState")
-            ctypes.windll.powrprof.SetSuspendState(0, 1, 0)
-            time.sleep(1)  # Wait a bit to see if sleep was triggered
-            
-            # If we're still running after 1 second, the sleep command might have failed
-            logger.info("SetSuspendState呼び出し後もシステムが実行中です。代替方法を試行します")
-        except Exception as e:
-            logger.error(f"SetSuspendStateを使用したスリープに失敗しました: {str(e)}")
-            
-        # Method 2: Using rundll32
-        try:
-            logger.debug("スリープ方法2を試行中: rundll32")
-            subprocess.run(["rundll32.exe", "powrprof.dll,SetSuspendState", "0,1,0"], 
-                           check=True, 
-                           shell=True, 
-                           capture_output=True)
-            return True, "スリープコマンドが正常に送信されました"
-        except subprocess.SubprocessError as e:
-            logger.error(f"rundll32を使用したスリープに失敗しました: {str(e)}")
-            
-        # Method 3: Using powershell command
-        try:
-            logger.debug("スリープ方法3を試行中: PowerShell")
-            subprocess.run(["powershell", "-Command", "Add-Type -Assembly System.Windows.Forms; [System.Windows.Forms.Application]::SetSuspendState('Suspend', $false, $false)"], 
-                           check=True, 
-                           shell=True, 
-                           capture_output=True)
-            return True, "スリープコマンドが正常に送信されました"
-        except subprocess.SubprocessError as e:
-            logger.error(f"PowerShellを使用したスリープに失敗しました: {str(e)}")
-            
-        return False, "利用可能なすべての方法でスリープモードの起動に失敗しました"
+        return get_controller().trigger()
+    except Exception as e:
+        logger.exception("スリープトリガーで予期しないエラーが発生しました")
+        return False, f"スリープの起動中にエラーが発生しました: {str(e)}"
+
+async def trigger_sleep_async():
+    """
+    Async variant of trigger_sleep() for the ASGI server.
     
+    Returns:
+        tuple: (success, message)
+    """
+    logger.info("スリープコマンドが起動されました")
+    
+    try:
+        return await get_controller().trigger_async()
     except Exception as e:
         logger.exception("スリープトリガーで予期しないエラーが発生しました")
         return False, f"スリープの起動中にエラーが発生しました: {str(e)}"
+
+def trigger_sleep_coalesced(trigger=trigger_sleep):
+    """
+    Single-flight wrapper around trigger_sleep() (or another trigger function).
+
+    Concurrent callers, and callers arriving within SLEEP_COALESCE_WINDOW
+    seconds of a finished attempt, share that attempt's result instead of
+    running the fallback chain again.
+    
+    Returns:
+        tuple: (success, message)
+    """
+    return _sleep_flight.do('sleep', trigger)
@@ -0,0 +1,221 @@
+"""
+Fingerprinted, precompressed static assets.
+
+Every file under ``static/`` is also served at ``/assets/<name>.<hash>.<ext>``,
+where the hash is taken from the file's content, so the URL changes whenever
+the file does. Those responses can therefore be cached for a year as
+``immutable``; browsers never revalidate them. Templates link to them with
+``asset_url('css/custom.css')``.
+
+Each asset is served gzip- or brotli-encoded when the client accepts it. The
+compressed variants are built ahead of time:
+
+    python static_assets.py        # writes static/dist/ and its manifest
+
+and loaded at startup. Variants missing from ``static/dist`` (or built from
+an older version of the file) are compressed once at startup instead, so the
+app works without the build step. Brotli needs the optional ``brotli``
+package; without it only gzip is used.
+"""
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+from collections import namedtuple
+from flask import Response, abort, request, url_for
+from file_lock import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+Asset = namedtuple('Asset', 'name url_name digest content_type variants')
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def fingerprinted_name(name, digest):
+    """css/custom.css -> css/custom.<digest>.css"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def compress(data, encoding):
+    """Compress ``data`` for a Content-Encoding; None if the codec is unavailable."""
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical between builds
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def source_files(static_folder):
+    """Relative paths of the static files, excluding the build output."""
+    names = []
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for filename in files:
+            names.append(os.path.relpath(os.path.join(root, filename), static_folder).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def _write(path, data):
+    atomic_write(path, data)
+    # Readable by a front-end web server serving static/dist directly
+    os.chmod(path, 0o644)
+
+
+def build(static_folder):
+    """
+    Write fingerprinted copies and their compressed variants to static/dist.
+
+    Returns:
+        dict: manifest, source name -> fingerprinted name
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for name in source_files(static_folder):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+        url_name = fingerprinted_name(name, _digest(data))
+        path = os.path.join(dist, *url_name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write(path, data)
+        for encoding, suffix in ENCODINGS:
+            compressed = compress(data, encoding)
+            if compressed is not None and len(compressed) < len(data):
+                _write(path + suffix, compressed)
+        manifest[name] = url_name
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class AssetRegistry:
+    """Fingerprinted assets of one static folder, held in memory."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.dist = os.path.join(static_folder, DIST_DIR)
+        self.by_name = {}
+        self.by_url_name = {}
+        self.load()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.dist, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _built_variant(self, url_name, suffix):
+        try:
+            with open(os.path.join(self.dist, *url_name.split('/')) + suffix, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def load(self):
+        manifest = self._read_manifest()
+        built = compressed = 0
+        for name in source_files(self.static_folder):
+            with open(os.path.join(self.static_folder, name), 'rb') as f:
+                data = f.read()
+            digest = _digest(data)
+            url_name = fingerprinted_name(name, digest)
+            variants = {'identity': data}
+            for encoding, suffix in ENCODINGS:
+                variant = self._built_variant(url_name, suffix) if manifest.get(name) == url_name else None
+                if variant is not None:
+                    built += 1
+                else:
+                    variant = compress(data, encoding)
+                    compressed += variant is not None
+                if variant is not None and len(variant) < len(data):
+                    variants[encoding] = variant
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type == 'application/javascript':
+                content_type += '; charset=utf-8'
+            asset = Asset(name, url_name, digest, content_type, variants)
+            self.by_name[name] = asset
+            self.by_url_name[url_name] = asset
+        if compressed:
+            logger.info(f"Compressed {compressed} static asset variants at startup "
+                        f"({built} prebuilt); run static_assets.py to build them ahead of time")
+
+    def url(self, name):
+        """URL of the current version of a static file."""
+        asset = self.by_name.get(name)
+        if asset is None:
+            # Not fingerprinted (added after startup): plain static URL
+            return url_for('static', filename=name)
+        return url_for('asset', name=asset.url_name)
+
+    def response(self, url_name):
+        """Serve a fingerprinted asset, honouring If-None-Match and Accept-Encoding."""
+        asset = self.by_url_name.get(url_name)
+        if asset is None:
+            abort(404)
+
+        encoding = 'identity'
+        for candidate, _ in ENCODINGS:
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = Response(asset.variants[encoding], content_type=asset.content_type)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.headers['Vary'] = 'Accept-Encoding'
+        # One ETag per encoding: the bodies differ
+        response.set_etag(f"{asset.digest}-{encoding}")
+        return response.make_conditional(request)
+
+
+def init_app(app):
+    """
+    Serve fingerprinted assets at /assets/ and add asset_url() to templates.
+
+    Returns:
+        AssetRegistry: the loaded assets
+    """
+    registry = AssetRegistry(app.static_folder)
+
+    @app.route('/assets/<path:name>')
+    def asset(name):
+        return registry.response(name)
+
+    app.add_template_global(registry.url, 'asset_url')
+    return registry
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    static_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static')
+    manifest = build(static_folder)
+    for name, url_name in manifest.items():
+        print(f"{name} -> {DIST_DIR}/{url_name}")
+    if brotli is None:
+        print("brotli is not installed; only gzip variants were written", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
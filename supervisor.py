@@ -0,0 +1,289 @@
+"""
+Cross-platform supervisor for the server process.
+
+``ProcessSupervisor`` starts the server as a child process and keeps it
+running:
+
+- child stdout/stderr are drained by reader threads into a rotating log
+  (``server_output.log``), so a chatty child can never block on a full pipe
+- a waiter thread blocks in ``wait()`` and wakes the supervisor the moment
+  the child exits; nothing is polled
+- a periodic health probe of ``/status`` detects a hung child, which is
+  killed after ``health_failures`` consecutive failures; the URL follows
+  the SERVER_HOST/SERVER_PORT settings the child binds to
+- stopping asks the child to exit (SIGTERM; Ctrl-Break on Windows, where
+  the child runs in its own process group) so serve.py drains in-flight
+  requests, and kills it only after ``stop_timeout`` seconds
+- restarts back off exponentially (``backoff_initial`` doubling up to
+  ``backoff_max``); the delay resets once a child has run for
+  ``stable_after`` seconds
+
+It has no Windows dependencies; ``win_service.AlexaSleepService`` only wraps
+it. It can also run standalone:
+
+    python supervisor.py                      # supervises main.py
+    python supervisor.py -- python asgi.py    # any other command
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import logging_setup
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = '/status'
+
+# Where the server listens unless SERVER_HOST/SERVER_PORT say otherwise
+DEFAULT_SERVER_HOST = '0.0.0.0'
+DEFAULT_SERVER_PORT = 5000
+DEFAULT_OUTPUT_LOG = 'server_output.log'
+
+OUTPUT_FORMAT = '%(asctime)s - %(stream)s - %(message)s'
+
+
+def default_health_url():
+    """The child's ``/status`` URL, from the SERVER_HOST/SERVER_PORT settings it binds to."""
+    host = os.environ.get('SERVER_HOST') or DEFAULT_SERVER_HOST
+    port = int(os.environ.get('SERVER_PORT') or DEFAULT_SERVER_PORT)
+    # A wildcard bind is reached through loopback
+    host = {'0.0.0.0': '127.0.0.1', '::': '::1'}.get(host, host)
+    if ':' in host:
+        host = f"[{host}]"
+    return f"http://{host}:{port}{HEALTH_PATH}"
+
+
+def _attach_console():
+    """
+    Windows: make sure this process has a console the child can share.
+
+    Ctrl-Break can only be sent to processes attached to the sender's
+    console; a service has none, so one is allocated and hidden.
+    """
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    if kernel32.GetConsoleWindow():
+        return
+    if kernel32.AllocConsole():
+        window = kernel32.GetConsoleWindow()
+        if window:
+            ctypes.windll.user32.ShowWindow(window, 0)  # SW_HIDE
+    else:
+        logger.warning("Could not allocate a console; the server will be killed on stop")
+
+
+def http_probe(url, timeout):
+    """Return True if ``url`` answers with a 2xx status within ``timeout`` seconds."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (OSError, urllib.error.URLError, ValueError):
+        return False
+
+
+class ProcessSupervisor:
+    """
+    Runs a child process, restarting it when it exits or stops answering.
+
+    Health checks are off unless ``health_url`` is given; from_environment()
+    points them at the child's ``/status``.
+    """
+
+    def __init__(self, command, cwd=None, env=None, output_log=DEFAULT_OUTPUT_LOG,
+                 health_url=None, health_interval=30, health_timeout=5,
+                 health_failures=3, startup_grace=30, backoff_initial=1, backoff_max=60,
+                 stable_after=60, stop_timeout=15, creationflags=0, probe=http_probe):
+        self.command = list(command)
+        self.cwd = cwd
+        self.env = env
+        self.health_url = health_url
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health_failures = health_failures
+        self.startup_grace = startup_grace
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.creationflags = creationflags
+        self.probe = probe
+
+        self.process = None
+        self.restarts = 0
+        self._stop = threading.Event()
+        # Set when the child exits or stop() is called
+        self._wake = threading.Event()
+        self._thread = None
+
+        self.output = logging.getLogger(f"{__name__}.output")
+        self.output.propagate = False
+        self.output.setLevel(logging.INFO)
+        if output_log and not self.output.handlers:
+            self.output.addHandler(logging_setup.rotating_file_handler(
+                output_log, logging.Formatter(OUTPUT_FORMAT)))
+
+    # Child process --------------------------------------------------------
+
+    def _spawn(self):
+        self._wake.clear()
+        creationflags = self.creationflags
+        if os.name == 'nt':
+            # Its own process group lets Ctrl-Break reach the child (and only it)
+            _attach_console()
+            creationflags |= subprocess.CREATE_NEW_PROCESS_GROUP
+        process = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            env=self.env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=creationflags,
+        )
+        for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+            threading.Thread(target=self._drain, args=(stream, stream_name),
+                             name=f"supervisor-{stream_name}-{process.pid}", daemon=True).start()
+        threading.Thread(target=self._await_exit, args=(process,),
+                         name=f"supervisor-wait-{process.pid}", daemon=True).start()
+        logger.info(f"Server started with PID {process.pid}: {' '.join(self.command)}")
+        return process
+
+    def _drain(self, stream, stream_name):
+        """Copy one child pipe into the output log, line by line, until EOF."""
+        with stream:
+            for line in iter(stream.readline, b''):
+                self.output.info(line.decode('utf-8', errors='replace').rstrip('\r\n'),
+                                 extra={'stream': stream_name})
+
+    def _await_exit(self, process):
+        process.wait()
+        self._wake.set()
+
+    def _terminate(self, process):
+        """Ask the child to exit, then kill it after ``stop_timeout`` seconds."""
+        if process.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                # terminate() is TerminateProcess, which skips the drain in serve.py
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                process.terminate()
+            process.wait(self.stop_timeout)
+            return
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Server PID {process.pid} did not exit, killing it")
+        except OSError as e:
+            logger.warning(f"Could not ask server PID {process.pid} to exit, killing it: {e}")
+        try:
+            process.kill()
+            process.wait()
+        except OSError as e:
+            logger.error(f"Error terminating server process: {e}")
+
+    # Supervision loop -----------------------------------------------------
+
+    def _watch(self, process):
+        """Block until the child exits, hangs, or stop() is called."""
+        started = time.monotonic()
+        failures = 0
+        while not self._stop.is_set():
+            if self._wake.wait(self.health_interval if self.health_url else None):
+                return
+            if time.monotonic() - started < self.startup_grace:
+                continue
+            if self.probe(self.health_url, self.health_timeout):
+                failures = 0
+                continue
+            failures += 1
+            logger.warning(f"Health check {failures}/{self.health_failures} failed: {self.health_url}")
+            if failures >= self.health_failures:
+                logger.error(f"Server PID {process.pid} is not responding, restarting it")
+                self._terminate(process)
+                return
+
+    def run(self):
+        """Supervise until stop() is called. Blocks the calling thread."""
+        delay = self.backoff_initial
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.process = self._spawn()
+            except OSError as e:
+                logger.error(f"Could not start server: {e}")
+            else:
+                self._watch(self.process)
+                if self._stop.is_set():
+                    break
+                self._terminate(self.process)
+                logger.error(f"Server exited with code {self.process.returncode}")
+
+            if time.monotonic() - started >= self.stable_after:
+                delay = self.backoff_initial
+            logger.info(f"Restarting server in {delay:g}s")
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, self.backoff_max)
+            self.restarts += 1
+
+        if self.process is not None:
+            self._terminate(self.process)
+        logger.info("Supervisor stopped")
+
+    def start(self):
+        """Run the supervision loop on a background thread."""
+        self._thread = threading.Thread(target=self.run, name='supervisor', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """Stop supervising and terminate the child."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+
+def from_environment(command, cwd=None, **kwargs):
+    """Create a supervisor configured from SUPERVISOR_* environment variables."""
+    options = {
+        'health_url': os.environ.get('SUPERVISOR_HEALTH_URL', default_health_url()) or None,
+        'health_interval': float(os.environ.get('SUPERVISOR_HEALTH_INTERVAL', 30)),
+        'health_failures': int(os.environ.get('SUPERVISOR_HEALTH_FAILURES', 3)),
+        'startup_grace': float(os.environ.get('SUPERVISOR_STARTUP_GRACE', 30)),
+        'backoff_max': float(os.environ.get('SUPERVISOR_BACKOFF_MAX', 60)),
+    }
+    if cwd is not None:
+        options['output_log'] = os.path.join(cwd, DEFAULT_OUTPUT_LOG)
+    options.update(kwargs)
+    return ProcessSupervisor(command, cwd=cwd, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the server and restart it when it exits or hangs.')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='command to supervise (default: python main.py)')
+    args = parser.parse_args(argv)
+
+    base_dir = os.path.abspath(os.path.dirname(__file__))
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    command = command or [sys.executable, os.path.join(base_dir, 'main.py')]
+
+    logging.basicConfig(level=logging.INFO, format=logging_setup.LOG_FORMAT)
+    supervisor = from_environment(command, cwd=base_dir)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
+        if supervisor.process is not None:
+            supervisor._terminate(supervisor.process)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Tests for admission control and the credential caches, on a fake clock.
+"""
+import unittest
+from unittest import mock
+
+import admission
+import credential_cache
+from admission import AdmissionControl, RateLimited, TokenBucketLimiter
+from credential_cache import CredentialCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for module in (admission, credential_cache):
+            patcher = mock.patch.object(module, 'time', mock.Mock(monotonic=self.clock))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TokenBucketTest(ClockTestCase):
+    def test_burst_then_wait(self):
+        limiter = TokenBucketLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.take('ip') for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(limiter.take('ip'), 0.5)
+
+    def test_refills_at_rate(self):
+        limiter = TokenBucketLimiter(rate=2, burst=3)
+        for _ in range(3):
+            limiter.take('ip')
+
+        self.clock.advance(0.5)
+        self.assertEqual(limiter.take('ip'), 0.0)
+        self.assertGreater(limiter.take('ip'), 0)
+
+        self.clock.advance(1.0)
+        self.assertEqual([limiter.take('ip') for _ in range(2)], [0.0, 0.0])
+
+    def test_refill_is_capped_at_burst(self):
+        limiter = TokenBucketLimiter(rate=10, burst=2)
+        limiter.take('ip')
+        self.clock.advance(3600)
+        self.assertEqual([limiter.take('ip') for _ in range(2)], [0.0, 0.0])
+        self.assertGreater(limiter.take('ip'), 0)
+
+    def test_clients_have_separate_buckets(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1)
+        self.assertEqual(limiter.take('a'), 0.0)
+        self.assertGreater(limiter.take('a'), 0)
+        self.assertEqual(limiter.take('b'), 0.0)
+
+    def test_least_recently_seen_clients_are_forgotten(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_clients=2)
+        limiter.take('a')
+        limiter.take('b')
+        limiter.take('c')
+        # 'a' was evicted, so it starts again with a full bucket
+        self.assertEqual(limiter.take('a'), 0.0)
+
+    def test_zero_rate_disables_the_limit(self):
+        limiter = TokenBucketLimiter(rate=0, burst=0)
+        self.assertEqual([limiter.take('ip') for _ in range(5)], [0.0] * 5)
+
+
+class AdmissionControlTest(ClockTestCase):
+    def test_ip_limit(self):
+        control = AdmissionControl(ip_rate=1, ip_burst=2, key_rate=100, key_burst=100)
+        control.admit('10.0.0.1', 'k1.secret')
+        control.admit('10.0.0.1', 'k2.secret')
+        with self.assertRaises(RateLimited) as raised:
+            control.admit('10.0.0.1', 'k3.secret')
+        self.assertEqual(raised.exception.reason, 'ip')
+        self.assertEqual(raised.exception.retry_after_header, '1')
+        control.admit('10.0.0.2', 'k4.secret')
+
+    def test_key_prefix_limit_spans_client_ips(self):
+        control = AdmissionControl(ip_rate=100, ip_burst=100, key_rate=1, key_burst=1)
+        control.admit('10.0.0.1', 'k1.secret')
+        with self.assertRaises(RateLimited) as raised:
+            control.admit('10.0.0.2', 'k1.other')
+        self.assertEqual(raised.exception.reason, 'key')
+
+        self.clock.advance(1)
+        control.admit('10.0.0.3', 'k1.secret')
+
+    def test_kdf_slots(self):
+        control = AdmissionControl(kdf_concurrency=1)
+        with control.kdf_slot():
+            with self.assertRaises(RateLimited) as raised, control.kdf_slot():
+                pass
+            self.assertEqual(raised.exception.reason, 'kdf')
+        with control.kdf_slot():
+            pass
+
+    def test_negative_cache_expires(self):
+        control = AdmissionControl(negative_ttl=30)
+        control.remember_rejected('k1.wrong')
+        self.assertTrue(control.recently_rejected('k1.wrong'))
+        self.assertFalse(control.recently_rejected('k1.other'))
+
+        self.clock.advance(29)
+        self.assertTrue(control.recently_rejected('k1.wrong'))
+        self.clock.advance(1)
+        self.assertFalse(control.recently_rejected('k1.wrong'))
+
+    def test_negative_cache_is_dropped_when_keys_change(self):
+        control = AdmissionControl()
+        control.remember_rejected('k1.secret')
+        control.forget_rejected()
+        self.assertFalse(control.recently_rejected('k1.secret'))
+
+
+class CredentialCacheTest(ClockTestCase):
+    def test_entries_expire(self):
+        cache = CredentialCache(ttl=300)
+        cache.put('k1.secret', 'k1')
+        self.clock.advance(299)
+        self.assertEqual(cache.get('k1.secret'), 'k1')
+        self.clock.advance(1)
+        self.assertIsNone(cache.get('k1.secret'))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = CredentialCache(max_size=2)
+        cache.put('a.secret', 'a')
+        cache.put('b.secret', 'b')
+        cache.get('a.secret')
+        cache.put('c.secret', 'c')
+        self.assertEqual([cache.get(key) for key in ('a.secret', 'b.secret', 'c.secret')], ['a', None, 'c'])
+
+    def test_invalidate_one_key_id(self):
+        cache = CredentialCache()
+        cache.put('a.secret', 'a')
+        cache.put('b.secret', 'b')
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a.secret'))
+        self.assertEqual(cache.get('b.secret'), 'b')
+
+    def test_raw_keys_are_not_stored(self):
+        cache = CredentialCache()
+        cache.put('a.secret', 'a')
+        self.assertNotIn('a.secret', cache._entries)
+        self.assertEqual(cache.digest('a.secret'), next(iter(cache._entries)))
+
+    def test_zero_ttl_disables_the_cache(self):
+        cache = CredentialCache(ttl=0)
+        cache.put('a.secret', 'a')
+        self.assertIsNone(cache.get('a.secret'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""
+Tests for API key verification across key store reloads.
+
+Revoking a key must stop it from verifying even while it sits in the
+verified-key cache, including when another process revoked it. The "other
+process" is a real child process for the JSON store, and a second store on
+its own engine for the SQLite store.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import textwrap
+import subprocess
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+import auth
+import database
+from admission import AdmissionControl
+from credential_cache import CredentialCache
+from key_store import ApiKeyStore
+from models import db
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REVOKE_IN_CHILD = textwrap.dedent('''
+    import sys
+    sys.path.insert(0, {repo!r})
+    from key_store import ApiKeyStore
+    store = ApiKeyStore({path!r})
+    sys.exit(0 if store.update(lambda s: s.revoke({key_id!r})) else 1)
+''')
+
+
+class KeyStoreTestCase(unittest.TestCase):
+    """Runs auth against a fresh store and fresh caches, restored afterwards."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='keys-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        for name, value in (('verified_keys', CredentialCache()),
+                            ('admission_control', AdmissionControl(ip_rate=0, key_rate=0))):
+            patcher = mock.patch.object(auth, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        original = auth.key_store
+        self.addCleanup(setattr, auth, 'key_store', original)
+
+    def use_store(self, store):
+        auth.use_key_store(store)
+        return store
+
+
+class ApiKeyStoreReloadTest(KeyStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.workdir, 'api_keys.json')
+        self.store = self.use_store(ApiKeyStore(self.path, recheck_interval=0))
+
+    def test_cached_key_verifies_without_a_hash_check(self):
+        api_key = auth.create_api_key()
+        key_id = auth.verify_api_key(api_key)
+        with mock.patch.object(self.store, '_check') as check:
+            self.assertEqual(auth.verify_api_key(api_key), key_id)
+        check.assert_not_called()
+
+    def test_revocation_invalidates_the_cache(self):
+        api_key = auth.create_api_key()
+        key_id = auth.verify_api_key(api_key)
+        self.assertEqual(auth.verified_keys.get(api_key), key_id)
+
+        self.assertTrue(auth.revoke_api_key(key_id))
+        self.assertIsNone(auth.verified_keys.get(api_key))
+        self.assertIsNone(auth.verify_api_key(api_key))
+
+    def test_revocation_in_another_process_is_picked_up(self):
+        api_key = auth.create_api_key()
+        key_id = auth.verify_api_key(api_key)
+
+        script = REVOKE_IN_CHILD.format(repo=REPO, path=self.path, key_id=key_id)
+        subprocess.run([sys.executable, '-c', script], check=True, timeout=60)
+
+        self.assertIsNone(auth.verify_api_key(api_key))
+
+    def test_key_created_in_another_process_verifies(self):
+        other = ApiKeyStore(self.path)
+        key_id = other.new_key_id()
+        api_key = f"{key_id}.secret"
+        other.update(lambda s: s.add(key_id, auth.generate_password_hash(api_key)))
+
+        self.assertEqual(auth.verify_api_key(api_key), key_id)
+
+    def test_rejected_key_is_retried_after_keys_change(self):
+        other = ApiKeyStore(self.path)
+        key_id = 'abcd1234'
+        api_key = f"{key_id}.secret"
+        self.assertIsNone(auth.verify_api_key(api_key))
+        self.assertTrue(auth.admission_control.recently_rejected(api_key))
+
+        other.update(lambda s: s.add(key_id, auth.generate_password_hash(api_key)))
+        self.assertEqual(auth.verify_api_key(api_key), key_id)
+
+
+class SqlKeyStoreReloadTest(KeyStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        url = f"sqlite:///{os.path.join(self.workdir, 'keys.db')}"
+        engines = [create_engine(url), create_engine(url)]
+        for engine in engines:
+            self.addCleanup(engine.dispose)
+        db.metadata.create_all(engines[0])
+        self.store = self.use_store(database.SqlKeyStore(engines[0], recheck_interval=0))
+        # A worker process has its own engine and in-memory index
+        self.other = database.SqlKeyStore(engines[1], recheck_interval=0)
+        self.addCleanup(self.store.close)
+        self.addCleanup(self.other.close)
+
+    def test_revocation_by_another_worker_is_picked_up(self):
+        api_key = auth.create_api_key()
+        key_id = auth.verify_api_key(api_key)
+        self.assertIsNotNone(key_id)
+
+        self.assertTrue(self.other.update(lambda s: s.revoke(key_id)))
+        self.assertIsNone(auth.verify_api_key(api_key))
+
+    def test_key_created_by_another_worker_verifies(self):
+        key_id = self.other.new_key_id()
+        api_key = f"{key_id}.secret"
+        self.other.update(lambda s: s.add(key_id, auth.generate_password_hash(api_key)))
+
+        self.assertEqual(auth.verify_api_key(api_key), key_id)
+
+    def test_reload_waits_for_the_recheck_interval(self):
+        self.store.recheck_interval = 3600
+        self.store.refresh(force=True)
+        api_key = auth.create_api_key()
+        key_id = auth.verify_api_key(api_key)
+
+        self.other.update(lambda s: s.revoke(key_id))
+        # Not noticed until the next check of the generation
+        self.assertEqual(auth.verify_api_key(api_key), key_id)
+        self.store._next_check = 0.0
+        self.assertIsNone(auth.verify_api_key(api_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+Tests for parallel provisioning in lambda_fleet, against a stand-in provisioner.
+
+The stand-in skips boto3 and replaces ``provision`` so no AWS calls are made;
+``provision_all`` itself (thread pool, ordering, failure handling) is the real one.
+Deployments go through a stub Lambda client that records its calls.
+"""
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import lambda_fleet
+from lambda_fleet import Host, LambdaProvisioner, ProvisionResult
+from lambda_package import PackageBuilder
+
+
+class StandInProvisioner(LambdaProvisioner):
+    """LambdaProvisioner without AWS clients; provision() records its calls."""
+
+    def __init__(self, max_workers=4, barrier=None, failing=()):
+        self.max_workers = max_workers
+        self.barrier = barrier
+        self.failing = set(failing)
+        self._lock = threading.Lock()
+        self._account_id = '123456789012'
+        self._role_arn = 'arn:aws:iam::123456789012:role/test'
+        self.threads = set()
+        self.calls = []
+
+    def provision(self, api_key, endpoint_url, runtime='nodejs', function_name=None,
+                  host=None, update_existing=True):
+        with self._lock:
+            self.calls.append(host)
+            self.threads.add(threading.current_thread().name)
+        if self.barrier is not None:
+            # Only returns once max_workers hosts are being provisioned at the same time
+            self.barrier.wait(timeout=5)
+        if host in self.failing:
+            raise RuntimeError(f"{host} failed")
+        return ProvisionResult(host, True, 'created', function_name, f"arn:{host}",
+                               lambda_fleet.RUNTIMES[runtime][0], 'sha', 0.0, None)
+
+
+def hosts(count):
+    return [Host(f"pc{i}", f"https://pc{i}.example", f"key{i}", 'nodejs', f"fn{i}")
+            for i in range(count)]
+
+
+class ProvisionAllTest(unittest.TestCase):
+    def test_hosts_are_provisioned_concurrently(self):
+        provisioner = StandInProvisioner(max_workers=4, barrier=threading.Barrier(4))
+        results = provisioner.provision_all(hosts(8))
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(len(provisioner.threads), 4)
+        self.assertTrue(all(name.startswith('lambda-fleet') for name in provisioner.threads))
+
+    def test_results_keep_input_order(self):
+        provisioner = StandInProvisioner(max_workers=3)
+        results = provisioner.provision_all(hosts(10))
+
+        self.assertEqual([result.host for result in results], [f"pc{i}" for i in range(10)])
+        self.assertEqual(sorted(provisioner.calls), sorted(f"pc{i}" for i in range(10)))
+
+    def test_failure_does_not_stop_other_hosts(self):
+        provisioner = StandInProvisioner(max_workers=2, failing={'pc1'})
+        reported = []
+        results = provisioner.provision_all(hosts(4), on_result=reported.append)
+
+        self.assertEqual([result.ok for result in results], [True, False, True, True])
+        failed = results[1]
+        self.assertEqual(failed.action, 'failed')
+        self.assertEqual(failed.function_name, 'fn1')
+        self.assertEqual(failed.runtime, 'nodejs18.x')
+        self.assertIn('pc1 failed', failed.error)
+        self.assertEqual(sorted(result.host for result in reported), ['pc0', 'pc1', 'pc2', 'pc3'])
+
+    def test_no_hosts(self):
+        self.assertEqual(StandInProvisioner().provision_all([]), [])
+
+    def test_hosts_sharing_a_function_name_fail(self):
+        provisioner = StandInProvisioner()
+        batch = [Host('pc 1', 'https://a.example', 'k1'), Host('pc_1', 'https://b.example', 'k2'),
+                 Host('pc2', 'https://c.example', 'k3'),
+                 Host('pc3', 'https://d.example', 'k4', function_name='shared'),
+                 Host('pc4', 'https://e.example', 'k5', function_name='shared')]
+        results = provisioner.provision_all(batch)
+
+        self.assertEqual([result.ok for result in results], [False, False, True, False, False])
+        self.assertIn('pc_1', results[0].error)
+        self.assertEqual(results[0].function_name, 'AlexaSleepController_pc_1')
+        self.assertEqual(provisioner.calls, ['pc2'])
+
+    def test_role_failure_fails_every_host(self):
+        provisioner = StandInProvisioner()
+        provisioner._role_arn = None
+        provisioner._ensure_role = mock.Mock(side_effect=RuntimeError("AccessDenied"))
+        reported = []
+        results = provisioner.provision_all(hosts(3), on_result=reported.append)
+
+        self.assertEqual([result.host for result in results], ['pc0', 'pc1', 'pc2'])
+        self.assertFalse(any(result.ok for result in results))
+        self.assertTrue(all('AccessDenied' in result.error for result in results))
+        self.assertEqual(reported, results)
+        self.assertEqual(provisioner.calls, [])
+
+
+class StubLambdaClient:
+    """Records calls; every function in ``functions`` exists with that CodeSha256."""
+
+    def __init__(self, functions):
+        self.functions = dict(functions)
+        self.calls = []
+
+    def get_function_configuration(self, FunctionName):
+        self.calls.append(('get_function_configuration', FunctionName))
+        return {'FunctionArn': f"arn:{FunctionName}", 'CodeSha256': self.functions[FunctionName]}
+
+    def update_function_code(self, FunctionName, ZipFile, Publish):
+        self.calls.append(('update_function_code', FunctionName))
+
+
+class StubClientProvisioner(LambdaProvisioner):
+    """LambdaProvisioner whose only client is a StubLambdaClient."""
+
+    def __init__(self, lambda_client, builder):
+        self.lambda_client = lambda_client
+        self.builder = builder
+        self.max_workers = 2
+        self._lock = threading.Lock()
+
+
+class DeployTest(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp(prefix='lambda-cache-')
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.builder = PackageBuilder(cache_dir)
+
+    def package_sha(self):
+        return self.builder.build(lambda_fleet.RUNTIMES['nodejs'][1], 'nodejs', {
+            'API_KEY': 'key', 'ENDPOINT_URL': 'https://pc.example',
+        }).sha256
+
+    def provision(self, client):
+        provisioner = StubClientProvisioner(client, self.builder)
+        return provisioner.provision('key', 'https://pc.example', function_name='fn', host='pc')
+
+    def test_unchanged_code_is_looked_up_once_and_not_uploaded(self):
+        client = StubLambdaClient({'fn': self.package_sha()})
+        result = self.provision(client)
+
+        self.assertEqual(result.action, 'unchanged')
+        self.assertEqual(client.calls, [('get_function_configuration', 'fn')])
+
+    def test_changed_code_is_uploaded(self):
+        client = StubLambdaClient({'fn': 'old'})
+        result = self.provision(client)
+
+        self.assertEqual(result.action, 'updated')
+        self.assertEqual(client.calls, [('get_function_configuration', 'fn'),
+                                        ('update_function_code', 'fn')])
+
+
+class GetProvisionerTest(unittest.TestCase):
+    def setUp(self):
+        lambda_fleet._provisioners.clear()
+        self.addCleanup(lambda_fleet._provisioners.clear)
+
+    def test_reuses_provisioner_per_credentials(self):
+        first = lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1')
+        self.assertIs(lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1'), first)
+        self.assertIsNot(lambda_fleet.get_provisioner('AKIA1', 'secret2', 'us-east-1'), first)
+        self.assertIsNot(lambda_fleet.get_provisioner('AKIA1', 'secret1', 'eu-west-1'), first)
+
+    def test_secret_is_not_a_cache_key(self):
+        lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1')
+        for digest in lambda_fleet._provisioners:
+            self.assertNotIn(b'secret1', digest)
+
+    def test_expired_provisioner_is_replaced(self):
+        with mock.patch.object(lambda_fleet, 'PROVISIONER_TTL', 0):
+            first = lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1')
+            self.assertIsNot(lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1'), first)
+        self.assertEqual(len(lambda_fleet._provisioners), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        with mock.patch.object(lambda_fleet, 'PROVISIONER_CACHE_SIZE', 2):
+            first = lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1')
+            second = lambda_fleet.get_provisioner('AKIA2', 'secret2', 'us-east-1')
+            lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1')
+            lambda_fleet.get_provisioner('AKIA3', 'secret3', 'us-east-1')
+
+            self.assertEqual(len(lambda_fleet._provisioners), 2)
+            self.assertIs(lambda_fleet.get_provisioner('AKIA1', 'secret1', 'us-east-1'), first)
+            self.assertIsNot(lambda_fleet.get_provisioner('AKIA2', 'secret2', 'us-east-1'), second)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests for the shared rotating log handler: size tracking, rotation and
+continuing after another process rotated the file.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+import logging_setup
+from logging_setup import SizeAndTimeRotatingFileHandler
+
+
+class CountingFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(message)s')
+        self.calls = 0
+
+    def format(self, record):
+        self.calls += 1
+        return super().format(record)
+
+
+def record(message):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, message, None, None)
+
+
+class RotatingHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='logs-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.path = os.path.join(self.workdir, 'app.log')
+
+    def handler(self, **options):
+        handler = SizeAndTimeRotatingFileHandler(self.path, **options)
+        handler.setFormatter(CountingFormatter())
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_rotates_by_size(self):
+        handler = self.handler(max_bytes=100, backup_count=3)
+        for i in range(10):
+            handler.handle(record(f"message {i:02d} " + 'x' * 20))
+
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        for name in ('app.log', 'app.log.1', 'app.log.2'):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.workdir, name)), 100)
+        with open(self.path, encoding='utf-8') as f:
+            self.assertIn('message 09', f.read())
+
+    def test_size_counts_encoded_bytes(self):
+        handler = self.handler(max_bytes=100, backup_count=1)
+        # 10 characters, 30 bytes in UTF-8
+        for _ in range(4):
+            handler.handle(record('スリープ要求を受信しました'[:10]))
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        self.assertLessEqual(os.path.getsize(self.path), 100)
+
+    def test_each_record_is_formatted_once(self):
+        handler = self.handler(max_bytes=10 ** 6)
+        for i in range(20):
+            handler.handle(record(f"message {i}"))
+        self.assertEqual(handler.formatter.calls, 20)
+
+    def test_file_is_not_stat_for_every_record(self):
+        handler = self.handler(max_bytes=10 ** 6)
+        handler.handle(record('first'))
+        with mock.patch.object(logging_setup.os, 'stat', wraps=os.stat) as stat:
+            for i in range(50):
+                handler.handle(record(f"message {i}"))
+        self.assertLess(stat.call_count, 5)
+
+    def test_continues_in_the_new_file_after_another_process_rotates(self):
+        mine = self.handler(max_bytes=10 ** 6, backup_count=2)
+        mine.CHECK_INTERVAL = 0
+        mine.handle(record('before'))
+
+        other = self.handler(max_bytes=10 ** 6, backup_count=2)
+        other.handle(record('other'))
+        other.maxBytes = 1
+        other.handle(record('rotated'))
+
+        mine.handle(record('after'))
+        with open(self.path, encoding='utf-8') as f:
+            current = f.read()
+        with open(f"{self.path}.1", encoding='utf-8') as f:
+            rotated = f.read()
+        self.assertEqual(rotated, 'before\nother\n')
+        self.assertEqual(current, 'rotated\nafter\n')
+
+    def test_size_written_by_other_processes_is_noticed(self):
+        mine = self.handler(max_bytes=100, backup_count=1)
+        mine.handle(record('mine'))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('x' * 200 + '\n')
+
+        mine.handle(record('next'))
+        # The estimate was below the limit, so the next stat found the growth
+        mine._next_check = 0.0
+        mine.handle(record('last'))
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'last\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
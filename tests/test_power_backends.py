@@ -0,0 +1,114 @@
+"""
+Tests for PowerController's probing and fallback order, with FakeBackends.
+"""
+import asyncio
+import unittest
+
+from power_backends import FakeBackend, PowerController
+
+
+class CountingBackend(FakeBackend):
+    """FakeBackend that also counts how often it was probed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.probes = 0
+
+    def probe(self):
+        self.probes += 1
+        return super().probe()
+
+
+class ProbeTest(unittest.TestCase):
+    def test_unavailable_backends_are_skipped(self):
+        missing = FakeBackend('missing', available=False)
+        present = FakeBackend('present')
+        controller = PowerController([missing, present])
+
+        self.assertEqual(controller.probe(), [present])
+        self.assertEqual(controller.trigger(), (True, 'fake sleep'))
+        self.assertEqual(missing.calls, 0)
+
+    def test_backends_are_probed_once(self):
+        backend = CountingBackend()
+        controller = PowerController([backend])
+
+        controller.probe()
+        backend.available = False
+        controller.trigger()
+        controller.trigger()
+
+        self.assertEqual(backend.probes, 1)
+        self.assertEqual(backend.calls, 2)
+
+    def test_probe_error_counts_as_unavailable(self):
+        class BrokenProbe(FakeBackend):
+            def probe(self):
+                raise OSError("no such API")
+
+        controller = PowerController([BrokenProbe('broken'), FakeBackend('ok')])
+        self.assertEqual([backend.name for backend in controller.probe()], ['ok'])
+
+    def test_no_available_backend(self):
+        controller = PowerController([FakeBackend(available=False)])
+        success, _ = controller.trigger()
+        self.assertFalse(success)
+
+
+class MethodSelectionTest(unittest.TestCase):
+    def test_falls_back_and_remembers_the_working_backend(self):
+        first = FakeBackend('first', succeed=False)
+        second = FakeBackend('second')
+        controller = PowerController([first, second])
+
+        self.assertEqual(controller.trigger(), (True, 'fake sleep'))
+        self.assertIs(controller.preferred, second)
+        self.assertEqual((first.calls, second.calls), (1, 1))
+
+        # The next call goes straight to the backend that worked
+        self.assertEqual(controller.trigger(), (True, 'fake sleep'))
+        self.assertEqual((first.calls, second.calls), (1, 2))
+        self.assertEqual(controller.ordered_backends(), [second, first])
+
+    def test_preferred_backend_failing_falls_back_again(self):
+        first = FakeBackend('first', succeed=False)
+        second = FakeBackend('second')
+        controller = PowerController([first, second])
+        controller.trigger()
+
+        second.succeed = False
+        first.succeed = True
+        self.assertEqual(controller.trigger(), (True, 'fake sleep'))
+        self.assertIs(controller.preferred, first)
+        self.assertEqual((first.calls, second.calls), (2, 2))
+
+    def test_all_backends_failing(self):
+        backends = [FakeBackend('a', succeed=False), FakeBackend('b', succeed=False)]
+        controller = PowerController(backends)
+
+        success, _ = controller.trigger()
+        self.assertFalse(success)
+        self.assertIsNone(controller.preferred)
+        self.assertEqual([backend.calls for backend in backends], [1, 1])
+
+    def test_attempts_are_reported(self):
+        attempts = []
+        controller = PowerController(
+            [FakeBackend('first', succeed=False), FakeBackend('second')],
+            on_attempt=lambda name, seconds, success: attempts.append((name, success))
+        )
+        controller.trigger()
+        self.assertEqual(attempts, [('first', False), ('second', True)])
+
+    def test_async_trigger_uses_the_same_order(self):
+        first = FakeBackend('first', succeed=False)
+        second = FakeBackend('second')
+        controller = PowerController([first, second])
+
+        self.assertEqual(asyncio.run(controller.trigger_async()), (True, 'fake sleep'))
+        self.assertEqual(asyncio.run(controller.trigger_async()), (True, 'fake sleep'))
+        self.assertEqual((first.calls, second.calls), (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
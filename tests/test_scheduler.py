@@ -0,0 +1,251 @@
+"""
+Tests for the scheduler: recurrence maths, the heap, claiming due runs and
+request validation.
+
+Schedulers here are never started; tests call ``_pop_due`` and ``_fire``
+directly against a temporary SQLite database.
+"""
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+import database
+import scheduler
+from models import db, Schedule
+from scheduler import Scheduler, next_occurrence, parse_recurrence, parse_request
+
+# A Monday
+MONDAY = datetime.datetime(2026, 10, 12, 12, 0)
+
+
+class NextOccurrenceTest(unittest.TestCase):
+    def test_later_the_same_day(self):
+        self.assertEqual(next_occurrence('mon 23:00', MONDAY), MONDAY.replace(hour=23))
+
+    def test_time_already_passed_moves_to_the_next_matching_day(self):
+        self.assertEqual(next_occurrence('mon,tue,wed,thu,fri,sat,sun 08:30', MONDAY),
+                         datetime.datetime(2026, 10, 13, 8, 30))
+
+    def test_exact_time_is_not_repeated(self):
+        self.assertEqual(next_occurrence('mon 12:00', MONDAY), datetime.datetime(2026, 10, 19, 12, 0))
+
+    def test_weekdays_skip_the_weekend(self):
+        friday_night = datetime.datetime(2026, 10, 16, 23, 30)
+        self.assertEqual(next_occurrence(parse_recurrence('weekdays', '23:00'), friday_night),
+                         datetime.datetime(2026, 10, 19, 23, 0))
+
+    def test_weekends(self):
+        self.assertEqual(next_occurrence(parse_recurrence('weekends', '07:00'), MONDAY),
+                         datetime.datetime(2026, 10, 17, 7, 0))
+
+
+class ParseRequestTest(unittest.TestCase):
+    def test_recurrence_is_normalised(self):
+        run_at, recurrence = parse_request({'days': 'fri, mon', 'at': '23:00'}, now=MONDAY)
+        self.assertEqual(recurrence, 'mon,fri 23:00')
+        self.assertEqual(run_at, MONDAY.replace(hour=23))
+
+    def test_invalid_types_are_value_errors(self):
+        for data in ({'days': 5, 'at': '23:00'}, {'days': ['mon', 1], 'at': '23:00'},
+                     {'days': 'daily', 'at': 2300}, {'days': {'mon': True}, 'at': '23:00'}):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                parse_request(data, now=MONDAY)
+
+    def test_run_at_in_the_past_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_request({'run_at': '2026-10-12T11:00:00'}, now=MONDAY)
+
+    def test_run_at_within_tolerance_is_accepted(self):
+        run_at, _ = parse_request({'run_at': '2026-10-12T11:59:30'}, now=MONDAY)
+        self.assertEqual(run_at, datetime.datetime(2026, 10, 12, 11, 59, 30))
+
+    def test_delay_must_be_finite(self):
+        for minutes in ('nan', 'inf', -1, 'abc'):
+            with self.subTest(minutes=minutes), self.assertRaises(ValueError):
+                parse_request({'delay_minutes': minutes}, now=MONDAY)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp(prefix='scheduler-')
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.app = Flask(__name__, instance_path=workdir)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'test.db')}"
+        database.init_app(self.app)
+        self.runs = []
+        self.scheduler = self.make_scheduler()
+
+    def make_scheduler(self, **options):
+        def run_action(schedule):
+            self.runs.append(schedule.id)
+            return 'ok'
+        settings = dict(misfire_grace=5)
+        settings.update(options)
+        return Scheduler(self.app, run_action, **settings)
+
+    def add(self, run_at, recurrence=None):
+        with self.app.app_context():
+            return self.scheduler.create('sleep', run_at, recurrence).id
+
+    def load(self, schedule_id):
+        with self.app.app_context():
+            schedule = db.session.get(Schedule, schedule_id)
+            db.session.expunge(schedule)
+            return schedule
+
+
+class HeapTest(SchedulerTestCase):
+    def push(self, count, start=1000.0):
+        with self.scheduler._cond:
+            for i in range(count):
+                self.scheduler._push(f"s{i}", start + i)
+
+    def test_due_schedules_come_out_in_time_order(self):
+        with self.scheduler._cond:
+            self.scheduler._push('late', 30.0)
+            self.scheduler._push('early', 10.0)
+            self.scheduler._push('middle', 20.0)
+            self.assertEqual(self.scheduler._pop_due(25.0), ['early', 'middle'])
+            self.assertEqual(self.scheduler._pop_due(25.0), [])
+            self.assertEqual(list(self.scheduler._entries), ['late'])
+
+    def test_moved_schedule_runs_once_at_its_new_time(self):
+        with self.scheduler._cond:
+            self.scheduler._push('a', 10.0)
+            self.scheduler._push('a', 50.0)
+            self.assertEqual(self.scheduler._pop_due(20.0), [])
+            self.assertEqual(self.scheduler._pop_due(60.0), ['a'])
+
+    def test_cancelled_entries_are_skipped_and_compacted(self):
+        self.push(100)
+        with self.scheduler._cond:
+            for i in range(80):
+                self.scheduler._remove(f"s{i}")
+            # Rebuilt when the 51st removal left more dead entries than live
+            # ones; the 29 removed afterwards stay until they reach the top
+            self.assertEqual(len(self.scheduler._heap), 49)
+            self.assertEqual(len(self.scheduler._entries), 20)
+
+            due = self.scheduler._pop_due(1000.0 + 89)
+            self.assertEqual(due, [f"s{i}" for i in range(80, 90)])
+            self.assertEqual(self.scheduler._pop_due(10 ** 6), [f"s{i}" for i in range(90, 100)])
+            self.assertEqual(self.scheduler._heap, [])
+            self.assertEqual(self.scheduler._entries, {})
+
+    def test_dead_entries_at_the_top_are_dropped(self):
+        self.push(3)
+        with self.scheduler._cond:
+            self.scheduler._remove('s0')
+            self.assertEqual(self.scheduler._pop_due(0.0), [])
+            self.assertEqual(self.scheduler._heap[0][2], 's1')
+
+
+class FireTest(SchedulerTestCase):
+    def test_due_one_off_runs_once(self):
+        schedule_id = self.add(datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.scheduler._fire(schedule_id)
+        self.scheduler._fire(schedule_id)
+
+        self.assertEqual(self.runs, [schedule_id])
+        schedule = self.load(schedule_id)
+        self.assertEqual((schedule.status, schedule.run_count, schedule.last_result),
+                         (scheduler.DONE, 1, 'ok'))
+
+    def test_only_one_process_claims_a_run(self):
+        recurrence = parse_recurrence('daily', '03:00')
+        due_at = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        schedule_id = self.add(due_at, recurrence)
+        other = self.make_scheduler()
+        real_next_occurrence = scheduler.next_occurrence
+
+        def other_process_claims_first(*args):
+            # Runs after this scheduler loaded the row and before it claims it
+            hook.side_effect = real_next_occurrence
+            other._fire(schedule_id)
+            return real_next_occurrence(*args)
+
+        with mock.patch.object(scheduler, 'next_occurrence', side_effect=other_process_claims_first) as hook:
+            self.scheduler._fire(schedule_id)
+
+        self.assertEqual(self.runs, [schedule_id])
+        schedule = self.load(schedule_id)
+        self.assertEqual(schedule.run_count, 1)
+        self.assertEqual(schedule.run_at, real_next_occurrence(recurrence, schedule.last_run))
+        # The loser did not queue the next run; the winner did
+        self.assertNotIn(schedule_id, self.scheduler._entries)
+        self.assertIn(schedule_id, other._entries)
+
+    def test_late_run_within_grace_still_runs(self):
+        schedule_id = self.add(datetime.datetime.now() - datetime.timedelta(seconds=3))
+        self.scheduler._fire(schedule_id)
+
+        self.assertEqual(self.runs, [schedule_id])
+        self.assertEqual(self.load(schedule_id).status, scheduler.DONE)
+
+    def test_one_off_past_grace_is_missed(self):
+        schedule_id = self.add(datetime.datetime.now() - datetime.timedelta(seconds=60))
+        self.scheduler._fire(schedule_id)
+
+        self.assertEqual(self.runs, [])
+        schedule = self.load(schedule_id)
+        self.assertEqual((schedule.status, schedule.run_count), (scheduler.MISSED, 0))
+        self.assertIsNone(schedule.last_run)
+        self.assertTrue(schedule.last_result)
+
+    def test_recurring_past_grace_moves_to_the_next_time(self):
+        recurrence = parse_recurrence('daily', '03:00')
+        due_at = datetime.datetime.now() - datetime.timedelta(hours=2)
+        schedule_id = self.add(due_at, recurrence)
+        self.scheduler._fire(schedule_id)
+
+        self.assertEqual(self.runs, [])
+        schedule = self.load(schedule_id)
+        self.assertEqual((schedule.status, schedule.run_count), (scheduler.PENDING, 0))
+        self.assertGreater(schedule.run_at, datetime.datetime.now())
+        self.assertIn(schedule_id, self.scheduler._entries)
+
+    def test_cancelled_schedule_does_not_run(self):
+        schedule_id = self.add(datetime.datetime.now())
+        with self.app.app_context():
+            self.assertTrue(self.scheduler.cancel(schedule_id))
+        self.scheduler._fire(schedule_id)
+        self.assertEqual(self.runs, [])
+
+
+class CreateScheduleRequestTest(SchedulerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.register_blueprint(scheduler.create_blueprint(lambda: (None, None), self.scheduler))
+        self.client = self.app.test_client()
+
+    def post(self, data):
+        return self.client.post('/api/schedules', json=data)
+
+    def test_created(self):
+        response = self.post({'delay_minutes': 10})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['action'], 'sleep')
+
+    def test_malformed_bodies_are_rejected(self):
+        for data in ({'days': 5, 'at': '23:00'},
+                     {'action': ['sleep'], 'delay_minutes': 1},
+                     {'action': 5, 'delay_minutes': 1},
+                     {'target': {'group': 'a'}, 'delay_minutes': 1},
+                     {'run_at': '2000-01-01T00:00:00'},
+                     ['sleep']):
+            with self.subTest(data=data):
+                response = self.post(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.get_json())
+
+    def test_target_needs_controller_mode(self):
+        self.assertEqual(self.post({'target': 'office', 'delay_minutes': 1}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
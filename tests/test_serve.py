@@ -0,0 +1,124 @@
+"""
+Tests for the waitress runner's graceful stop.
+
+``run_waitress`` reaches into waitress internals to drain requests, so this
+starts it for real in a child process, with a small WSGI app whose one
+request is still running when SIGTERM arrives.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import shutil
+import tempfile
+import textwrap
+import threading
+import subprocess
+import unittest
+import urllib.request
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SLOW_APP = textwrap.dedent('''
+    import time
+
+    STARTED = {started!r}
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            open(STARTED, 'w').close()
+            # Longer than the 1 second run_waitress gives threads after draining
+            time.sleep(2)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'done']
+''')
+
+RUN_WAITRESS = textwrap.dedent('''
+    import sys
+    sys.path[:0] = [{workdir!r}, {repo!r}]
+    import serve
+    serve.run_waitress('slow_app:app', host='127.0.0.1', port={port}, threads=2, backlog=16,
+                       keepalive=5, graceful_timeout={graceful_timeout}, connection_limit=10)
+''')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.02)
+
+
+def accepting(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+@unittest.skipIf(os.name == 'nt', "sends SIGTERM")
+class WaitressDrainTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='serve-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.started = os.path.join(self.workdir, 'started')
+        with open(os.path.join(self.workdir, 'slow_app.py'), 'w') as f:
+            f.write(SLOW_APP.format(started=self.started))
+        self.port = free_port()
+
+    def start_server(self, graceful_timeout=10):
+        script = RUN_WAITRESS.format(workdir=self.workdir, repo=REPO, port=self.port,
+                                     graceful_timeout=graceful_timeout)
+        process = subprocess.Popen([sys.executable, '-c', script],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(lambda: process.poll() is None and process.kill())
+        wait_for(lambda: accepting(self.port) or process.poll() is not None)
+        self.assertIsNone(process.poll(), "server exited on startup")
+        return process
+
+    def get_in_background(self, path):
+        result = {}
+
+        def get():
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}{path}", timeout=10) as response:
+                    result['status'], result['body'] = response.status, response.read()
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        return thread, result
+
+    def test_in_flight_request_is_answered_before_exit(self):
+        process = self.start_server()
+        thread, result = self.get_in_background('/slow')
+        wait_for(lambda: os.path.exists(self.started))
+
+        process.send_signal(signal.SIGTERM)
+        thread.join(timeout=10)
+
+        self.assertEqual(result, {'status': 200, 'body': b'done'})
+        self.assertEqual(process.wait(timeout=10), 0)
+        self.assertFalse(accepting(self.port))
+
+    def test_idle_server_stops_at_once(self):
+        process = self.start_server()
+        started = time.monotonic()
+        process.send_signal(signal.SIGTERM)
+
+        self.assertEqual(process.wait(timeout=10), 0)
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
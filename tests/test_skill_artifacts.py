@@ -0,0 +1,59 @@
+"""
+Tests for the offline skill artifact generator's output directory handling.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import skill_artifacts
+from lambda_fleet import Host
+
+
+def host(name):
+    return Host(name, 'https://pc.example', 'key')
+
+
+class SafeNameTest(unittest.TestCase):
+    def test_unsafe_characters_are_replaced(self):
+        self.assertEqual(skill_artifacts._safe_name('pc 1/a'), 'pc_1_a')
+        self.assertEqual(skill_artifacts._safe_name('pc.local'), 'pc.local')
+
+    def test_names_without_a_usable_directory_are_rejected(self):
+        for name in ('', '.', '..', '...'):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                skill_artifacts._safe_name(name)
+
+
+class GenerateTest(unittest.TestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp(prefix='skill-artifacts-')
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.output = os.path.join(workdir, 'out')
+
+    def test_colliding_and_invalid_names_fail_before_writing(self):
+        reported = []
+        results = skill_artifacts.generate(
+            [host('pc 1'), host('pc_1'), host('..'), host('pc2')], self.output, 'us-east-1',
+            workers=1, on_result=reported.append)
+
+        by_host = {result['host']: result for result in results}
+        self.assertEqual(len(results), 4)
+        self.assertEqual(reported, results)
+        self.assertTrue(by_host['pc2']['ok'])
+        for name in ('pc 1', 'pc_1', '..'):
+            self.assertFalse(by_host[name]['ok'])
+        self.assertIn("'pc_1'", by_host['pc 1']['error'])
+        self.assertEqual(os.listdir(os.path.dirname(self.output)), ['out'])
+        self.assertEqual(os.listdir(self.output), ['pc2'])
+
+    def test_group_function_cannot_share_a_host_directory(self):
+        results = skill_artifacts.generate(
+            [host('group'), host('pc2')], self.output, 'us-east-1', workers=1, group_function='group')
+
+        self.assertEqual(sorted((result['host'], result['ok']) for result in results),
+                         [('group', False), ('group', False), ('pc2', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+"""
+Tests for the /api/sleep job path (202 with a job ID, then coalescing) and
+the dashboard's long-poll parameters.
+
+The app is imported against a temporary database, history file and metrics
+directory. Each test swaps in its own JobExecutor whose sleep action is a
+PowerController over FakeBackends, so nothing is suspended.
+"""
+import os
+import atexit
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from power_backends import FakeBackend, PowerController
+
+app_module = None
+_workdir = None
+
+AUTH = {'Authorization': 'Basic YWRtaW46YWRtaW4='}  # admin:admin
+
+
+def setUpModule():
+    global app_module, _workdir
+    _workdir = tempfile.mkdtemp(prefix='sleep-jobs-')
+    # Registered first, so it runs after the app's own exit hooks (logs, metrics)
+    atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+    environment = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+        'API_KEYS_FILE': os.path.join(_workdir, 'api_keys.json'),
+        'SLEEP_HISTORY_FILE': os.path.join(_workdir, 'sleep_history.ring'),
+        'METRICS_DIR': os.path.join(_workdir, 'metrics'),
+        'ADMIN_USERNAME': 'admin',
+        'ADMIN_PASSWORD': 'admin',
+        'SLEEP_BACKENDS': 'simulated',
+    }
+    patcher = mock.patch.dict(os.environ, environment)
+    patcher.start()
+
+    import logging_setup
+    logging_setup.configure_logging(log_file=os.path.join(_workdir, 'app.log'),
+                                    events_file=os.path.join(_workdir, 'events.log'),
+                                    level='WARNING')
+    import app
+    app_module = app
+
+
+def tearDownModule():
+    mock.patch.stopall()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class BlockingBackend(FakeBackend):
+    """FakeBackend whose suspend() waits until the test releases it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def suspend(self):
+        self.started.set()
+        self.release.wait(timeout=10)
+        return super().suspend()
+
+
+class SleepJobTest(unittest.TestCase):
+    def use_backends(self, *backends, coalesce_window=0.0):
+        controller = PowerController(backends)
+        executor = app_module.jobs.JobExecutor(
+            app_module.app,
+            actions={'sleep': controller.trigger},
+            on_finished=app_module.record_finished_job,
+            on_coalesced=app_module.record_coalesced_request,
+            coalesce_window=coalesce_window
+        )
+        patcher = mock.patch.object(app_module, 'job_executor', executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def post_sleep(self):
+        return app_module.app.test_client().post('/api/sleep', headers=AUTH)
+
+    def job(self, job_id):
+        response = app_module.app.test_client().get(f"/api/jobs/{job_id}", headers=AUTH)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def wait_finished(self, job_id):
+        wait_for(lambda: self.job(job_id)['finished'] is not None)
+        return self.job(job_id)
+
+    def test_returns_202_with_job_id(self):
+        backend = FakeBackend()
+        self.use_backends(backend)
+
+        response = self.post_sleep()
+        self.assertEqual(response.status_code, 202)
+        body = response.get_json()
+        self.assertTrue(body['job_id'])
+        self.assertEqual(response.headers['Location'], body['status_url'])
+        self.assertEqual(body['status_url'], f"/api/jobs/{body['job_id']}")
+
+        job = self.wait_finished(body['job_id'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['message'], 'fake sleep')
+        self.assertEqual(backend.calls, 1)
+
+    def test_failed_backends_fail_the_job(self):
+        self.use_backends(FakeBackend('broken', succeed=False))
+
+        job_id = self.post_sleep().get_json()['job_id']
+        self.assertEqual(self.wait_finished(job_id)['status'], 'failed')
+
+    def test_unknown_job(self):
+        self.use_backends(FakeBackend())
+        response = app_module.app.test_client().get('/api/jobs/missing', headers=AUTH)
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_authentication(self):
+        backend = FakeBackend()
+        self.use_backends(backend)
+
+        response = app_module.app.test_client().post('/api/sleep')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(backend.calls, 0)
+
+    def test_concurrent_requests_share_one_job(self):
+        backend = BlockingBackend()
+        self.use_backends(backend)
+
+        first = self.post_sleep().get_json()['job_id']
+        self.assertTrue(backend.started.wait(timeout=10))
+
+        job_ids = []
+        threads = [threading.Thread(target=lambda: job_ids.append(self.post_sleep().get_json()['job_id']))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        backend.release.set()
+
+        self.assertEqual(job_ids, [first] * 5)
+        self.assertEqual(self.wait_finished(first)['status'], 'succeeded')
+        self.assertEqual(backend.calls, 1)
+
+    def test_burst_after_finish_reuses_the_job(self):
+        backend = FakeBackend()
+        self.use_backends(backend, coalesce_window=60)
+
+        first = self.post_sleep().get_json()['job_id']
+        self.wait_finished(first)
+        burst = [self.post_sleep() for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in burst], [202] * 3)
+        self.assertEqual([response.get_json()['job_id'] for response in burst], [first] * 3)
+        self.assertEqual(backend.calls, 1)
+
+    def test_request_after_window_starts_a_new_job(self):
+        backend = FakeBackend()
+        self.use_backends(backend, coalesce_window=0.0)
+
+        first = self.post_sleep().get_json()['job_id']
+        self.wait_finished(first)
+        second = self.post_sleep().get_json()['job_id']
+
+        self.assertNotEqual(second, first)
+        self.wait_finished(second)
+        self.assertEqual(backend.calls, 2)
+
+    def test_coalesced_requests_are_recorded(self):
+        backend = BlockingBackend()
+        self.use_backends(backend)
+
+        def recorded():
+            with app_module.app.app_context():
+                return len(app_module.database.recent_sleep_events(limit=1000))
+        before = recorded()
+
+        first = self.post_sleep().get_json()['job_id']
+        self.assertTrue(backend.started.wait(timeout=10))
+        self.post_sleep()
+        self.post_sleep()
+        backend.release.set()
+        self.wait_finished(first)
+        wait_for(lambda: recorded() - before == 3)
+
+
+class PollWaitTest(unittest.TestCase):
+    def wait_for_query(self, query):
+        with app_module.app.test_request_context(f"/events/poll{query}"):
+            return app_module.poll_wait()
+
+    def test_default(self):
+        self.assertEqual(self.wait_for_query(''), app_module.POLL_WAIT_DEFAULT)
+
+    def test_unparseable_values_fall_back_to_the_default(self):
+        for query in ('?wait=abc', '?wait=', '?wait=nan', '?wait=NaN'):
+            with self.subTest(query=query):
+                self.assertEqual(self.wait_for_query(query), app_module.POLL_WAIT_DEFAULT)
+
+    def test_clamped_to_a_finite_range(self):
+        self.assertEqual(self.wait_for_query('?wait=5'), 5.0)
+        self.assertEqual(self.wait_for_query('?wait=1e9'), app_module.POLL_WAIT_MAX)
+        self.assertEqual(self.wait_for_query('?wait=inf'), app_module.POLL_WAIT_MAX)
+        self.assertEqual(self.wait_for_query('?wait=-3'), 0.0)
+        self.assertEqual(self.wait_for_query('?wait=-inf'), 0.0)
+
+    def test_poll_with_bad_wait_is_not_an_error(self):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['logged_in'] = True
+        # Falls back to the default wait, shortened here so the test does not block
+        with mock.patch.object(app_module, 'POLL_WAIT_DEFAULT', 0.0):
+            response = client.get('/events/poll?wait=abc')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('events', response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
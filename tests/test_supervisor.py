@@ -0,0 +1,167 @@
+"""
+Tests for the supervisor's restart loop, with short-lived stand-in children.
+
+The children are small ``python -c`` commands, so no server is started; the
+timings are scaled down to fractions of a second.
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import supervisor
+from supervisor import ProcessSupervisor
+
+# Exits at once with an error, like a server that crashes on startup
+CRASHING_CHILD = [sys.executable, '-c', 'import sys; sys.exit(3)']
+# Runs until it is stopped, like a hung server
+HUNG_CHILD = [sys.executable, '-c', 'import time; time.sleep(60)']
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def make_supervisor(command, **options):
+    settings = dict(output_log=None, backoff_initial=0.05, backoff_max=0.2,
+                    stable_after=60, stop_timeout=5)
+    settings.update(options)
+    return ProcessSupervisor(command, **settings)
+
+
+class RestartLoopTest(unittest.TestCase):
+    def run_until(self, sup, restarts):
+        with self.assertLogs('supervisor', level='INFO') as logs:
+            sup.start()
+            try:
+                wait_for(lambda: sup.restarts >= restarts)
+            finally:
+                sup.stop(timeout=10)
+        self.assertFalse(sup._thread.is_alive())
+        self.output = logs.output
+        return [float(match.group(1)) for match in
+                (re.search(r'Restarting server in ([\d.]+)s', line) for line in logs.output) if match]
+
+    def test_crashing_child_is_restarted_with_exponential_backoff(self):
+        sup = make_supervisor(CRASHING_CHILD)
+        delays = self.run_until(sup, 4)
+
+        self.assertEqual(delays[:4], [0.05, 0.1, 0.2, 0.2])
+        self.assertIn('Server exited with code 3', '\n'.join(self.output))
+
+    def test_backoff_resets_after_a_stable_run(self):
+        sup = make_supervisor(CRASHING_CHILD, stable_after=0)
+        delays = self.run_until(sup, 3)
+
+        self.assertTrue(delays)
+        self.assertEqual(set(delays), {0.05})
+
+    def test_unresponsive_child_is_killed_and_restarted(self):
+        probes = []
+
+        def probe(url, timeout):
+            probes.append(url)
+            return False
+
+        sup = make_supervisor(HUNG_CHILD, health_url='http://127.0.0.1:1/status', probe=probe,
+                              health_interval=0.02, health_failures=2, startup_grace=0)
+        first = None
+        with self.assertLogs('supervisor', level='INFO'):
+            sup.start()
+            try:
+                wait_for(lambda: sup.process is not None)
+                first = sup.process
+                wait_for(lambda: sup.restarts >= 1)
+            finally:
+                sup.stop(timeout=10)
+
+        self.assertIsNotNone(first.poll())
+        self.assertGreaterEqual(len(probes), 2)
+        self.assertEqual(set(probes), {'http://127.0.0.1:1/status'})
+
+    def test_stop_terminates_a_running_child(self):
+        sup = make_supervisor(HUNG_CHILD)
+        with self.assertLogs('supervisor', level='INFO'):
+            sup.start()
+            wait_for(lambda: sup.process is not None)
+            sup.stop(timeout=10)
+
+        self.assertIsNotNone(sup.process.poll())
+        self.assertEqual(sup.restarts, 0)
+
+
+class TerminateTest(unittest.TestCase):
+    @unittest.skipIf(os.name == 'nt', 'SIGTERM is not catchable on Windows')
+    def test_child_ignoring_the_stop_request_is_killed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        ready = os.path.join(directory, 'ready')
+        child = [sys.executable, '-c',
+                 'import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                 'open(sys.argv[1], "w").close(); time.sleep(60)', ready]
+        sup = make_supervisor(child, stop_timeout=0.2)
+        with self.assertLogs('supervisor', level='INFO') as logs:
+            process = sup._spawn()
+            wait_for(lambda: os.path.exists(ready))
+            started = time.monotonic()
+            sup._terminate(process)
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(process.returncode, -9)
+        self.assertIn('did not exit, killing it', '\n'.join(logs.output))
+
+    def test_windows_child_gets_ctrl_break_in_its_own_process_group(self):
+        process = mock.Mock(pid=1234)
+        process.poll.return_value = None
+        sup = make_supervisor(HUNG_CHILD)
+        with mock.patch.object(supervisor.os, 'name', 'nt'), \
+                mock.patch.object(supervisor.signal, 'CTRL_BREAK_EVENT', 1, create=True), \
+                mock.patch.object(supervisor.subprocess, 'CREATE_NEW_PROCESS_GROUP', 0x200, create=True), \
+                mock.patch.object(supervisor, '_attach_console') as attach, \
+                mock.patch.object(supervisor.subprocess, 'Popen', return_value=process) as popen, \
+                mock.patch.object(supervisor.threading, 'Thread'), \
+                self.assertLogs('supervisor', level='INFO'):
+            sup._spawn()
+            sup._terminate(process)
+
+        attach.assert_called_once_with()
+        self.assertEqual(popen.call_args.kwargs['creationflags'] & 0x200, 0x200)
+        process.send_signal.assert_called_once_with(1)
+        process.terminate.assert_not_called()
+        process.kill.assert_not_called()
+
+
+class HealthUrlTest(unittest.TestCase):
+    def health_url(self, **env):
+        with mock.patch.dict(os.environ, env):
+            for name in ('SERVER_HOST', 'SERVER_PORT'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return supervisor.default_health_url()
+
+    def test_default_port(self):
+        self.assertEqual(self.health_url(), 'http://127.0.0.1:5000/status')
+
+    def test_follows_server_port_and_host(self):
+        self.assertEqual(self.health_url(SERVER_PORT='8080'), 'http://127.0.0.1:8080/status')
+        self.assertEqual(self.health_url(SERVER_HOST='192.168.1.5', SERVER_PORT='8080'),
+                         'http://192.168.1.5:8080/status')
+        self.assertEqual(self.health_url(SERVER_HOST='::'), 'http://[::1]:5000/status')
+
+    def test_from_environment_uses_it(self):
+        with mock.patch.dict(os.environ, {'SERVER_PORT': '8123'}):
+            os.environ.pop('SUPERVISOR_HEALTH_URL', None)
+            sup = supervisor.from_environment(CRASHING_CHILD, output_log=None)
+        self.assertEqual(sup.health_url, 'http://127.0.0.1:8123/status')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ import win32serviceutil
 import win32service
 import win32event
 import servicemanager
-import subprocess
+import supervisor
 
 # Configure logging
 logging.basicConfig(
@@ -26,13 +26,12 @@ class AlexaSleepService(win32serviceutil.ServiceFramework):
     def __init__(self, args):
         win32serviceutil.ServiceFramework.__init__(self, args)
         self.stop_event = win32event.CreateEvent(None, 0, 0, None)
-        self.is_alive = True
         
         # Get the directory of the service script
         self.base_dir = os.path.abspath(os.path.dirname(__file__))
         
-        # Process ID for the server process
-        self.process = None
+        # Supervisor that runs and restarts the server process
+        self.supervisor = None
         
         socket.setdefaulttimeout(60)
         
@@ -41,15 +40,6 @@ class AlexaSleepService(win32serviceutil.ServiceFramework):
         logger.info("Stopping service...")
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
         win32event.SetEvent(self.stop_event)
-        self.is_alive = False
-        
-        # Terminate the server process if it's running
-        if self.process:
-            try:
-                self.process.terminate()
-                logger.info("Server process terminated")
-            except Exception as e:
-                logger.error(f"Error terminating server process: {e}")
 
     def SvcDoRun(self):
         """Run the service"""
@@ -74,51 +64,25 @@ class AlexaSleepService(win32serviceutil.ServiceFramework):
             return
         
         try:
-            # Get Python interpreter path
-            python_exe = sys.executable
-            
-            # Start the server as a subprocess
-            logger.info(f"Starting server with {python_exe} {main_script}")
-            self.process = subprocess.Popen(
-                [python_exe, main_script],
-                cwd=self.base_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NO_WINDOW
+            # Output draining, restarts with backoff and health checks are
+            # handled by the supervisor; the service only starts and stops it
+            # The child shares the supervisor's hidden console (no
+            # CREATE_NO_WINDOW), so it can be stopped with Ctrl-Break
+            self.supervisor = supervisor.from_environment(
+                [sys.executable, main_script],
+                cwd=self.base_dir
             )
-            
-            logger.info(f"Server started with PID: {self.process.pid}")
+            self.supervisor.start()
             
             # Wait for the service to be stopped
-            while self.is_alive:
-                # Check if the process is still running
-                if self.process.poll() is not None:
-                    logger.error(f"Server process exited unexpectedly with code: {self.process.returncode}")
-                    # Log stderr output from the process
-                    error_output = self.process.stderr.read().decode('utf-8', errors='ignore')
-                    logger.error(f"Server error output: {error_output}")
-                    
-                    # Restart the server
-                    logger.info("Attempting to restart server...")
-                    self.process = subprocess.Popen(
-                        [python_exe, main_script],
-                        cwd=self.base_dir,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                    logger.info(f"Server restarted with PID: {self.process.pid}")
-                
-                # Wait for stop event or check again in 10 seconds
-                rc = win32event.WaitForSingleObject(self.stop_event, 10000)
-                if rc == win32event.WAIT_OBJECT_0:
-                    # Stop event triggered
-                    break
-            
+            win32event.WaitForSingleObject(self.stop_event, win32event.INFINITE)
             logger.info("Service stop event received")
             
         except Exception as e:
             logger.exception(f"Error in service main loop: {e}")
+        finally:
+            if self.supervisor:
+                self.supervisor.stop()
 
 
 if __name__ == '__main__':